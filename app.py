@@ -1,34 +1,70 @@
 from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 import configparser
 import os
 from dotenv import load_dotenv, set_key
+from fastapi.concurrency import run_in_threadpool
 from utils.helper import (
     DataHandler,
+    IndexBuildInProgress,
     remove_directory,
+    config_store,
+    prompt_store,
+    store_registry,
+    answer_cache,
+    question_condenser,
+    context_packer,
+    reranker_service,
+    rerank_by_default,
+    rerank_preload,
     encode_kwargs,
     model_kwargs,
+    project_dir,
+    vectorstore_dir,
 )
-import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 import ast 
+import json
+import threading
+import time
 from qa_model_apis import (
     get_chat_model,
     get_embedding_model,
+    get_embedding_cache_stats,
 )
 from utils.codegraph import (
     parse_python_code,
     read_current_repo_path,
-    build_file_tree,
 )
+from utils.dir_tree import DirectoryTree, parse_patterns
+
+from utils.codegraph_index import indexed_graph, repo_codegraph_index
 
 from utils.go_codegraph import(
     parse_go_code,
-    go_build_file_tree,
+    go_parser,
+)
+from utils.ingest_jobs import IngestJobManager
+from utils.embedding_writer import has_checkpoint
+from utils.index_manifest import manifest_path
+from utils.db_pool import DatabasePool
+from utils.model_pool import ModelPool, model_key, parse_model_list
+from utils.metrics import (
+    registry,
+    configure_logging,
+    logger,
+    span,
+    set_trace_id,
+    trace_id_var,
+    http_request_seconds,
+    http_requests_in_flight,
 )
 
+configure_logging()
+
 app = FastAPI()
 
 app.add_middleware(
@@ -39,19 +75,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-config_path = os.path.join('config', 'config.ini')
-prompt_templates_path = os.path.join('config', 'prompt_templates.ini')
-config = configparser.ConfigParser()
-config.read(config_path)
+config = config_store.snapshot()
 
 templates = Jinja2Templates(directory="templates")
 
+# background ingestion of the repositories
+ingest_jobs = IngestJobManager(max_concurrent=config.getint('ingest_setting', 'max_concurrent_jobs', fallback=1))
+
 DB_NAME = config['database']['db_name']
 DB_USER = config['database']['db_user']
 DB_PASSWORD = config['database']['db_password']
 DB_HOST = config['database']['db_host']
 DB_PORT = config['database']['db_port']
 
+# shared connections, opened at startup and closed at shutdown
+db_pool = DatabasePool(
+    min_size=config.getint('database', 'pool_min_size', fallback=1),
+    max_size=config.getint('database', 'pool_max_size', fallback=10),
+    health_check_interval=config.getint('database', 'health_check_interval', fallback=30),
+    dbname=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    host=DB_HOST,
+    port=DB_PORT
+)
+
+# the upper bounds of a /callgraph answer
+callgraph_max_hops = config.getint('codegraph_setting', 'max_hops', fallback=3)
+callgraph_max_nodes = config.getint('codegraph_setting', 'max_nodes', fallback=200)
+callgraph_max_edges = config.getint('codegraph_setting', 'max_edges', fallback=600)
+
+# the file trees of the code graph pages, the directory listings stay cached until they change
+tree_ignore = parse_patterns(config.get('directory_tree', 'ignore', fallback='')) or None
+tree_page_size = config.getint('directory_tree', 'page_size', fallback=200)
+tree_max_repos = config.getint('directory_tree', 'max_repos', fallback=8)
+python_tree = DirectoryTree(['.py'], ignore=tree_ignore, page_size=tree_page_size, max_repos=tree_max_repos)
+go_tree = DirectoryTree(['.go'], ignore=tree_ignore, page_size=tree_page_size, max_repos=tree_max_repos)
+
 # for analyse code
 current_session = None
 
@@ -61,18 +121,12 @@ current_model_info = {
     "eb_provider": None,
     "eb_model": None,
     "chat_model": None,
-    "embedding_model": None
+    "embedding_model": None,
+    "condense": None,
+    "condense_model": None
 }
 
-def init_db():
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    cursor = conn.cursor()
+def init_db(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS sessions (
             id BIGINT PRIMARY KEY,
@@ -80,21 +134,74 @@ def init_db():
             url TEXT NOT NULL
         )
     ''')
-    conn.commit()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id BIGSERIAL PRIMARY KEY,
+            session_id BIGINT NOT NULL,
+            sender TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS messages_session_id_id ON messages (session_id, id)')
+    migrate_session_tables(cursor)
     # fix the first time to set the session
     cursor.execute('SELECT id, name, url FROM sessions LIMIT 1')
     session = cursor.fetchone()
     if session:
         global current_session
         current_session = {'id': session[0], 'name': session[1], 'url': session[2]}
-        print("Default session set to:", current_session)
-    conn.close()
+        logger.info(f"Default session set to: {current_session}")
+
+# move the messages of the old per-session tables into the messages table
+def migrate_session_tables(cursor):
+    cursor.execute('''
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = current_schema() AND table_name ~ '^session_[0-9]+$'
+    ''')
+    for (table,) in cursor.fetchall():
+        session_id = int(table[len('session_'):])
+        cursor.execute(sql.SQL('''
+            INSERT INTO messages (session_id, sender, text)
+            SELECT %s, sender, text FROM {} ORDER BY id
+        ''').format(sql.Identifier(table)), (session_id,))
+        logger.info(f"Migrated {cursor.rowcount} messages of {table}")
+        cursor.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(table)))
+
+# the chat and embedding models stay loaded, switching back to one of them is free
+model_pool = ModelPool(
+    max_models=config.getint('model_pool', 'max_models', fallback=4),
+    max_memory_mb=config.getfloat('model_pool', 'max_memory_mb', fallback=0),
+)
+
+def chat_model_key(provider, model_name):
+    return model_key('chat', provider, model_name)
+
+def embedding_model_key(provider, model_name):
+    return model_key('embedding', provider, model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
+
+def pooled_chat_model(provider, model_name):
+    return model_pool.get_or_load(chat_model_key(provider, model_name),
+                                  lambda: get_chat_model(provider, model_name))
+
+def pooled_embedding_model(provider, model_name):
+    return model_pool.get_or_load(embedding_model_key(provider, model_name),
+                                  lambda: get_embedding_model(provider, model_name, model_kwargs, encode_kwargs))
 
 def load_models_if_needed():
+    config = config_store.snapshot()
     selected_provider = config.get('model_providers', 'selected_provider')
     selected_model = config.get(f"{selected_provider}_llm_models", 'selected_model')
     eb_selected_provider = config.get('embedding_model_providers', 'selected_provider')
     eb_selected_model = config.get(f"{eb_selected_provider}_embedding_models", 'selected_model')
+    # an optional smaller chat model for condensing the follow-up questions
+    condense = (config.get('condense_setting', 'provider', fallback=''),
+                config.get('condense_setting', 'model', fallback=''))
+    # the models current_model_info holds stay in the pool, evicting them would free nothing; set
+    # before the loads so a model loaded first is not evicted by the next one
+    model_pool.set_active([chat_model_key(selected_provider, selected_model),
+                           embedding_model_key(eb_selected_provider, eb_selected_model),
+                           chat_model_key(*condense) if all(condense) else None])
     
     if (current_model_info["provider"] != selected_provider or 
         current_model_info["model"] != selected_model or 
@@ -105,64 +212,53 @@ def load_models_if_needed():
         current_model_info["model"] = selected_model
         current_model_info["eb_provider"] = eb_selected_provider
         current_model_info["eb_model"] = eb_selected_model
-        current_model_info["chat_model"] = get_chat_model(selected_provider, selected_model)
-        current_model_info["embedding_model"] = get_embedding_model(eb_selected_provider, eb_selected_model, model_kwargs, encode_kwargs)
-        print(f"Loaded new models: provider={selected_provider}, model={selected_model}")
+        current_model_info["chat_model"] = pooled_chat_model(selected_provider, selected_model)
+        current_model_info["embedding_model"] = pooled_embedding_model(eb_selected_provider, eb_selected_model)
+        logger.info(f"Switched models: provider={selected_provider}, model={selected_model}")
+
+    if current_model_info["condense"] != condense:
+        current_model_info["condense"] = condense
+        current_model_info["condense_model"] = pooled_chat_model(*condense) if all(condense) else None
+        if all(condense):
+            logger.info(f"Loaded condense model: provider={condense[0]}, model={condense[1]}")
     
-    print(f"Loaded models: provider={selected_provider}, model={selected_model}")
-
-def create_message_table(session_id):
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    cursor = conn.cursor()
-    table_name = sql.Identifier(f'session_{session_id}')
-    cursor.execute(sql.SQL('''
-        CREATE TABLE IF NOT EXISTS {} (
-            id BIGSERIAL PRIMARY KEY,
-            sender TEXT NOT NULL,
-            text TEXT NOT NULL
-        )
-    ''').format(table_name))
-    conn.commit()
-    conn.close()
+    logger.info(f"Loaded models: provider={selected_provider}, model={selected_model}")
+
+def save_chat_messages(cursor, session_id, user_message, bot_response):
+    # Save user message and bot response of the session
+    with span('db_write'):
+        cursor.execute('INSERT INTO messages (session_id, sender, text) VALUES (%s, %s, %s), (%s, %s, %s)',
+                       (session_id, 'You', user_message, session_id, 'QA-Pilot', bot_response))
 
-init_db()
+@app.on_event("startup")
+async def open_db_pool():
+    db_pool.open()
+    await db_pool.run(init_db)
 
-def load_config():
-    config.read(config_path)
-    return config
+@app.on_event("shutdown")
+def close_db_pool():
+    db_pool.close()
+
+@app.get('/db_pool_stats')
+async def db_pool_stats():
+    return JSONResponse(content=db_pool.stats())
 
 @app.get('/get_config')
 async def get_config():
-    config = load_config()
-    config_dict = {section: dict(config.items(section)) for section in config.sections()}
-    return JSONResponse(content=config_dict)
+    return JSONResponse(content=config_store.snapshot().as_dict())
 
+# the writes replace the file atomically, one at a time
 @app.post('/save_config')
 async def save_config(request: Request):
     new_config = await request.json()
-    config = load_config()
-    for section, section_values in new_config.items():
-        if not config.has_section(section):
-            config.add_section(section)
-        for key, value in section_values.items():
-            config.set(section, key, value)
-    with open(config_path, 'w') as configfile:
-        config.write(configfile)
+    config_store.update(new_config)
     return JSONResponse(content={"message": "Configuration saved successfully!"})
 
 @app.post('/update_provider')
 async def update_provider(request: Request):
     data = await request.json()
     selected_provider = data.get('selected_provider')
-    config.set('model_providers', 'selected_provider', selected_provider)
-    with open(config_path, 'w') as configfile:
-        config.write(configfile)
+    config_store.update({'model_providers': {'selected_provider': selected_provider}})
     return JSONResponse(content={"message": "Provider updated successfully!"})
 
 @app.post('/update_model')
@@ -170,28 +266,233 @@ async def update_model(request: Request):
     data = await request.json()
     selected_provider = data.get('selected_provider')
     selected_model = data.get('selected_model')
-    config.set(f'{selected_provider}_llm_models', 'selected_model', selected_model)
-    with open(config_path, 'w') as configfile:
-        config.write(configfile)
+    config_store.update({f'{selected_provider}_llm_models': {'selected_model': selected_model}})
     return JSONResponse(content={"message": "Model updated successfully!"})
 
+@app.get('/config_stats')
+async def config_stats():
+    return JSONResponse(content={'config': config_store.stats(), 'prompt_templates': prompt_store.stats()})
+
+def repo_name_of(git_url):
+    return git_url.split('/')[-1].rsplit('.', 1)[0]
+
+# only the ingestion job builds or resumes an index, a chat on it fails fast meanwhile; an incremental
+# refresh (the index has a manifest to diff against) keeps the old index usable until it is done
+def check_index_available(current_repo):
+    repo_name = repo_name_of(current_repo)
+    db_dir = os.path.join(vectorstore_dir, repo_name)
+    job = ingest_jobs.active(repo_name)
+    if job is not None and not (job.kind == 'refresh' and os.path.exists(manifest_path(db_dir))):
+        raise HTTPException(status_code=409, detail=f"The index of {repo_name} is being built, see /jobs/{job.id}")
+    if has_checkpoint(db_dir):
+        raise HTTPException(status_code=503, detail=f"The index build of {repo_name} was interrupted, "
+                                                    f"load the repository again to resume it")
+
+def submit_ingest_job(git_url, kind):
+    def run(job):
+        load_models_if_needed()
+        chat_model = current_model_info["chat_model"]
+        embedding_model = current_model_info["embedding_model"]
+        data_handler = DataHandler(git_url, chat_model, embedding_model)
+        data_handler.progress_callback = job.update_stage
+        data_handler.git_clone_repo()
+        result = None
+        if kind == 'refresh':
+            result = data_handler.refresh_db()
+        else:
+            data_handler.load_into_db(resume=True)
+        # the file counts of the directory listings, summed here instead of by the first listing
+        for tree in (python_tree, go_tree):
+            tree.build(data_handler.download_path)
+        return result
+
+    repo_name = repo_name_of(git_url)
+    job, created = ingest_jobs.submit(repo_name, git_url, run, kind=kind)
+    content = job.to_dict()
+    content["message"] = f"Repository {git_url} {'queued' if created else 'is already being processed'}"
+    return JSONResponse(content=content, status_code=202)
+
 @app.post('/load_repo')
 async def load_repo(request: Request):
     data = await request.json()
     git_url = data.get('git_url')
     if not git_url:
         raise HTTPException(status_code=400, detail="Git URL is required")
+    return submit_ingest_job(git_url, 'load')
 
-    load_models_if_needed()
-    chat_model = current_model_info["chat_model"]
-    embedding_model = current_model_info["embedding_model"]
-    data_handler = DataHandler(git_url, chat_model, embedding_model)
+@app.post('/refresh_repo')
+async def refresh_repo(request: Request):
+    data = await request.json()
+    git_url = data.get('git_url')
+    if not git_url:
+        raise HTTPException(status_code=400, detail="Git URL is required")
+    return submit_ingest_job(git_url, 'refresh')
+
+@app.get('/jobs')
+async def list_jobs():
+    return JSONResponse(content=ingest_jobs.list())
+
+@app.get('/jobs/{job_id}')
+async def get_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=job.to_dict())
+
+@app.delete('/jobs/{job_id}')
+async def cancel_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not ingest_jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}, only queued jobs can be cancelled")
+    return JSONResponse(content={"message": "Job cancelled successfully!"})
+
+@app.on_event("shutdown")
+def shutdown_ingest_jobs():
+    ingest_jobs.shutdown()
+
+@app.on_event("shutdown")
+def save_answer_cache():
+    answer_cache.save()
+
+@app.on_event("shutdown")
+def stop_go_parser():
+    go_parser.close()
+
+@app.get('/embedding_cache_stats')
+async def embedding_cache_stats():
+    return JSONResponse(content=get_embedding_cache_stats())
+
+@app.get('/vectorstore_registry_stats')
+async def vectorstore_registry_stats():
+    return JSONResponse(content=store_registry.stats())
+
+@app.get('/answer_cache_stats')
+async def answer_cache_stats():
+    return JSONResponse(content=answer_cache.stats())
+
+@app.get('/context_packer_stats')
+async def context_packer_stats():
+    return JSONResponse(content=context_packer.stats())
+
+@app.on_event("startup")
+def preload_reranker():
+    # load it in the background, the first reranked question should not pay for it
+    if rerank_preload:
+        threading.Thread(target=reranker_service.load, name='reranker-preload', daemon=True).start()
+
+@app.on_event("startup")
+def preload_models():
+    # the configured models are loaded and warmed in the background, the server starts right away
+    config = config_store.snapshot()
+    warm = config.getboolean('model_pool', 'warm', fallback=True)
+
+    def warm_chat(model):
+        if hasattr(model, 'complete'):
+            model.complete("Hello")
+        else:
+            model.invoke("Hello")
+
+    def preload():
+        if config.getboolean('model_pool', 'preload_selected', fallback=True):
+            load_models_if_needed()
+        for provider, model_name in parse_model_list(config.get('model_pool', 'preload_chat', fallback='')):
+            model_pool.warm(chat_model_key(provider, model_name),
+                            lambda: get_chat_model(provider, model_name), warm_chat if warm else None)
+        for provider, model_name in parse_model_list(config.get('model_pool', 'preload_embedding', fallback='')):
+            model_pool.warm(embedding_model_key(provider, model_name),
+                            lambda: get_embedding_model(provider, model_name, model_kwargs, encode_kwargs),
+                            (lambda model: model.embed_query("warmup")) if warm else None)
+
+    threading.Thread(target=preload, name='model-preload', daemon=True).start()
+
+@app.get('/model_pool_stats')
+async def model_pool_stats():
+    return JSONResponse(content=model_pool.stats())
+
+@app.get('/reranker_stats')
+async def reranker_stats():
+    return JSONResponse(content=reranker_service.stats())
+
+@app.get('/condense_stats')
+async def condense_stats():
+    return JSONResponse(content=question_condenser.stats())
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # a client supplied X-Trace-ID is kept, so the logs can be matched with the caller's
+    token = set_trace_id(request.headers.get('x-trace-id'))
+    method = request.method
+    http_requests_in_flight.inc(method=method)
+    started = time.perf_counter()
+    status = 500
     try:
-        data_handler.git_clone_repo()
-        data_handler.load_into_db()
-        return JSONResponse(content={"message": f"Repository {git_url} loaded successfully!"})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        response = await call_next(request)
+        status = response.status_code
+        response.headers['X-Trace-ID'] = trace_id_var.get()
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        http_requests_in_flight.dec(method=method)
+        route = request.scope.get('route')
+        http_request_seconds.observe(elapsed, method=method, route=route.path if route else 'unmatched',
+                                     status=status)
+        logger.info(f"{method} {request.url.path} {status} {elapsed * 1000:.1f} ms")
+        trace_id_var.reset(token)
+
+# the counters owned by the caches and pools, read on every scrape
+def component_metrics():
+    answers = answer_cache.stats()
+    stores = store_registry.stats()
+    embeddings = get_embedding_cache_stats()
+    reranker = reranker_service.stats()
+    condense = question_condenser.stats()
+    pool = db_pool.stats()
+    models = model_pool.stats()
+    jobs = ingest_jobs.list()
+    go_worker = go_parser.stats()
+    packer = context_packer.stats()
+    hit_rate = [({'cache': 'answer'}, answers['hit_rate'])]
+    lookups = [({'cache': 'answer', 'result': 'hit'}, answers['hits']),
+               ({'cache': 'answer', 'result': 'miss'}, answers['misses']),
+               ({'cache': 'vectorstore', 'result': 'hit'}, stores['hits']),
+               ({'cache': 'vectorstore', 'result': 'miss'}, stores['misses'])]
+    store_lookups = stores['hits'] + stores['misses']
+    hit_rate.append(({'cache': 'vectorstore'}, stores['hits'] / store_lookups if store_lookups else 0.0))
+    if embeddings.get('enabled'):
+        hit_rate.append(({'cache': 'embedding'}, embeddings['hit_rate']))
+        lookups += [({'cache': 'embedding', 'result': 'hit'}, embeddings['hits']),
+                    ({'cache': 'embedding', 'result': 'miss'}, embeddings['misses'])]
+    return [
+        ('qa_pilot_cache_hit_rate', 'gauge', 'Hit rate of the caches since the start.', hit_rate),
+        ('qa_pilot_cache_lookups_total', 'counter', 'Cache lookups by result.', lookups),
+        ('qa_pilot_open_vectorstores', 'gauge', 'Vector stores held by the registry.',
+         [({}, len(stores['stores']))]),
+        ('qa_pilot_resident_models', 'gauge', 'Models held by the model pool.',
+         [({'kind': kind}, sum(1 for m in models['models'] if m['kind'] == kind)) for kind in ('chat', 'embedding')]),
+        ('qa_pilot_model_resident_bytes', 'gauge', 'Process memory growth while each pooled model loaded.',
+         [({'kind': m['kind'], 'provider': m['provider'], 'model': m['model']}, m['resident_bytes'])
+          for m in models['models']]),
+        ('qa_pilot_reranker_requests_total', 'counter', 'Reranked questions.', [({}, reranker['requests'])]),
+        ('qa_pilot_condense_turns_total', 'counter', 'Questions by condensing mode.',
+         [({'mode': mode}, condense[mode]) for mode in ('no_history', 'self_contained', 'condensed', 'parallel')]),
+        ('qa_pilot_db_connections_in_use', 'gauge', 'Checked out database connections.', [({}, pool['in_use'])]),
+        ('qa_pilot_ingest_jobs_in_flight', 'gauge', 'Queued and running ingestion jobs.',
+         [({'status': status}, sum(1 for job in jobs if job['status'] == status)) for status in ('queued', 'running')]),
+        ('qa_pilot_context_tokens_total', 'counter', 'Tokens of the retrieved documents and of the packed contexts.',
+         [({'stage': 'retrieved'}, packer['tokens_in']), ({'stage': 'packed'}, packer['tokens_out'])]),
+        ('qa_pilot_go_parser_requests_total', 'counter', 'Files sent to the Go parser worker.',
+         [({}, go_worker['requests'])]),
+        ('qa_pilot_go_parser_restarts_total', 'counter', 'Restarts of the Go parser worker.',
+         [({}, go_worker['restarts'])]),
+    ]
+
+registry.add_collector(component_metrics)
+
+@app.get('/metrics')
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
 
 @app.post('/chat')
 async def chat(request: Request):
@@ -205,94 +506,124 @@ async def chat(request: Request):
     session_id = data.get('session_id')
     if not user_message or not current_repo or not session_id:
         raise HTTPException(status_code=400, detail="Message, current_repo and session_id are required")
+    check_index_available(current_repo)
+
+    rsd = False
+    rr = rerank_by_default
+    # return source documents
+    if user_message.startswith('rsd:'):
+        user_message = user_message[4:].strip()
+        rsd = True
+    # use reranker
+    elif user_message.startswith('rr:'):
+        user_message = user_message[3:].strip()
+        rr = True
+
+    # opening the store and answering block, keep them off the event loop
+    def answer():
+        data_handler = DataHandler(current_repo, chat_model, embedding_model, current_model_info["condense_model"])
+        data_handler.load_into_db()
+        return data_handler.retrieval_qa(user_message, rsd=rsd, rr=rr)
 
     try:
-        data_handler = DataHandler(current_repo, chat_model, embedding_model)
-        data_handler.load_into_db()
-        rsd = False
-        rr = False
-
-        # return source documents
-        if user_message.startswith('rsd:'):
-            user_message = user_message[4:].strip()
-            rsd = True
-        # use reranker
-        elif user_message.startswith('rr:'):
-            user_message = user_message[3:].strip()
-            rr = True
-        bot_response = data_handler.retrieval_qa(user_message, rsd=rsd, rr=rr)
-
-        # Save user message and bot response to the session table
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        cursor = conn.cursor()
-        table_name = sql.Identifier(f'session_{session_id}')
-        cursor.execute(sql.SQL('INSERT INTO {} (sender, text) VALUES (%s, %s)').format(table_name), ('You', user_message))
-        cursor.execute(sql.SQL('INSERT INTO {} (sender, text) VALUES (%s, %s)').format(table_name), ('QA-Pilot', bot_response))
-        conn.commit()
-        conn.close()
+        bot_response = await run_in_threadpool(answer)
+
+        await db_pool.run(save_chat_messages, session_id, user_message, bot_response)
 
         return JSONResponse(content={"response": bot_response})
+    except IndexBuildInProgress as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post('/chat_stream')
+async def chat_stream(request: Request):
+    data = await request.json()
+    user_message = data.get('message')
+    current_repo = data.get('current_repo')
+    session_id = data.get('session_id')
+    if not user_message or not current_repo or not session_id:
+        raise HTTPException(status_code=400, detail="Message, current_repo and session_id are required")
+    check_index_available(current_repo)
+
+    # a sync generator, starlette runs it in the threadpool
+    def events():
+        message = user_message
+        try:
+            load_models_if_needed()
+            data_handler = DataHandler(current_repo, current_model_info["chat_model"], current_model_info["embedding_model"],
+                                       current_model_info["condense_model"])
+            data_handler.load_into_db()
+            if message.startswith('rsd:'):
+                # the source documents are not generated, send them as one chunk
+                message = message[4:].strip()
+                bot_response = data_handler.retrieval_qa(message, rsd=True)
+                yield sse_event("token", bot_response)
+            else:
+                rr = rerank_by_default
+                if message.startswith('rr:'):
+                    message = message[3:].strip()
+                    rr = True
+                bot_response = ""
+                for event, payload in data_handler.stream_retrieval_qa(message, rr=rr):
+                    if event == "done":
+                        bot_response = payload
+                    else:
+                        yield sse_event(event, payload)
+            db_pool.run_sync(save_chat_messages, session_id, message, bot_response)
+            yield sse_event("done", {"response": bot_response})
+        except Exception as e:
+            logger.error(f"Error streaming the chat answer: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def fetch_sessions(cursor):
+    cursor.execute('SELECT id, name, url FROM sessions')
+    return [{'id': row[0], 'name': row[1], 'url': row[2]} for row in cursor.fetchall()]
+
 @app.get('/sessions')
 async def get_sessions():
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, url FROM sessions')
-    sessions = [{'id': row[0], 'name': row[1], 'url': row[2]} for row in cursor.fetchall()]
-    conn.close()
-    print(f"Fetched sessions from DB: {sessions}")
+    sessions = await db_pool.run(fetch_sessions)
+    logger.debug(f"Fetched sessions from DB: {sessions}")
     return JSONResponse(content=sessions)
 
+def upsert_sessions(cursor, sessions):
+    if not sessions:
+        return
+    execute_values(cursor,
+                   'INSERT INTO sessions (id, name, url) VALUES %s ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, url = EXCLUDED.url',
+                   # one row per id, a statement cannot update the same row twice
+                   list({session['id']: (session['id'], session['name'], session['url']) for session in sessions}.values()))
+
 @app.post('/sessions')
 async def save_sessions(request: Request):
     sessions = await request.json()
-    print(f"Received sessions to save: {sessions}")
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    cursor = conn.cursor()
-    for session in sessions:
-        cursor.execute('INSERT INTO sessions (id, name, url) VALUES (%s, %s, %s) ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, url = EXCLUDED.url',
-                       (session['id'], session['name'], session['url']))
-        create_message_table(session['id'])
-    conn.commit()
-    conn.close()
-    print("Saved sessions to DB")
+    logger.debug(f"Received sessions to save: {sessions}")
+    await db_pool.run(upsert_sessions, sessions)
+    logger.info("Saved sessions to DB")
     return JSONResponse(content={"message": "Sessions saved successfully!"})
 
+def fetch_messages(cursor, session_id, before_id, limit):
+    # keyset pagination on (session_id, id), newest page first
+    if before_id is None:
+        cursor.execute('SELECT id, sender, text, created_at FROM messages WHERE session_id = %s ORDER BY id DESC LIMIT %s',
+                       (session_id, limit))
+    else:
+        cursor.execute('SELECT id, sender, text, created_at FROM messages WHERE session_id = %s AND id < %s ORDER BY id DESC LIMIT %s',
+                       (session_id, before_id, limit))
+    rows = reversed(cursor.fetchall())
+    return [{'id': row[0], 'sender': row[1], 'text': row[2], 'created_at': row[3].isoformat()} for row in rows]
+
 @app.get('/messages/{session_id}')
-async def get_messages(session_id: int):
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    cursor = conn.cursor()
-    table_name = sql.Identifier(f'session_{session_id}')
-    cursor.execute(sql.SQL('SELECT sender, text FROM {}').format(table_name))
-    messages = [{'sender': row[0], 'text': row[1]} for row in cursor.fetchall()]
-    conn.close()
-    print(f"Fetched messages from session {session_id}")
+async def get_messages(session_id: int, before_id: int = None, limit: int = 100):
+    limit = max(1, min(limit, 500))
+    messages = await db_pool.run(fetch_messages, session_id, before_id, limit)
+    logger.debug(f"Fetched messages from session {session_id}")
     return JSONResponse(content=messages)
 
 @app.post('/update_current_session')
@@ -301,39 +632,31 @@ async def update_current_session(request: Request):
     current_session = await request.json()
     return JSONResponse(content={"message": "Current session updated successfully!"})
 
+def remove_session(cursor, session_id):
+    cursor.execute('SELECT name FROM sessions WHERE id = %s', (session_id,))
+    session = cursor.fetchone()
+    session_name = None
+    if session:
+        session_name = session[0]
+        logger.debug(f"Session name: {session_name}")
+    cursor.execute('DELETE FROM sessions WHERE id = %s', (session_id,))
+    cursor.execute('DELETE FROM messages WHERE session_id = %s', (session_id,))
+    return session_name
+
 @app.delete('/sessions/{session_id}')
 async def delete_session(session_id: int):
-    print(f"Deleting session with ID: {session_id}")
-
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    cursor = conn.cursor()
+    logger.info(f"Deleting session with ID: {session_id}")
 
     try:
-        cursor.execute('SELECT name FROM sessions WHERE id = %s', (session_id,))
-        session = cursor.fetchone()
-        if session:
-            session_name = session[0]
-            print("anem", session_name)
-        cursor.execute('DELETE FROM sessions WHERE id = %s', (session_id,))
-        conn.commit()
-        cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(sql.Identifier(f'session_{session_id}')))
-        conn.commit()
+        session_name = await db_pool.run(remove_session, session_id)
         # remove the git clone project
         remove_project_path = os.path.join("projects", session_name)
         remove_directory(remove_project_path)
-        print("Session deleted successfully")
+        logger.info("Session deleted successfully")
         return JSONResponse(content={"message": "Session deleted successfully!"})
     except Exception as e:
-        print(f"Error deleting session: {e}")
+        logger.error(f"Error deleting session: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 # api key handling functions
 @app.post('/check_api_key')
@@ -396,7 +719,7 @@ async def upload_llamacpp_model(file: UploadFile = File(...), chunk: int = Form(
 
         return JSONResponse(content={"message": "Chunk uploaded successfully!"})
     except Exception as e:
-        print(f"Error uploading model: {e}")
+        logger.error(f"Error uploading model: {e}")
         raise HTTPException(status_code=500, detail="Failed to upload chunk")
     
 
@@ -412,24 +735,14 @@ async def delete_llamacpp_model(model_name: str):
 # handle prompt templates
 @app.get('/get_prompt_templates')
 async def get_prompt_templates():
-    prompt_templates_path = os.path.join('config', 'prompt_templates.ini')
-    templates_config = configparser.ConfigParser()
-
-    if not os.path.exists(prompt_templates_path):
-        return JSONResponse(content={})
-
-    with open(prompt_templates_path, 'r', encoding='utf-8') as file:
-        file_content = file.read()
-        # Ensure the content has a section header
-        if '[qa_prompt_templates]' not in file_content:
-            file_content = '[qa_prompt_templates]\n' + file_content
-
     try:
-        templates_config.read_string(file_content)
-    except configparser.ParsingError as e:
-        print(f"Error parsing config: {e}")
+        templates_config = prompt_store.snapshot()
+    except configparser.Error as e:
+        logger.error(f"Error parsing config: {e}")
         raise HTTPException(status_code=500, detail="Error parsing prompt templates")
 
+    if not templates_config.has_section('qa_prompt_templates'):
+        return JSONResponse(content={})
     templates = {k: v.replace('\\n', '\n') for k, v in templates_config.items('qa_prompt_templates')}
     return JSONResponse(content=templates)
 
@@ -439,14 +752,7 @@ async def delete_prompt_template(request: Request):
     data = await request.json()
     template_name = data.get('template_name')
 
-    prompt_templates_path = os.path.join('config', 'prompt_templates.ini')
-    templates_config = configparser.ConfigParser()
-    templates_config.read(prompt_templates_path)
-
-    if template_name in templates_config['qa_prompt_templates']:
-        templates_config.remove_option('qa_prompt_templates', template_name)
-        with open(prompt_templates_path, 'w', encoding='utf-8') as configfile:
-            templates_config.write(configfile)
+    if prompt_store.remove_option('qa_prompt_templates', template_name):
         return JSONResponse(content={"message": "Template deleted successfully!"})
     else:
         raise HTTPException(status_code=404, detail="Template not found")
@@ -455,12 +761,7 @@ async def delete_prompt_template(request: Request):
 @app.post('/save_prompt_templates')
 async def save_prompt_templates(request: Request):
     new_templates = await request.json()
-    prompt_templates_path = os.path.join('config', 'prompt_templates.ini')
-    templates_config = configparser.ConfigParser()
-    templates_config['qa_prompt_templates'] = {k: v.replace('\n', '\\n') for k, v in new_templates.items()}
-
-    with open(prompt_templates_path, 'w', encoding='utf-8') as configfile:
-        templates_config.write(configfile)
+    prompt_store.replace_section('qa_prompt_templates', {k: v.replace('\n', '\\n') for k, v in new_templates.items()})
     return JSONResponse(content={"message": "Templates saved successfully!"})
 
 #############################python codegraph############################
@@ -471,16 +772,58 @@ async def codegraph_home(request: Request):
 
 @app.get('/data')
 async def data(filepath: str):
-    code_data = parse_python_code(filepath)  # Ensure the path points to your Python code file
+    # the repos parsed at ingestion are served from their code graph index
+    graph = indexed_graph(filepath, project_dir, vectorstore_dir)
+    if graph is not None:
+        return Response(content=graph, media_type='application/json')
+    with span('parse_python'):
+        code_data = parse_python_code(filepath)  # Ensure the path points to your Python code file
     return JSONResponse(content=code_data)
 
-@app.get('/directory')
-async def directory():
+async def list_directory(tree, path, offset, limit):
     current_repo_path = read_current_repo_path(current_session)
     if current_repo_path is None:
         raise HTTPException(status_code=404, detail="Repository path not set or not found")
-    dir_tree = build_file_tree(current_repo_path)  # Ensure the path points to your code directory
-    return JSONResponse(content=dir_tree)
+    try:
+        # a directory not listed since the ingestion is scanned, keep it off the event loop
+        return await run_in_threadpool(tree.list, current_repo_path, path or None, offset=offset, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+@app.get('/directory')
+async def directory(path: str = '', offset: int = 0, limit: int = 0):
+    # one level of the tree per request, the page starts at offset
+    return JSONResponse(content=await list_directory(python_tree, path, offset, limit))
+
+@app.get('/callgraph')
+async def callgraph(symbol: str, hops: int = 1, direction: str = 'both', max_nodes: int = 100, max_edges: int = 300):
+    """The calls within hops of a symbol across the whole repo, e.g. DataHandler.build_db."""
+    if current_session is None:
+        raise HTTPException(status_code=404, detail="Repository path not set or not found")
+    if direction not in ('in', 'out', 'both'):
+        raise HTTPException(status_code=400, detail="direction must be in, out or both")
+    index = repo_codegraph_index(current_session['name'], project_dir, vectorstore_dir)
+    if index is None:
+        raise HTTPException(status_code=404, detail="The code graph index of the repository is not built yet")
+
+    # linking the repo after a change of the index is CPU bound, keep it off the event loop
+    def query():
+        graph = index.call_graph()
+        matches = graph.find(symbol)
+        if not matches:
+            raise HTTPException(status_code=404, detail=f"Symbol {symbol} not found")
+        if len(matches) > 1:
+            raise HTTPException(status_code=400,
+                                detail={"message": f"Symbol {symbol} is ambiguous", "candidates": matches})
+        # the caps keep the answer small whatever the client asks for
+        with span('callgraph'):
+            return graph.subgraph(matches[0], hops=max(0, min(hops, callgraph_max_hops)), direction=direction,
+                                  max_nodes=max(1, min(max_nodes, callgraph_max_nodes)),
+                                  max_edges=max(0, min(max_edges, callgraph_max_edges)))
+
+    return JSONResponse(content=await run_in_threadpool(query))
 
 @app.post('/analyze')
 async def analyze(request: Request):
@@ -503,16 +846,13 @@ async def go_codegraph_home(request: Request):
 async def go_data(filepath: str):
     if os.path.isdir(filepath):
         raise HTTPException(status_code=400, detail="The specified path is a directory, not a file.")
-    code_data = parse_go_code(filepath)
+    with span('parse_go'):
+        code_data = parse_go_code(filepath)
     return JSONResponse(content=code_data)
 
 @app.get('/go_directory')
-async def directory():
-    current_repo_path = read_current_repo_path(current_session)
-    if current_repo_path is None:
-        raise HTTPException(status_code=404, detail="Repository path not set or not found")
-    dir_tree = go_build_file_tree(current_repo_path)  # Ensure the path points to your code directory
-    return JSONResponse(content=dir_tree)
+async def go_directory(path: str = '', offset: int = 0, limit: int = 0):
+    return JSONResponse(content=await list_directory(go_tree, path, offset, limit))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,44 @@
+import hashlib
+import math
+import re
+from typing import List
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+TOKEN_RE = re.compile(r'[A-Za-z0-9_]+')
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: every token is hashed into one of dim
+    buckets with a +/-1 sign and the vector is L2 normalized. Texts sharing
+    identifiers end up close, which is enough to exercise the retrieval.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.model_name = f'hash-{dim}'
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for token in TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dim] += 1.0 if (value >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def fake_chat_model():
+    """A chat model answering from a fixed list, with invoke and stream like the real providers."""
+    return FakeListChatModel(responses=[
+        'The function loads the configuration and returns the parsed settings.',
+        'It is defined in the module and called by the request handler.',
+        'The class keeps the state of the session between the calls.',
+    ])
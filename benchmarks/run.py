@@ -0,0 +1,267 @@
+"""
+Offline benchmark of the ingestion, query and code graph paths of DataHandler.
+
+The run happens in a scratch directory with its own config/ (vector stores,
+projects and caches inside it), a hash embedding model and a fake chat model,
+so it needs neither a GPU nor the network. e.g.
+
+    python -m benchmarks.run --files 500 --lines 150 --queries 100 \\
+        --output bench.json --baseline benchmarks/baseline.json
+
+Use --save-baseline to store the results as the new baseline.
+"""
+import argparse
+import configparser
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_models import HashEmbeddings, fake_chat_model  # noqa: E402
+from benchmarks.synthetic_repo import DEFAULT_MIX, WORDS, generate_repo, parse_mix  # noqa: E402
+
+REPO_NAME = 'bench_repo'
+
+# +1: higher is better, -1: lower is better
+METRIC_DIRECTIONS = {
+    'ingest.files_per_second': 1,
+    'ingest.chunks_per_second': 1,
+    'query.p50_ms': -1,
+    'query.p95_ms': -1,
+    'query.p99_ms': -1,
+    'query.first_ms': -1,
+    'codegraph.python_files_per_second': 1,
+    'codegraph.go_files_per_second': 1,
+    'peak_rss_mb': -1,
+    'index_size_mb': -1,
+}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on linux and in bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def prepare_workdir(workdir, backend='chroma', dtype='int8'):
+    """Copy config/ into workdir with every directory and cache pointing inside it."""
+    config_dir = os.path.join(workdir, 'config')
+    shutil.copytree(os.path.join(REPO_ROOT, 'config'), config_dir, dirs_exist_ok=True)
+    config_path = os.path.join(config_dir, 'config.ini')
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    overrides = {
+        'the_project_dirs': {'vectorstore_dir': 'vectorstore', 'sessions_dir': 'sessions', 'project_dir': 'projects'},
+        # any provider but localai takes the chat model path
+        'model_providers': {'selected_provider': 'openai'},
+        'answer_cache': {'enabled': 'false', 'persist_path': ''},
+        'embedding_cache': {'enabled': 'false'},
+        'rerank_setting': {'preload': 'false', 'by_default': 'false'},
+        'vector_backend': {'backend': backend, 'dtype': dtype},
+    }
+    for section, values in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+    with open(config_path, 'w') as f:
+        config.write(f)
+    # go_codegraph runs ./parser
+    parser = os.path.join(REPO_ROOT, 'parser')
+    if os.path.exists(parser):
+        os.symlink(parser, os.path.join(workdir, 'parser'))
+
+
+def bench_ingest(DataHandler, chat_model, embedding_model):
+    handler = DataHandler(REPO_NAME, chat_model, embedding_model)
+    started = time.perf_counter()
+    handler.load_files()
+    handler.split_files()
+    handler.db = handler.store_vectors()
+    seconds = time.perf_counter() - started
+    report = handler.pipeline.report()
+    files = report['load']['items']
+    chunks = report['split']['items']
+    return handler, {
+        'seconds': round(seconds, 3),
+        'files': files,
+        'chunks': chunks,
+        'files_per_second': round(files / seconds, 2) if seconds else 0.0,
+        'chunks_per_second': round(chunks / seconds, 2) if seconds else 0.0,
+        'stages': report,
+    }
+
+
+def bench_queries(DataHandler, chat_model, embedding_model, queries):
+    latencies = []
+    for i in range(queries):
+        question = f"How does {WORDS[i % len(WORDS)]}_{WORDS[(i * 7) % len(WORDS)]} work?"
+        started = time.perf_counter()
+        # a new handler per question, like the chat endpoints
+        handler = DataHandler(REPO_NAME, chat_model, embedding_model)
+        handler.load_into_db()
+        handler.retrieval_qa(question)
+        latencies.append((time.perf_counter() - started) * 1000)
+    # the first one opens the store, the rest hit the store registry
+    warm = latencies[1:] or latencies
+    return {
+        'queries': queries,
+        'first_ms': round(latencies[0], 2) if latencies else 0.0,
+        'p50_ms': round(percentile(warm, 50), 2),
+        'p95_ms': round(percentile(warm, 95), 2),
+        'p99_ms': round(percentile(warm, 99), 2),
+    }
+
+
+def bench_codegraph(paths, parse, limit):
+    paths = paths[:limit]
+    if not paths:
+        return {'files': 0, 'files_per_second': 0.0}
+    started = time.perf_counter()
+    for path in paths:
+        parse(path)
+    seconds = time.perf_counter() - started
+    return {'files': len(paths), 'seconds': round(seconds, 3),
+            'files_per_second': round(len(paths) / seconds, 2) if seconds else 0.0}
+
+
+def flatten(results):
+    metrics = {
+        'ingest.files_per_second': results['ingest']['files_per_second'],
+        'ingest.chunks_per_second': results['ingest']['chunks_per_second'],
+        'peak_rss_mb': results['peak_rss_mb'],
+        'index_size_mb': results['index_size_mb'],
+    }
+    for key in ('first_ms', 'p50_ms', 'p95_ms', 'p99_ms'):
+        metrics[f'query.{key}'] = results['query'][key]
+    for language in ('python', 'go'):
+        graph = results['codegraph'].get(language)
+        if graph and graph['files']:
+            metrics[f'codegraph.{language}_files_per_second'] = graph['files_per_second']
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    """Return [(metric, baseline, current, change, regressed)] of the metrics in both."""
+    rows = []
+    for name, direction in METRIC_DIRECTIONS.items():
+        if name not in metrics or name not in baseline or not baseline[name]:
+            continue
+        change = (metrics[name] - baseline[name]) / baseline[name]
+        rows.append((name, baseline[name], metrics[name], change, direction * change < -tolerance))
+    return rows
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='qa_pilot_bench_')
+    cwd = os.getcwd()
+    try:
+        prepare_workdir(workdir, args.backend, args.dtype)
+        os.chdir(workdir)
+        # helper reads config/config.ini of the current directory at import
+        from utils.helper import DataHandler
+        from utils.codegraph import parse_python_code
+        from utils.go_codegraph import parse_go_code
+        from utils.store_registry import directory_size
+
+        written = generate_repo(os.path.join('projects', REPO_NAME), files=args.files, lines=args.lines,
+                                mix=parse_mix(args.mix) if args.mix else DEFAULT_MIX, seed=args.seed)
+        chat_model = fake_chat_model()
+        embedding_model = HashEmbeddings(args.dim)
+
+        handler, ingest = bench_ingest(DataHandler, chat_model, embedding_model)
+        query = bench_queries(DataHandler, chat_model, embedding_model, args.queries)
+        codegraph = {'python': bench_codegraph(written.get('py', []), parse_python_code, args.graph_files)}
+        if os.path.exists('parser'):
+            codegraph['go'] = bench_codegraph(written.get('go', []), parse_go_code, args.graph_files)
+        else:
+            codegraph['go'] = {'files': 0, 'skipped': 'no ./parser binary, run go build -o parser parser.go'}
+
+        results = {
+            'config': {'files': args.files, 'lines': args.lines, 'mix': args.mix or DEFAULT_MIX,
+                       'seed': args.seed, 'queries': args.queries, 'dim': args.dim,
+                       'backend': args.backend, 'dtype': args.dtype,
+                       'python': platform.python_version(), 'machine': platform.machine()},
+            'ingest': ingest,
+            'query': query,
+            'codegraph': codegraph,
+            'index_size_mb': round(directory_size(handler.db_dir) / (1024 * 1024), 3),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+        results['metrics'] = flatten(results)
+        return results
+    finally:
+        os.chdir(cwd)
+        if args.keep_workdir:
+            print(f"Kept the work directory {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200, help='number of generated files')
+    parser.add_argument('--lines', type=int, default=120, help='minimum lines per generated file')
+    parser.add_argument('--mix', default='', help='language mix, e.g. py=0.5,go=0.2,js=0.15,md=0.15')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--graph-files', type=int, default=50, help='files parsed per code graph language')
+    parser.add_argument('--dim', type=int, default=256, help='dimension of the hash embeddings')
+    parser.add_argument('--backend', default='chroma', choices=['chroma', 'ann'], help='vector backend of the index')
+    parser.add_argument('--dtype', default='int8', choices=['float32', 'float16', 'int8'],
+                        help='vector storage of the ann backend')
+    parser.add_argument('--output', default='', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=os.path.join(REPO_ROOT, 'benchmarks', 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change reported as a regression')
+    parser.add_argument('--keep-workdir', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'config': results['config'], 'metrics': results['metrics']}, f, indent=2)
+            f.write('\n')
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('config', {}).get('files') != args.files or baseline.get('config', {}).get('lines') != args.lines:
+        print("Warning: the baseline was recorded with another repo size, the numbers are not comparable")
+    rows = compare(results['metrics'], baseline['metrics'], args.tolerance)
+    print(f"\n{'metric':40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, old, new, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:40} {old:12.2f} {new:12.2f} {change * 100:7.1f}%{flag}")
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import os
+import random
+
+# the default language mix of the generated files, by extension
+DEFAULT_MIX = {'py': 0.5, 'go': 0.2, 'js': 0.15, 'md': 0.15}
+
+WORDS = ['user', 'session', 'config', 'repo', 'index', 'chunk', 'cache', 'query', 'model', 'store',
+         'file', 'path', 'token', 'vector', 'parser', 'graph', 'node', 'message', 'history', 'job']
+
+
+def parse_mix(text):
+    """Parse "py=0.5,go=0.2" into {'py': 0.5, 'go': 0.2}."""
+    mix = {}
+    for part in text.split(','):
+        if part.strip():
+            ext, weight = part.split('=')
+            mix[ext.strip().lstrip('.')] = float(weight)
+    return mix
+
+
+def identifier(rng, style='snake'):
+    parts = rng.sample(WORDS, 2)
+    if style == 'camel':
+        return parts[0] + parts[1].capitalize()
+    if style == 'pascal':
+        return ''.join(p.capitalize() for p in parts)
+    return '_'.join(parts)
+
+
+def python_source(rng, lines):
+    out = ['import os', 'import json', '']
+    while len(out) < lines:
+        name = identifier(rng, 'pascal')
+        out += [f'class {name}:', f'    """Keep the {name.lower()} state."""', '',
+                '    def __init__(self, path):', '        self.path = path', '']
+        for _ in range(rng.randint(2, 4)):
+            method = identifier(rng)
+            out += [f'    def {method}(self, value):',
+                    '        result = os.path.join(self.path, str(value))',
+                    f'        return json.dumps({{"{method}": result}})', '']
+        func = identifier(rng)
+        out += [f'def {func}(path):', f'    return {name}(path).{method}(1)', '', '']
+    # whole blocks only, the file has to parse
+    return '\n'.join(out) + '\n'
+
+
+def go_source(rng, lines):
+    out = ['package main', '', 'import "fmt"', '']
+    while len(out) < lines:
+        name = identifier(rng, 'pascal')
+        out += [f'type {name} struct {{', '\tPath string', '}', '',
+                f'func (s *{name}) {identifier(rng, "pascal")}(value int) string {{',
+                '\treturn fmt.Sprintf("%s/%d", s.Path, value)', '}', '',
+                f'func {identifier(rng, "camel")}(path string) *{name} {{',
+                f'\treturn &{name}{{Path: path}}', '}', '']
+    return '\n'.join(out) + '\n'
+
+
+def js_source(rng, lines):
+    out = []
+    while len(out) < lines:
+        name = identifier(rng, 'camel')
+        out += [f'export function {name}(value) {{', f'  const {identifier(rng, "camel")} = value * 2;',
+                f'  return `{name}:${{value}}`;', '}', '']
+    return '\n'.join(out) + '\n'
+
+
+def markdown_source(rng, lines):
+    out = []
+    while len(out) < lines:
+        out += [f'## {identifier(rng, "pascal")}', '',
+                ' '.join(rng.choice(WORDS) for _ in range(16)) + '.', '']
+    return '\n'.join(out) + '\n'
+
+
+GENERATORS = {'py': python_source, 'go': go_source, 'js': js_source, 'md': markdown_source}
+
+
+def generate_repo(root, files=200, lines=120, mix=None, seed=0, files_per_dir=20):
+    """
+    Write a reproducible repository of files of at least lines lines each, the
+    extensions drawn from mix, spread over sub directories of files_per_dir files.
+    Returns {extension: [paths]}.
+    """
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(GENERATORS)
+    if unknown:
+        raise ValueError(f"No generator for {sorted(unknown)}, supported: {sorted(GENERATORS)}")
+    rng = random.Random(seed)
+    extensions = list(mix)
+    weights = [mix[ext] for ext in extensions]
+    written = {ext: [] for ext in extensions}
+    for i in range(files):
+        ext = rng.choices(extensions, weights)[0]
+        directory = os.path.join(root, f'pkg{i // files_per_dir:03d}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{identifier(rng)}_{i}.{ext}')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(GENERATORS[ext](rng, lines))
+        written[ext].append(path)
+    return written
@@ -0,0 +1,185 @@
+"""
+Comparison of the vector backends on synthetic (clustered) embeddings: build
+time, query latency, recall@k against an exact float32 search, on-disk size
+and the resident memory an opened index adds while it answers the queries.
+Every backend is built and queried in fresh processes so the memory numbers
+do not mix; ann:<dtype>:<nprobe> queries the index of ann:<dtype> with nprobe
+lists (0 scales them with the lists), to sweep it. e.g.
+
+    python -m benchmarks.vector_backends --vectors 100000 --dim 384 \\
+        --backends chroma,ann:float32,ann:float16,ann:int8 --output backends.json
+    python -m benchmarks.vector_backends --vectors 5000 --dim 64 --clusters 0 \\
+        --backends ann:int8:8,ann:int8:32,ann:int8:0
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.run import percentile  # noqa: E402
+
+BATCH_SIZE = 1000
+
+
+def current_rss_mb():
+    """The resident set size of this process, from /proc on linux."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        from benchmarks.run import peak_rss_mb
+        return peak_rss_mb()
+
+
+def synthetic_vectors(count, dim, clusters, seed):
+    """Vectors around clusters random centers, embeddings of code chunks are far from uniform; 0 for uniform ones."""
+    rng = np.random.default_rng(seed)
+    if not clusters:
+        return rng.normal(size=(count, dim)).astype(np.float32)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors.astype(np.float32)
+
+
+def open_backend(spec, path):
+    from utils.vector_backends import AnnBackend, ChromaBackend
+    name, dtype, nprobe = (spec.split(':') + ['', ''])[:3]
+    if name == 'ann':
+        return AnnBackend(path, dtype=dtype or 'int8', nprobe=int(nprobe or 0))
+    return ChromaBackend(path)
+
+
+def build(spec, path, vectors_path):
+    vectors = np.load(vectors_path, mmap_mode='r')
+    started = time.perf_counter()
+    backend = open_backend(spec, path)
+    for start in range(0, len(vectors), BATCH_SIZE):
+        batch = np.asarray(vectors[start:start + BATCH_SIZE])
+        ids = [str(i) for i in range(start, start + len(batch))]
+        backend.upsert(ids, batch.tolist(), [{'source': f'file_{int(i) % 97}.py'} for i in ids],
+                       [f'chunk {i}' for i in ids])
+    backend.persist()
+    return {'build_seconds': round(time.perf_counter() - started, 3)}
+
+
+def query(spec, path, queries_path, k):
+    queries = np.load(queries_path)
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    backend = open_backend(spec, path)
+    open_ms = (time.perf_counter() - started) * 1000
+    latencies = []
+    found = []
+    for embedding in queries:
+        started = time.perf_counter()
+        results = backend.query(embedding.tolist(), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append([int(doc_id) for doc_id, _, _ in results])
+    result = {'open_ms': round(open_ms, 2), 'p50_ms': round(percentile(latencies, 50), 3),
+              'p95_ms': round(percentile(latencies, 95), 3),
+              'resident_mb': round(current_rss_mb() - rss_before, 1), 'found': found}
+    stats = backend.stats()
+    if 'nprobe' in stats:
+        result.update(lists=stats['lists'], nprobe=stats['nprobe'])
+    return result
+
+
+def in_fresh_process(function, *args):
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(function, args)
+
+
+def exact_neighbors(vectors, queries, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return [set(np.argsort(-(normalized @ q))[:k].tolist()) for q in queries]
+
+
+def directory_mb(path):
+    from utils.store_registry import directory_size
+    return round(directory_size(path) / (1024 * 1024), 2)
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='qa_pilot_vectors_')
+    try:
+        vectors = synthetic_vectors(args.vectors, args.dim, args.clusters, args.seed)
+        rng = np.random.default_rng(args.seed + 1)
+        # near the stored vectors, like a question about an indexed chunk
+        queries = vectors[rng.integers(0, len(vectors), args.queries)]
+        queries = queries + 0.3 * rng.normal(size=queries.shape).astype(np.float32)
+        vectors_path = os.path.join(workdir, 'vectors.npy')
+        queries_path = os.path.join(workdir, 'queries.npy')
+        np.save(vectors_path, vectors)
+        np.save(queries_path, queries)
+        truth = exact_neighbors(vectors, queries, args.k)
+        del vectors
+
+        results = {'config': {'vectors': args.vectors, 'dim': args.dim, 'clusters': args.clusters,
+                              'queries': args.queries, 'k': args.k, 'seed': args.seed},
+                   'backends': {}}
+        builds = {}
+        for spec in args.backends.split(','):
+            spec = spec.strip()
+            # the specs of one index with another nprobe share its build
+            stored = ':'.join(spec.split(':')[:2])
+            path = os.path.join(workdir, stored.replace(':', '_'))
+            try:
+                if stored not in builds:
+                    builds[stored] = in_fresh_process(build, stored, path, vectors_path)
+                result = dict(builds[stored])
+                result.update(in_fresh_process(query, spec, path, queries_path, args.k))
+            except ImportError as e:
+                results['backends'][spec] = {'skipped': str(e)}
+                continue
+            found = result.pop('found')
+            result['recall'] = round(sum(len(truth[i] & set(ids)) for i, ids in enumerate(found)) /
+                                     (len(truth) * args.k), 4)
+            result['index_size_mb'] = directory_mb(path)
+            results['backends'][spec] = result
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--clusters', type=int, default=200, help='centers of the synthetic vectors, 0 for uniform ones')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backends', default='chroma,ann:float32,ann:float16,ann:int8',
+                        help='comma separated, ann:<dtype>[:<nprobe>] for the in-process index')
+    parser.add_argument('--output', default='', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    print(f"\n{'backend':16} {'build s':>9} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7} {'disk MB':>8} {'rss MB':>7}")
+    for spec, result in results['backends'].items():
+        if 'skipped' in result:
+            print(f"{spec:16} skipped: {result['skipped']}")
+            continue
+        print(f"{spec:16} {result['build_seconds']:9.2f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+              f"{result['recall']:7.3f} {result['index_size_mb']:8.1f} {result['resident_mb']:7.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,73 +1,286 @@
 package main
 
 import (
+	"bufio"
 	"encoding/json"
+	"flag"
 	"fmt"
 	"go/ast"
 	"go/parser"
 	"go/token"
+	"io"
+	"io/fs"
+	"log"
 	"os"
+	"path/filepath"
+	"runtime"
 	"strings"
+	"sync"
 )
 
 type Node struct {
-	Name     string
-	Type     string   // "func", "method", "type", "interface", "int", or "import"
-	Calls    []string // list of called functions/methods
-	Code     string   // source code of the node
-	Position string   // file position of the node
+	Name      string
+	Type      string   // "func", "method", "type", "interface", "int", or "import"
+	Calls     []string // list of called functions/methods
+	Code      string   // source code of the node
+	Position  string   // file position of the node
+	StartLine int      // first line of the node, doc comment included
+	EndLine   int      // last line of the node
+}
+
+// one request of the -serve mode, a file (path) or all the files under a directory (dir)
+type Request struct {
+	ID   json.RawMessage `json:"id"`
+	Path string          `json:"path,omitempty"`
+	Dir  string          `json:"dir,omitempty"`
+}
+
+// one line of the -serve and -dir output, a directory request ends with Done
+type Result struct {
+	ID    json.RawMessage   `json:"id,omitempty"`
+	Path  string            `json:"path,omitempty"`
+	Nodes *map[string]*Node `json:"nodes,omitempty"` // a pointer, an empty file still sends {}
+	Error string            `json:"error,omitempty"`
+	Done  bool              `json:"done,omitempty"`
+	Files int               `json:"files,omitempty"`
+}
+
+// the -serve protocol, printed by -version, the app checks it before it starts the worker
+const serveProtocol = 1
+
+var verbose bool
+
+func debugf(format string, args ...interface{}) {
+	if verbose {
+		log.Printf(format, args...)
+	}
 }
 
 func main() {
-	if len(os.Args) < 2 {
-		fmt.Println("Usage: ./parser <path_to_go_file>")
+	serve := flag.Bool("serve", false, "read {\"id\", \"path\"|\"dir\"} JSON lines on stdin and write the results as JSON lines")
+	dir := flag.String("dir", "", "parse every .go file under the directory, one JSON line per file")
+	workers := flag.Int("workers", runtime.NumCPU(), "files parsed at the same time")
+	version := flag.Bool("version", false, "print the -serve protocol version")
+	flag.BoolVar(&verbose, "v", false, "log the requests to stderr")
+	flag.Usage = func() {
+		fmt.Println("Usage: ./parser <path_to_go_file> | -dir <directory> | -serve [-workers n] [-v] | -version")
+	}
+	flag.Parse()
+	if *workers < 1 {
+		*workers = 1
+	}
+
+	out := newResultWriter(os.Stdout)
+	switch {
+	case *version:
+		fmt.Println(serveProtocol)
+	case *serve:
+		serveRequests(os.Stdin, out, *workers)
+	case *dir != "":
+		files, err := parseDir(*dir, *workers, func(result Result) { out.write(result) })
+		if err != nil {
+			fmt.Println(err)
+			os.Exit(1)
+		}
+		debugf("parsed %d files under %s", files, *dir)
+	case flag.NArg() == 1:
+		nodes, err := parseFile(flag.Arg(0))
+		if err != nil {
+			fmt.Println(err)
+			os.Exit(1)
+		}
+		jsonOutput, err := json.Marshal(nodes)
+		if err != nil {
+			fmt.Println(err)
+			os.Exit(1)
+		}
+		fmt.Println(string(jsonOutput))
+	default:
+		flag.Usage()
 		os.Exit(1)
 	}
+}
+
+// resultWriter writes whole JSON lines from many goroutines
+type resultWriter struct {
+	mu  sync.Mutex
+	out *bufio.Writer
+}
+
+func newResultWriter(w io.Writer) *resultWriter {
+	return &resultWriter{out: bufio.NewWriter(w)}
+}
+
+func (w *resultWriter) write(result Result) {
+	line, err := json.Marshal(result)
+	if err != nil {
+		line, _ = json.Marshal(Result{ID: result.ID, Path: result.Path, Error: err.Error()})
+	}
+	w.mu.Lock()
+	defer w.mu.Unlock()
+	w.out.Write(line)
+	w.out.WriteByte('\n')
+	w.out.Flush()
+}
+
+func serveRequests(in io.Reader, out *resultWriter, workers int) {
+	scanner := bufio.NewScanner(in)
+	scanner.Buffer(make([]byte, 64*1024), 16*1024*1024)
+	slots := make(chan struct{}, workers)
+	var wg sync.WaitGroup
+	for scanner.Scan() {
+		var request Request
+		if err := json.Unmarshal(scanner.Bytes(), &request); err != nil {
+			out.write(Result{Error: fmt.Sprintf("invalid request: %v", err)})
+			continue
+		}
+		debugf("request %s: path=%q dir=%q", request.ID, request.Path, request.Dir)
+		if request.Dir != "" {
+			// a directory fans out over the workers itself
+			wg.Add(1)
+			go func(request Request) {
+				defer wg.Done()
+				// the caller waits for the done line, it must come even after a panic
+				defer func() {
+					if r := recover(); r != nil {
+						out.write(Result{ID: request.ID, Done: true, Error: fmt.Sprintf("parser panic: %v", r)})
+					}
+				}()
+				files, err := parseDir(request.Dir, workers, func(result Result) {
+					result.ID = request.ID
+					out.write(result)
+				})
+				done := Result{ID: request.ID, Done: true, Files: files}
+				if err != nil {
+					done.Error = err.Error()
+				}
+				out.write(done)
+			}(request)
+			continue
+		}
+		slots <- struct{}{}
+		wg.Add(1)
+		go func(request Request) {
+			defer wg.Done()
+			defer func() { <-slots }()
+			out.write(parseResult(request.ID, request.Path))
+		}(request)
+	}
+	wg.Wait()
+}
+
+// parseResult never panics, a file the parser chokes on answers with an error like a syntax error
+func parseResult(id json.RawMessage, path string) (result Result) {
+	defer func() {
+		if r := recover(); r != nil {
+			result = Result{ID: id, Path: path, Error: fmt.Sprintf("parser panic: %v", r)}
+		}
+	}()
+	nodes, err := parseFile(path)
+	if err != nil {
+		return Result{ID: id, Path: path, Error: err.Error()}
+	}
+	return Result{ID: id, Path: path, Nodes: &nodes}
+}
+
+// parseDir parses the .go files under root with workers goroutines, the hidden directories are skipped
+func parseDir(root string, workers int, emit func(Result)) (int, error) {
+	paths := make(chan string)
+	var wg sync.WaitGroup
+	for i := 0; i < workers; i++ {
+		wg.Add(1)
+		go func() {
+			defer wg.Done()
+			for path := range paths {
+				emit(parseResult(nil, path))
+			}
+		}()
+	}
+	files := 0
+	err := filepath.WalkDir(root, func(path string, entry fs.DirEntry, err error) error {
+		if err != nil {
+			return err
+		}
+		if entry.IsDir() {
+			if path != root && strings.HasPrefix(entry.Name(), ".") {
+				return filepath.SkipDir
+			}
+			return nil
+		}
+		if strings.HasSuffix(path, ".go") {
+			files++
+			paths <- path
+		}
+		return nil
+	})
+	close(paths)
+	wg.Wait()
+	return files, err
+}
 
-	filePath := os.Args[1]
+// parseFile returns the nodes of one file, keyed by function, Type.method, type and import path
+func parseFile(filePath string) (map[string]*Node, error) {
+	src, err := os.ReadFile(filePath)
+	if err != nil {
+		return nil, err
+	}
 	fset := token.NewFileSet()
-	node, err := parser.ParseFile(fset, filePath, nil, parser.ParseComments)
+	node, err := parser.ParseFile(fset, filePath, src, parser.ParseComments)
 	if err != nil {
-		fmt.Println(err)
-		os.Exit(1)
+		return nil, err
 	}
 
 	nodes := make(map[string]*Node)
+	// the node of each function, the keys of repeated names (init) carry their line
+	funcNodes := make(map[*ast.FuncDecl]*Node)
 	ast.Inspect(node, func(n ast.Node) bool {
 		switch x := n.(type) {
 		case *ast.FuncDecl:
-			funcName := x.Name.Name
+			funcName := funcKey(x)
 			funcType := "func"
 			if x.Recv != nil {
-				recvType := fmt.Sprintf("%s", x.Recv.List[0].Type)
-				if len(recvType) > 1 && recvType[0] == '*' {
-					recvType = recvType[1:]
-				}
 				funcType = "method"
-				funcName = fmt.Sprintf("%s.%s", cleanType(recvType), funcName)
 			}
 			pos := fset.Position(x.Pos())
-			code := getNodeCode(fset, x.Pos(), x.End(), filePath)
-			nodes[funcName] = &Node{
-				Name:     funcName,
-				Type:     funcType,
-				Calls:    []string{},
-				Code:     code,
-				Position: pos.String(),
+			code := getNodeCode(fset, x.Pos(), x.End(), src)
+			startLine := pos.Line
+			if x.Doc != nil {
+				startLine = fset.Position(x.Doc.Pos()).Line
 			}
+			funcNode := &Node{
+				Name:      funcName,
+				Type:      funcType,
+				Calls:     []string{},
+				Code:      code,
+				Position:  pos.String(),
+				StartLine: startLine,
+				EndLine:   fset.Position(x.End()).Line,
+			}
+			nodes[uniqueKey(nodes, funcName, pos.Line)] = funcNode
+			funcNodes[x] = funcNode
 		case *ast.GenDecl:
 			if x.Tok == token.TYPE {
 				for _, spec := range x.Specs {
 					typeSpec := spec.(*ast.TypeSpec)
 					typeName := typeSpec.Name.Name
 					pos := fset.Position(typeSpec.Pos())
-					code := getNodeCode(fset, typeSpec.Pos(), typeSpec.End(), filePath)
-					nodes[typeName] = &Node{
-						Name:     typeName,
-						Type:     "type",
-						Calls:    []string{},
-						Code:     code,
-						Position: pos.String(),
+					code := getNodeCode(fset, typeSpec.Pos(), typeSpec.End(), src)
+					startLine := pos.Line
+					if len(x.Specs) == 1 {
+						// a single "type X ..." declaration, take the keyword and doc comment as well
+						startLine = fset.Position(x.Pos()).Line
+						if x.Doc != nil {
+							startLine = fset.Position(x.Doc.Pos()).Line
+						}
+					}
+					nodes[uniqueKey(nodes, typeName, pos.Line)] = &Node{
+						Name:      typeName,
+						Type:      "type",
+						Calls:     []string{},
+						Code:      code,
+						Position:  pos.String(),
+						StartLine: startLine,
+						EndLine:   fset.Position(typeSpec.End()).Line,
 					}
 				}
 			} else if x.Tok == token.IMPORT {
@@ -76,12 +289,14 @@ func main() {
 					importPath := importSpec.Path.Value
 					pos := fset.Position(importSpec.Pos())
 					code := importSpec.Path.Value
-					nodes[importPath] = &Node{
-						Name:     importPath,
-						Type:     "import",
-						Calls:    []string{},
-						Code:     code,
-						Position: pos.String(),
+					nodes[uniqueKey(nodes, importPath, pos.Line)] = &Node{
+						Name:      importPath,
+						Type:      "import",
+						Calls:     []string{},
+						Code:      code,
+						Position:  pos.String(),
+						StartLine: pos.Line,
+						EndLine:   fset.Position(importSpec.End()).Line,
 					}
 				}
 			}
@@ -89,64 +304,62 @@ func main() {
 		return true
 	})
 
-	// Collect function and method calls
-	ast.Inspect(node, func(n ast.Node) bool {
-		switch x := n.(type) {
-		case *ast.CallExpr:
-			caller := ""
-			if sel, ok := x.Fun.(*ast.SelectorExpr); ok {
-				if ident, ok := sel.X.(*ast.Ident); ok {
-					caller = fmt.Sprintf("%s.%s", ident.Name, sel.Sel.Name)
-				}
-			} else if ident, ok := x.Fun.(*ast.Ident); ok {
-				caller = ident.Name
-			}
-			if caller != "" {
-				if parentFunc := getParentFunc(node, x.Pos(), fset); parentFunc != "" {
-					if _, ok := nodes[parentFunc]; ok {
-						nodes[parentFunc].Calls = append(nodes[parentFunc].Calls, caller)
+	// Collect function and method calls, the declarations are top level so each
+	// one is walked once instead of searching the parent of every call
+	for _, decl := range node.Decls {
+		fd, ok := decl.(*ast.FuncDecl)
+		if !ok {
+			continue
+		}
+		parent, ok := funcNodes[fd]
+		if !ok {
+			continue
+		}
+		ast.Inspect(fd, func(n ast.Node) bool {
+			if x, ok := n.(*ast.CallExpr); ok {
+				caller := ""
+				if sel, ok := x.Fun.(*ast.SelectorExpr); ok {
+					if ident, ok := sel.X.(*ast.Ident); ok {
+						caller = fmt.Sprintf("%s.%s", ident.Name, sel.Sel.Name)
 					}
+				} else if ident, ok := x.Fun.(*ast.Ident); ok {
+					caller = ident.Name
+				}
+				if caller != "" {
+					parent.Calls = append(parent.Calls, caller)
 				}
 			}
-		}
-		return true
-	})
+			return true
+		})
+	}
+	return nodes, nil
+}
 
-	jsonOutput, err := json.Marshal(nodes)
-	if err != nil {
-		fmt.Println(err)
-		os.Exit(1)
+// uniqueKey is key, or key#line when the file already has a node of that name,
+// Go allows several init functions and blank (_) declarations in one file
+func uniqueKey(nodes map[string]*Node, key string, line int) string {
+	if _, ok := nodes[key]; !ok {
+		return key
 	}
-	fmt.Println(string(jsonOutput))
+	return fmt.Sprintf("%s#%d", key, line)
 }
 
-func getNodeCode(fset *token.FileSet, start, end token.Pos, filePath string) string {
-	startOffset := fset.Position(start).Offset
-	endOffset := fset.Position(end).Offset
-	code, _ := os.ReadFile(filePath)
-	return string(code[startOffset:endOffset])
+// funcKey is the node key of a function, Type.method for a method
+func funcKey(fd *ast.FuncDecl) string {
+	if fd.Recv == nil {
+		return fd.Name.Name
+	}
+	recvType := fmt.Sprintf("%s", fd.Recv.List[0].Type)
+	if len(recvType) > 1 && recvType[0] == '*' {
+		recvType = recvType[1:]
+	}
+	return fmt.Sprintf("%s.%s", cleanType(recvType), fd.Name.Name)
 }
 
-func getParentFunc(node *ast.File, pos token.Pos, fset *token.FileSet) string {
-	var parentFunc string
-	ast.Inspect(node, func(n ast.Node) bool {
-		if fd, ok := n.(*ast.FuncDecl); ok {
-			if fd.Pos() < pos && fd.End() > pos {
-				if fd.Recv != nil {
-					recvType := fmt.Sprintf("%s", fd.Recv.List[0].Type)
-					if len(recvType) > 1 && recvType[0] == '*' {
-						recvType = recvType[1:]
-					}
-					parentFunc = fmt.Sprintf("%s.%s", cleanType(recvType), fd.Name.Name)
-				} else {
-					parentFunc = fd.Name.Name
-				}
-				return false
-			}
-		}
-		return true
-	})
-	return parentFunc
+func getNodeCode(fset *token.FileSet, start, end token.Pos, src []byte) string {
+	startOffset := fset.Position(start).Offset
+	endOffset := fset.Position(end).Offset
+	return string(src[startOffset:endOffset])
 }
 
 func cleanType(typeName string) string {
@@ -15,6 +15,7 @@ from langchain_community.chat_models import ChatLlamaCpp
 from langchain_nvidia_ai_endpoints import ChatNVIDIA
 from langchain_community.chat_models.tongyi import ChatTongyi
 from langchain_community.chat_models.moonshot import MoonshotChat
+from utils.embedding_cache import CachedEmbeddings, get_cache_store
 
 # read from the config.ini
 config_path = os.path.join('config', 'config.ini')
@@ -22,6 +23,9 @@ config = configparser.ConfigParser()
 config.read(config_path)
 ollama_base_url = config.get('ollama_llm_models', 'base_url')
 localai_base_url = config.get('localai_llm_models', 'base_url')
+embedding_cache_enabled = config.getboolean('embedding_cache', 'enabled', fallback=False)
+embedding_cache_dir = config.get('embedding_cache', 'cache_dir', fallback='cache_vectors')
+embedding_cache_max_size_mb = config.getfloat('embedding_cache', 'max_size_mb', fallback=2048)
 
 
 # get the chat model from config
@@ -92,17 +96,31 @@ def get_chat_model(provider, model_name=''):
     
 
 def get_embedding_model(eb_provider, model_name='', model_kwargs='', encode_kwargs=''):
-     if eb_provider == 'huggingface': 
-        return HuggingFaceEmbeddings(
+    if eb_provider == 'huggingface':
+        embedding_model = HuggingFaceEmbeddings(
                 model_name=model_name,
                 model_kwargs=model_kwargs,
                 encode_kwargs=encode_kwargs,
                 cache_folder="./cache_embeddings/"
             )
-     elif eb_provider == 'ollama':
-         return OllamaEmbeddings(
+    elif eb_provider == 'ollama':
+        embedding_model = OllamaEmbeddings(
                 model=model_name,
                 model_kwargs=model_kwargs
          )
-     else:
-        raise ValueError(f"Unsupported embedding model provider: {eb_provider}")
\ No newline at end of file
+    else:
+        raise ValueError(f"Unsupported embedding model provider: {eb_provider}")
+
+    # reuse the vectors of the chunks which were already embedded with the same settings
+    if embedding_cache_enabled:
+        store = get_cache_store(embedding_cache_dir, embedding_cache_max_size_mb)
+        return CachedEmbeddings(embedding_model, store, eb_provider, model_name, encode_kwargs)
+    return embedding_model
+
+
+def get_embedding_cache_stats():
+    if not embedding_cache_enabled:
+        return {'enabled': False}
+    stats = get_cache_store(embedding_cache_dir, embedding_cache_max_size_mb).stats()
+    stats['enabled'] = True
+    return stats
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+from utils.ann_index import MemmapAnnIndex, default_nprobe, normalize
+
+
+def random_vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def add(index, ids, vectors):
+    index.add([str(i) for i in ids], vectors, [f'chunk {i}' for i in ids],
+              [{'source': f'file_{i % 3}.py'} for i in ids])
+
+
+def ids_of(results):
+    return [doc_id for doc_id, _, _, _ in results]
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16', 'int8'])
+def test_search_finds_the_vector(tmp_path, dtype):
+    index = MemmapAnnIndex(str(tmp_path), dtype=dtype)
+    vectors = random_vectors(50)
+    add(index, range(50), vectors)
+    for i in (0, 17, 49):
+        doc_id, document, metadata, score = index.search(vectors[i], k=1)[0]
+        assert (doc_id, document, metadata) == (str(i), f'chunk {i}', {'source': f'file_{i % 3}.py'})
+        assert score == pytest.approx(1.0, abs=0.02)
+
+
+def test_upsert_replaces(tmp_path):
+    index = MemmapAnnIndex(str(tmp_path))
+    vectors = random_vectors(10)
+    add(index, range(10), vectors)
+    index.add(['3'], vectors[7:8], ['new text'], [{'source': 'new.py'}])
+    assert len(index) == 10
+    assert index.get(ids=['3'])['documents'] == ['new text']
+    # the old row of 3 is dead, its vector now finds 7 and the new 3
+    assert ids_of(index.search(vectors[3], k=10)).count('3') == 1
+    assert set(ids_of(index.search(vectors[7], k=2))) == {'3', '7'}
+
+
+def test_delete_and_get(tmp_path):
+    index = MemmapAnnIndex(str(tmp_path))
+    vectors = random_vectors(10)
+    add(index, range(10), vectors)
+    index.delete(['0', '4'])
+    assert len(index) == 8
+    assert '4' not in ids_of(index.search(vectors[4], k=10))
+    assert index.get(where={'source': 'file_1.py'})['ids'] == ['1', '7']
+    assert index.get(limit=2, offset=1)['ids'] == ['2', '3']
+
+
+def test_compaction_keeps_the_live_rows(tmp_path):
+    index = MemmapAnnIndex(str(tmp_path))
+    vectors = random_vectors(20)
+    add(index, range(20), vectors)
+    index.delete([str(i) for i in range(10)])
+    index.persist()
+    assert index.info['count'] == 10
+    for i in range(10, 20):
+        assert ids_of(index.search(vectors[i], k=1)) == [str(i)]
+
+
+def test_reopen(tmp_path):
+    index = MemmapAnnIndex(str(tmp_path), dtype='int8', min_train=100)
+    vectors = random_vectors(300)
+    add(index, range(300), vectors)
+    index.persist()
+    lists = index.stats()['lists']
+    index.close()
+
+    # the index keeps the dtype it was built with and its lists
+    reopened = MemmapAnnIndex(str(tmp_path), dtype='float32', min_train=100)
+    assert reopened.dtype == 'int8'
+    assert len(reopened) == 300
+    assert reopened.stats()['lists'] == lists > 0
+    assert ids_of(reopened.search(vectors[123], k=1)) == ['123']
+    # rows added after the training are scanned until the next persist
+    add(reopened, [300], random_vectors(1, seed=1))
+    assert ids_of(reopened.search(random_vectors(1, seed=1)[0], k=1)) == ['300']
+
+
+def test_default_nprobe_scales_with_the_lists():
+    assert default_nprobe(16) == 16
+    assert default_nprobe(282) == 36
+    assert default_nprobe(4096) == 512
+
+
+def test_recall_on_unclustered_vectors(tmp_path):
+    vectors = random_vectors(5000, dim=64)
+    queries = random_vectors(50, dim=64, seed=1)
+    index = MemmapAnnIndex(str(tmp_path))
+    add(index, range(len(vectors)), vectors)
+    index.persist()
+    assert index.stats()['lists'] > 200
+
+    normalized = normalize(vectors)
+    truth = [set(np.argsort(-(normalized @ normalize(query)))[:10].astype(str)) for query in queries]
+
+    def recall():
+        return np.mean([len(truth[i] & set(ids_of(index.search(query, k=10)))) / 10
+                        for i, query in enumerate(queries)])
+
+    # uniform vectors are the worst case of the lists, the default still probes enough of them
+    scaled = recall()
+    index.nprobe = 8
+    assert scaled > 0.6
+    assert scaled > recall() + 0.15
+
+
+def test_reopen_without_persist_then_add(tmp_path):
+    vectors = random_vectors(15)
+    index = MemmapAnnIndex(str(tmp_path), dtype='int8')
+    add(index, range(10), vectors[:10])
+    # an interrupted build, the resumed one opens the index again and goes on
+    index.conn.close()
+    resumed = MemmapAnnIndex(str(tmp_path), dtype='int8')
+    add(resumed, range(10, 15), vectors[10:])
+    assert len(resumed) == 15
+    for i in (0, 9, 14):
+        assert ids_of(resumed.search(vectors[i], k=1)) == [str(i)]
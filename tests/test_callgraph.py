@@ -0,0 +1,218 @@
+import ast
+import textwrap
+import pytest
+from utils.callgraph import CallGraph, extract_python_symbols, resolve_relative
+
+
+def symbols_of(files):
+    return [extract_python_symbols(ast.parse(textwrap.dedent(source)), rel_path)
+            for rel_path, source in files.items()]
+
+
+def call_graph(files):
+    return CallGraph(symbols_of(files))
+
+
+def callees(graph, name):
+    return sorted(graph.names[target] for target, kind in graph.out_edges[graph.ids[name]] if kind == 'calls')
+
+
+def test_extract_python_symbols():
+    symbols = extract_python_symbols(ast.parse(textwrap.dedent('''
+        import os.path
+        import numpy as np
+        from . import sibling
+        from .helpers import tool as t
+        from ..base import Base
+
+        class Handler(Base, sibling.Mixin):
+            def run(self):
+                def inner():
+                    os.path.join('a')
+                t()
+                t()
+                self.stop()
+
+        def main():
+            Handler().run()
+    ''')), 'pkg/sub/mod.py')
+
+    assert symbols['module'] == 'pkg.sub.mod'
+    assert not symbols['is_package']
+    # the function inside run is not a symbol of its own
+    assert sorted(symbols['defs']) == ['Handler', 'Handler.run', 'main']
+    assert symbols['defs']['Handler']['kind'] == 'class'
+    assert symbols['defs']['Handler.run']['kind'] == 'method'
+    assert symbols['defs']['main']['kind'] == 'function'
+    assert symbols['bases']['Handler'] == ['Base', 'sibling.Mixin']
+    assert symbols['imports'] == {'os': 'os', 'np': 'numpy', 'sibling': 'pkg.sub.sibling',
+                                  't': 'pkg.sub.helpers.tool', 'Base': 'pkg.base.Base'}
+    # the calls of the nested function count for run, a repeated call once
+    assert symbols['calls']['Handler.run'] == ['os.path.join', 't', 'self.stop']
+    # a call on a call result has no name
+    assert symbols['calls']['main'] == ['Handler']
+
+
+def test_resolve_relative():
+    assert resolve_relative('pkg.mod', False, 1, 'other') == 'pkg.other'
+    assert resolve_relative('pkg', True, 1, 'other') == 'pkg.other'
+    assert resolve_relative('pkg.sub.mod', False, 2, None) == 'pkg'
+    assert resolve_relative('mod', False, 0, 'os') == 'os'
+
+
+def test_relative_import_calls():
+    graph = call_graph({
+        'pkg/__init__.py': '',
+        'pkg/a.py': '''
+            from .b import helper
+            from . import b
+
+            def first():
+                helper()
+
+            def second():
+                b.helper()
+        ''',
+        'pkg/b.py': '''
+            def helper():
+                pass
+        ''',
+    })
+    assert callees(graph, 'pkg.a.first') == ['pkg.b.helper']
+    assert callees(graph, 'pkg.a.second') == ['pkg.b.helper']
+    assert graph.resolve('pkg.a.helper') == graph.ids['pkg.b.helper']
+
+
+def test_package_reexports():
+    graph = call_graph({
+        'pkg/__init__.py': 'from .impl import Thing\n',
+        'pkg/impl.py': '''
+            class Thing:
+                def run(self):
+                    pass
+        ''',
+        'app.py': '''
+            from pkg import Thing
+            import pkg
+
+            def main():
+                Thing.run()
+                pkg.Thing()
+        ''',
+    })
+    assert graph.resolve('pkg.Thing') == graph.ids['pkg.impl.Thing']
+    assert graph.resolve('pkg.Thing.run') == graph.ids['pkg.impl.Thing.run']
+    assert callees(graph, 'app.main') == ['pkg.impl.Thing', 'pkg.impl.Thing.run']
+
+
+def test_reexport_cycle_stops():
+    graph = call_graph({
+        'a/__init__.py': 'from b import name\n',
+        'b/__init__.py': 'from a import name\n',
+    })
+    assert graph.resolve('a.name') is None
+
+
+def test_self_calls_through_bases():
+    graph = call_graph({
+        'base.py': '''
+            class Base:
+                def helper(self):
+                    pass
+
+                def shared(self):
+                    pass
+        ''',
+        'child.py': '''
+            from base import Base
+
+            class Child(Base):
+                def shared(self):
+                    pass
+
+                def run(self):
+                    self.helper()
+                    self.shared()
+                    self.missing()
+
+                def bare(self):
+                    # a bare name never resolves against the class scope
+                    shared()
+        ''',
+    })
+    assert callees(graph, 'child.Child.run') == ['base.Base.helper', 'child.Child.shared']
+    assert callees(graph, 'child.Child.bare') == []
+    assert graph.resolve('child.Child.helper') == graph.ids['base.Base.helper']
+    assert (graph.ids['base.Base'], 'inherits') in graph.out_edges[graph.ids['child.Child']]
+
+
+def test_src_layout():
+    graph = call_graph({
+        'src/mylib/__init__.py': '',
+        'src/mylib/core.py': '''
+            def go():
+                pass
+        ''',
+        'scripts/run.py': '''
+            from mylib.core import go
+            import mylib.core
+
+            def main():
+                go()
+                mylib.core.go()
+        ''',
+    })
+    assert callees(graph, 'scripts.run.main') == ['src.mylib.core.go']
+
+
+def test_src_layout_ambiguous_suffix():
+    graph = call_graph({
+        'src/one/util.py': 'def f():\n    pass\n',
+        'src/two/util.py': 'def f():\n    pass\n',
+        'main.py': 'from util import f\n\ndef main():\n    f()\n',
+    })
+    # util matches two modules, nothing is guessed
+    assert callees(graph, 'main.main') == []
+
+
+@pytest.fixture
+def star():
+    leaves = ''.join(f'def leaf{i}():\n    pass\n\n' for i in range(10))
+    hub = 'def hub():\n' + ''.join(f'    leaf{i}()\n' for i in range(10))
+    caller = 'def caller():\n    hub()\n'
+    return call_graph({'star.py': leaves + hub + caller})
+
+
+def test_subgraph_hops_and_direction(star):
+    out = star.subgraph('star.hub', hops=1, direction='out')
+    assert len(out['nodeDataArray']) == 11
+    assert len(out['linkDataArray']) == 10
+    assert not out['truncated']
+
+    callers = star.subgraph('star.hub', hops=1, direction='in')
+    assert [node['key'] for node in callers['nodeDataArray']] == ['star.hub', 'star.caller']
+
+    two_hops = star.subgraph('star.caller', hops=2, direction='out')
+    assert len(two_hops['nodeDataArray']) == 12
+    assert max(node['hops'] for node in two_hops['nodeDataArray']) == 2
+
+    alone = star.subgraph('star.hub', hops=0)
+    assert len(alone['nodeDataArray']) == 1 and alone['linkDataArray'] == []
+
+
+def test_subgraph_caps(star):
+    capped = star.subgraph('star.hub', hops=1, direction='both', max_nodes=4)
+    assert len(capped['nodeDataArray']) == 4
+    assert capped['truncated']
+
+    capped = star.subgraph('star.hub', hops=1, direction='out', max_edges=3)
+    assert len(capped['nodeDataArray']) == 11
+    assert len(capped['linkDataArray']) == 3
+    assert capped['truncated']
+
+
+def test_find(star):
+    assert star.find('star.hub') == ['star.hub']
+    assert star.find('hub') == ['star.hub']
+    assert star.find('leaf', limit=3) == []
+    assert len(star.find('leaf1')) == 1
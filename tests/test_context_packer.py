@@ -0,0 +1,47 @@
+from langchain_core.documents import Document
+from utils.context_packer import ContextPacker
+
+
+def packer():
+    # one token per character keeps the budgets exact
+    return ContextPacker(default_budget=1000, counter=len)
+
+
+def doc(text, source='a.py', start=None, end=None, score=None):
+    metadata = {'source': source, 'start_line': start, 'end_line': end}
+    if score is not None:
+        metadata['relevance_score'] = score
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_duplicates_and_adjacent_chunks_merge():
+    context = packer().pack([doc('def a():\n    pass', start=1, end=2),
+                             doc('def a():\n    pass', start=1, end=2),
+                             doc('def b():\n    pass', start=3, end=4)])
+    assert context == 'File: a.py (lines 1-4)\ndef a():\n    pass\ndef b():\n    pass'
+
+
+def test_blocks_within_the_budget_in_retrieval_order():
+    docs = [doc('x' * 30, source='first.py'), doc('y' * 30, source='second.py'), doc('z' * 500, source='big.py')]
+    context = packer().pack(docs, budget=120)
+    assert context.split('\n\n') == ['File: first.py\n' + 'x' * 30, 'File: second.py\n' + 'y' * 30]
+
+
+def test_the_best_block_always_goes_in():
+    # a single line far over the budget is cut by characters
+    context = packer().pack([doc('x' * 500, source='long.py')], budget=40)
+    assert context.startswith('File: long.py\nxxx')
+    assert len(context) == 40
+
+    # not even the header fits
+    context = packer().pack([doc('x' * 500, source='long.py')], budget=5)
+    assert context == 'File:'
+
+
+def test_tokens_are_counted():
+    pack = packer()
+    pack.pack([doc('abcd'), doc('abcd', source='b.py')])
+    stats = pack.stats()
+    assert stats['requests'] == 1
+    assert stats['duplicates_dropped'] == 1
+    assert stats['tokens_in'] == 8
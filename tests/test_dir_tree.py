@@ -0,0 +1,93 @@
+import os
+import pytest
+from utils.dir_tree import DirectoryTree
+
+
+def make_files(root, paths):
+    for path in paths:
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('')
+
+
+@pytest.fixture
+def repo(tmp_path):
+    make_files(str(tmp_path), ['main.py', 'README.md', 'pkg/a.py', 'pkg/sub/b.py', 'pkg/sub/c.py',
+                               'docs/index.md', 'node_modules/x/y.py'])
+    return str(tmp_path)
+
+
+def entries(listing):
+    return [(entry['name'], entry['type'], entry.get('files')) for entry in listing['entries']]
+
+
+def test_list(repo):
+    tree = DirectoryTree(['.py'])
+    # the directories without matching files and the ignored ones are left out
+    assert entries(tree.list(repo)) == [('pkg', 'directory', 3), ('main.py', 'file', None)]
+    assert entries(tree.list(repo, os.path.join(repo, 'pkg'))) == [('sub', 'directory', 2), ('a.py', 'file', None)]
+    with pytest.raises(ValueError):
+        tree.list(repo, os.path.dirname(repo))
+    with pytest.raises(FileNotFoundError):
+        tree.list(repo, os.path.join(repo, 'missing'))
+
+
+def test_pages(repo):
+    make_files(repo, [f'many/m{i}.py' for i in range(5)])
+    tree = DirectoryTree(['.py'], page_size=2)
+    many = os.path.join(repo, 'many')
+    first = tree.list(repo, many, limit=10)
+    assert [entry['name'] for entry in first['entries']] == ['m0.py', 'm1.py']
+    assert first['total'] == 5 and first['next_offset'] == 2
+    assert tree.list(repo, many, offset=4)['next_offset'] is None
+
+
+def test_build_then_list_scans_nothing(repo):
+    tree = DirectoryTree(['.py'])
+    assert tree.build(repo) == 4
+    misses = tree.misses
+    tree.list(repo)
+    tree.list(repo, os.path.join(repo, 'pkg'))
+    assert tree.misses == misses
+
+
+def touch(directory):
+    # the mtime of a directory may not move within the resolution of the file system
+    os.utime(directory, ns=(0, os.stat(directory).st_mtime_ns + 1))
+
+
+def test_rescan_updates_the_parents(repo):
+    tree = DirectoryTree(['.py'])
+    tree.build(repo)
+    sub = os.path.join(repo, 'pkg', 'sub')
+    make_files(repo, ['pkg/sub/d.py', 'pkg/sub/new/e.py', 'pkg/sub/new/f.py'])
+    touch(sub)
+    assert entries(tree.list(repo, sub)) == [('new', 'directory', 2), ('b.py', 'file', None),
+                                             ('c.py', 'file', None), ('d.py', 'file', None)]
+    # the change of sub is carried up to the root, the parents are not rescanned
+    misses = tree.misses
+    assert tree.count(repo, os.path.join(repo, 'pkg')) == 6
+    assert tree.count(repo, repo) == 7
+    assert tree.misses == misses
+
+    for name in ('e.py', 'f.py'):
+        os.remove(os.path.join(sub, 'new', name))
+    os.rmdir(os.path.join(sub, 'new'))
+    touch(sub)
+    tree.list(repo, sub)
+    assert tree.count(repo, repo) == 5
+    assert entries(tree.list(repo))[0] == ('pkg', 'directory', 4)
+
+
+def test_repos_are_bounded(tmp_path):
+    roots = []
+    for name in ('one', 'two', 'three'):
+        root = str(tmp_path / name)
+        make_files(root, ['a.py'])
+        roots.append(root)
+    tree = DirectoryTree(['.py'], max_repos=2)
+    for root in roots:
+        tree.list(root)
+    assert tree.stats()['repos'] == 2
+    assert list(tree.repos) == [os.path.realpath(root) for root in roots[1:]]
@@ -0,0 +1,49 @@
+import threading
+import time
+from utils.model_pool import ModelPool, model_key
+
+
+def key(name):
+    return model_key('chat', 'fake', name)
+
+
+def test_lru_eviction():
+    pool = ModelPool(max_models=2)
+    for name in ('a', 'b'):
+        pool.get_or_load(key(name), lambda: object())
+    pool.get_or_load(key('a'), lambda: object())
+    pool.get_or_load(key('c'), lambda: object())
+    assert list(pool.entries) == [key('a'), key('c')]
+    assert pool.stats()['evictions'] == 1
+
+
+def test_active_models_are_not_evicted():
+    pool = ModelPool(max_models=1)
+    pool.set_active([key('a'), None])
+    pool.get_or_load(key('a'), lambda: object())
+    pool.get_or_load(key('b'), lambda: object())
+    # a is held by the app, b was just loaded
+    assert set(pool.entries) == {key('a'), key('b')}
+    pool.set_active([key('b')])
+    assert list(pool.entries) == [key('b')]
+
+
+def test_loads_are_serialized():
+    pool = ModelPool(max_models=4)
+    running = []
+    overlapped = []
+
+    def loader():
+        running.append(1)
+        overlapped.append(len(running) > 1)
+        time.sleep(0.02)
+        running.pop()
+        return object()
+
+    threads = [threading.Thread(target=pool.get_or_load, args=(key(name), loader)) for name in 'abc']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(pool.entries) == 3
+    assert not any(overlapped)
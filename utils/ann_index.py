@@ -0,0 +1,350 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import numpy as np
+
+DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+# below this many vectors a full scan is as fast as probing the lists
+MIN_TRAIN_VECTORS = 2048
+# the k-means runs on at most this many vectors
+MAX_TRAIN_SAMPLE = 65536
+KMEANS_ITERATIONS = 12
+# the full scan works through the vectors in blocks of this many rows
+SCAN_BLOCK = 65536
+# without an nprobe a query reads this share of the lists, at least MIN_NPROBE of them,
+# so the recall holds as nlist grows with the repo
+NPROBE_FRACTION = 0.125
+MIN_NPROBE = 16
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def default_nlist(count):
+    return int(min(4096, max(16, 4 * math.sqrt(count))))
+
+
+def default_nprobe(nlist):
+    return min(nlist, max(MIN_NPROBE, math.ceil(nlist * NPROBE_FRACTION)))
+
+
+def kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means of normalized vectors, returns the normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        # an empty list takes a random vector again
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class MemmapAnnIndex:
+    """
+    An inverted file (IVF) index for cosine similarity kept in one directory:
+    the normalized vectors in a memory-mapped array (float32, float16, or int8
+    with a scale per vector), the k-means centroids and the rows of each list,
+    and the ids, texts and metadata in sqlite. Only the probed lists are read
+    from disk for a query, so an open index costs little resident memory, and
+    int8 takes a quarter of the float32 space. Up to min_train vectors, and for
+    the rows added since the last training, the vectors are scanned in full.
+    nprobe lists are probed per query, 0 scales them with the number of lists.
+
+    Rows are only appended; an upserted id gets a new row and a deleted one only
+    leaves sqlite, persist() compacts the arrays once dead rows pile up.
+    """
+
+    def __init__(self, path, dtype='float32', nlist=0, nprobe=0, min_train=MIN_TRAIN_VECTORS):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, use one of {sorted(DTYPES)}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.nprobe = max(0, nprobe)
+        self.min_train = min_train
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(path, 'meta.sqlite'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                source TEXT,
+                document TEXT,
+                metadata TEXT
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)')
+        self.conn.commit()
+        self.info = self._load_info() or {'dim': None, 'dtype': dtype, 'count': 0, 'nlist': nlist,
+                                          'trained_count': 0, 'indexed_count': 0}
+        # an existing index keeps the dtype it was built with
+        self.dtype = self.info['dtype']
+        # info.json is only saved by persist(), the rows added since (an interrupted build) are in sqlite
+        last_row = self.conn.execute('SELECT MAX(row) FROM chunks').fetchone()[0]
+        if last_row is not None and last_row >= self.info['count']:
+            self.info['count'] = last_row + 1
+        self.vectors = None
+        self.scales = None
+        self.centroids = None
+        self.order = None
+        self.offsets = None
+        self._open_arrays()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load_info(self):
+        try:
+            with open(self._file('info.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_info(self):
+        tmp_path = self._file('info.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.info, f)
+        os.replace(tmp_path, self._file('info.json'))
+
+    def _map(self, name, dtype, shape):
+        path = self._file(name)
+        row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * np.dtype(dtype).itemsize
+        capacity = os.path.getsize(path) // row_bytes if os.path.exists(path) and row_bytes else 0
+        if capacity < shape[0]:
+            with open(path, 'ab') as f:
+                f.truncate(shape[0] * row_bytes)
+            capacity = shape[0]
+        return np.memmap(path, dtype=dtype, mode='r+', shape=(capacity,) + tuple(shape[1:]))
+
+    def _open_arrays(self, capacity=0):
+        dim = self.info['dim']
+        if dim is None:
+            return
+        capacity = max(capacity, self.info['count'], 1)
+        self.vectors = self._map(f'vectors.{self.dtype}', DTYPES[self.dtype], (capacity, dim))
+        if self.dtype == 'int8':
+            self.scales = self._map('scales.f32', np.float32, (self.vectors.shape[0],))
+        if os.path.exists(self._file('centroids.npy')) and self.info['trained_count']:
+            self.centroids = np.load(self._file('centroids.npy'))
+            self.order = np.load(self._file('order.npy'), mmap_mode='r')
+            self.offsets = np.load(self._file('offsets.npy'))
+
+    def _reserve(self, rows):
+        if self.vectors is None or self.vectors.shape[0] < rows:
+            if self.vectors is not None:
+                self.vectors.flush()
+            # grow by doubling, like the embedding cache slabs
+            current = self.vectors.shape[0] if self.vectors is not None else 0
+            self._open_arrays(max(rows, current * 2, 1024))
+
+    def _quantize(self, vectors):
+        if self.dtype == 'int8':
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            return np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8), scales
+        return vectors.astype(DTYPES[self.dtype]), None
+
+    def _scores(self, rows, query):
+        """The similarity of query with the vectors of rows (an index array or a slice)."""
+        vectors = self.vectors[rows]
+        scores = vectors.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return scores
+
+    def _dequantized(self, start, stop):
+        vectors = self.vectors[start:stop].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[start:stop, None]
+        return vectors
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+    def add(self, ids, embeddings, documents, metadatas):
+        """Insert or replace the vectors, texts and metadata of ids."""
+        if not len(ids):
+            return
+        vectors = normalize(embeddings)
+        with self.lock:
+            if self.info['dim'] is None:
+                self.info['dim'] = int(vectors.shape[1])
+                # the arrays cannot be opened again without it
+                self._save_info()
+            elif vectors.shape[1] != self.info['dim']:
+                raise ValueError(f"Expected vectors of dimension {self.info['dim']}, got {vectors.shape[1]}")
+            start = self.info['count']
+            stop = start + len(ids)
+            self._reserve(stop)
+            quantized, scales = self._quantize(vectors)
+            self.vectors[start:stop] = quantized
+            if scales is not None:
+                self.scales[start:stop] = scales
+            self.info['count'] = stop
+            rows = [(start + i, doc_id, (metadata or {}).get('source'), document, json.dumps(metadata or {}))
+                    for i, (doc_id, document, metadata) in enumerate(zip(ids, documents, metadatas))]
+            # the old row of an upserted id stays in the arrays as a dead row
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO chunks (row, id, source, document, metadata) VALUES (?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    def delete(self, ids):
+        with self.lock:
+            self.conn.executemany('DELETE FROM chunks WHERE id = ?', [(doc_id,) for doc_id in ids])
+            self.conn.commit()
+
+    def _rows(self, sql, params=()):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return {'ids': [row[0] for row in rows], 'documents': [row[1] for row in rows],
+                'metadatas': [json.loads(row[2]) for row in rows]}
+
+    def get(self, ids=None, where=None, limit=None, offset=None):
+        """The chunks of ids, or matching the {key: value} metadata filter, like chroma's get."""
+        sql = 'SELECT id, document, metadata FROM chunks'
+        clauses, params = [], []
+        if ids is not None:
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params += list(ids)
+        extra = dict(where or {})
+        if 'source' in extra:
+            clauses.append('source = ?')
+            params.append(extra.pop('source'))
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY row'
+        if extra:
+            # the other metadata keys are filtered after loading
+            result = self._rows(sql, params)
+            keep = [i for i, metadata in enumerate(result['metadatas'])
+                    if all(metadata.get(key) == value for key, value in extra.items())]
+            keep = keep[offset or 0:(offset or 0) + limit if limit else None]
+            return {key: [values[i] for i in keep] for key, values in result.items()}
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [limit, offset or 0]
+        return self._rows(sql, params)
+
+    def search(self, embedding, k=4):
+        """[(id, document, metadata, score)] of the k most similar live vectors, best first."""
+        query = normalize(embedding)
+        with self.lock:
+            count = self.info['count']
+            if count == 0 or self.vectors is None:
+                return []
+            if self.centroids is None:
+                rows = np.arange(count)
+                scores = np.concatenate([self._scores(slice(start, min(start + SCAN_BLOCK, count)), query)
+                                         for start in range(0, count, SCAN_BLOCK)])
+            else:
+                # the probed lists plus the rows added since they were built
+                indexed_count = self.info['indexed_count']
+                lists = np.argsort(-(self.centroids @ query))[:self._nprobe()]
+                rows = np.concatenate([np.asarray(self.order[self.offsets[i]:self.offsets[i + 1]]) for i in lists] +
+                                      [np.arange(indexed_count, count)]).astype(np.int64)
+                rows.sort()
+                scores = self._scores(rows, query)
+            # some of the best rows may be dead, take a few more
+            wanted = min(len(rows), k * 2 + 16)
+            best = np.argpartition(-scores, wanted - 1)[:wanted] if wanted < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(-scores[best])]
+            candidates = [(int(rows[i]), float(scores[i])) for i in best]
+            found = {}
+            placeholders = ','.join('?' * len(candidates))
+            for row, doc_id, document, metadata in self.conn.execute(
+                    f'SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})',
+                    [row for row, _ in candidates]):
+                found[row] = (doc_id, document, json.loads(metadata))
+        results = [found[row] + (score,) for row, score in candidates if row in found]
+        return results[:k]
+
+    def _nprobe(self):
+        return self.nprobe or default_nprobe(len(self.centroids))
+
+    def _compact(self):
+        live = [row for (row,) in self.conn.execute('SELECT row FROM chunks ORDER BY row')]
+        if self.vectors is None:
+            return
+        rows = np.asarray(live, dtype=np.int64)
+        vectors = np.array(self.vectors[rows]) if len(rows) else np.zeros((0, self.info['dim']), DTYPES[self.dtype])
+        scales = np.array(self.scales[rows]) if self.scales is not None and len(rows) else None
+        self.conn.execute('CREATE TABLE chunks_compacted AS SELECT ROW_NUMBER() OVER (ORDER BY row) - 1 AS row, '
+                          'id, source, document, metadata FROM chunks')
+        self.conn.execute('DELETE FROM chunks')
+        self.conn.execute('INSERT INTO chunks SELECT * FROM chunks_compacted')
+        self.conn.execute('DROP TABLE chunks_compacted')
+        self.conn.commit()
+        self.vectors[:len(rows)] = vectors
+        if scales is not None:
+            self.scales[:len(rows)] = scales
+        self.info['count'] = len(rows)
+        # the lists point at the old rows
+        self.info['trained_count'] = 0
+        self.info['indexed_count'] = 0
+        self.centroids = None
+
+    def _train(self, count):
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, size=min(count, MAX_TRAIN_SAMPLE), replace=False))
+        sample = self.vectors[sample_rows].astype(np.float32)
+        if self.scales is not None:
+            sample *= self.scales[sample_rows, None]
+        nlist = min(self.info['nlist'] or default_nlist(count), len(sample))
+        self.centroids = kmeans(normalize(sample), nlist)
+        np.save(self._file('centroids.npy'), self.centroids)
+        self.info['trained_count'] = count
+
+    def _build_lists(self, count):
+        assign = np.concatenate([np.argmax(self._dequantized(start, min(start + SCAN_BLOCK, count)) @ self.centroids.T,
+                                           axis=1) for start in range(0, count, SCAN_BLOCK)])
+        order = np.argsort(assign, kind='stable').astype(np.int32)
+        offsets = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1)).astype(np.int64)
+        np.save(self._file('order.npy'), order)
+        np.save(self._file('offsets.npy'), offsets)
+        self.order = np.load(self._file('order.npy'), mmap_mode='r')
+        self.offsets = offsets
+        self.info['indexed_count'] = count
+
+    def persist(self):
+        """Flush the vectors, compact and (re)train the lists when the index grew or has many dead rows."""
+        with self.lock:
+            if self.vectors is None:
+                self._save_info()
+                return
+            live = self.conn.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+            if self.info['count'] and live < 0.7 * self.info['count']:
+                self._compact()
+            count = self.info['count']
+            if live >= self.min_train and (self.centroids is None or count >= 2 * self.info['trained_count']):
+                self._train(count)
+            if self.centroids is not None and self.info['indexed_count'] != count:
+                self._build_lists(count)
+            self.vectors.flush()
+            if self.scales is not None:
+                self.scales.flush()
+            self._save_info()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+            self.vectors = None
+            self.scales = None
+
+    def stats(self):
+        with self.lock:
+            live = self.conn.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+            return {'path': self.path, 'dtype': self.dtype, 'dim': self.info['dim'], 'rows': self.info['count'],
+                    'live': live, 'lists': len(self.centroids) if self.centroids is not None else 0,
+                    'nprobe': self._nprobe() if self.centroids is not None else self.nprobe,
+                    'unindexed': self.info['count'] - self.info['indexed_count']}
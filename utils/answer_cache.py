@@ -0,0 +1,136 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from cachetools import TTLCache
+from utils.metrics import logger
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def fingerprint(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class AnswerCache:
+    """
+    TTL + LRU cache of the generated answers. An entry belongs to a scope (repo,
+    index version, provider, model, prompt template, chat history, options) and is
+    found by the normalized query; in semantic mode a query whose embedding is
+    close enough to a cached query of the same scope is a hit as well.
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600, persist_path=None, semantic=False,
+                 semantic_threshold=0.95, semantic_scope_size=200):
+        self.ttl = ttl
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl, timer=time.time)
+        self.persist_path = persist_path
+        self.semantic = semantic
+        self.semantic_threshold = semantic_threshold
+        self.semantic_scope_size = semantic_scope_size
+        # scope -> OrderedDict(full key -> query vector)
+        self.vectors = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        if persist_path:
+            self.load()
+
+    @staticmethod
+    def scope_key(**scope):
+        return fingerprint(scope)
+
+    @staticmethod
+    def full_key(scope, query):
+        return f"{scope}:{fingerprint(normalize_query(query))}"
+
+    def get(self, scope, query, embed_query=None):
+        """Return the cached answer or None, embed_query(text) enables the semantic lookup."""
+        key = self.full_key(scope, query)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry['answer']
+        if self.semantic and embed_query is not None:
+            vector = embed_query(normalize_query(query))
+            with self.lock:
+                best_key, best_score = None, self.semantic_threshold
+                for candidate, candidate_vector in list(self.vectors.get(scope, {}).items()):
+                    if candidate not in self.cache:
+                        continue
+                    score = cosine_similarity(vector, candidate_vector)
+                    if score >= best_score:
+                        best_key, best_score = candidate, score
+                if best_key is not None:
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return self.cache[best_key]['answer']
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, scope, query, answer, embed_query=None):
+        key = self.full_key(scope, query)
+        vector = embed_query(normalize_query(query)) if self.semantic and embed_query is not None else None
+        with self.lock:
+            self.cache[key] = {'answer': answer, 'created_at': time.time()}
+            if vector is not None:
+                vectors = self.vectors.setdefault(scope, OrderedDict())
+                vectors[key] = vector
+                while len(vectors) > self.semantic_scope_size:
+                    vectors.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.vectors.clear()
+
+    def load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Error loading the answer cache {self.persist_path}: {e}")
+            return
+        now = time.time()
+        # the reloaded entries get a new ttl, only skip the ones which are already expired
+        for key, entry in entries.items():
+            if now - entry.get('created_at', 0) < self.ttl:
+                self.cache[key] = entry
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self.lock:
+            entries = {key: entry for key, entry in self.cache.items()}
+        os.makedirs(os.path.dirname(self.persist_path) or '.', exist_ok=True)
+        tmp_path = self.persist_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.persist_path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.cache),
+            'hits': self.hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'semantic': self.semantic,
+        }
@@ -0,0 +1,290 @@
+import ast
+import os
+from collections import deque
+
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+# how many re-exports (from .mod import name in a package) are followed
+MAX_REEXPORT_DEPTH = 5
+
+KIND_COLORS = {'class': 'lightblue', 'method': 'lightgreen', 'function': 'lightcoral'}
+
+
+def module_name(rel_path):
+    """utils/helper.py -> (utils.helper, False), utils/__init__.py -> (utils, True)."""
+    parts = rel_path[:-3].replace(os.sep, '/').split('/')
+    if parts[-1] == '__init__':
+        return '.'.join(parts[:-1]), True
+    return '.'.join(parts), False
+
+
+def resolve_relative(module, is_package, level, target):
+    """The absolute module of `from ..target import x` inside module."""
+    if not level:
+        return target or ''
+    package = module.split('.') if is_package else module.split('.')[:-1]
+    if level > 1:
+        package = package[:-(level - 1)] if level - 1 <= len(package) else []
+    base = '.'.join(p for p in package if p)
+    if target:
+        return f'{base}.{target}' if base else target
+    return base
+
+
+def call_name(func):
+    """a.b.c() -> 'a.b.c', f() -> 'f', None for calls on other expressions."""
+    parts = []
+    while isinstance(func, ast.Attribute):
+        parts.append(func.attr)
+        func = func.value
+    if not isinstance(func, ast.Name):
+        return None
+    parts.append(func.id)
+    return '.'.join(reversed(parts))
+
+
+def extract_python_symbols(tree, rel_path):
+    """
+    The definitions, imports and calls of one module, as plain values so they can
+    be stored and linked with the other modules later. The names in defs, bases
+    and calls are relative to the module, e.g. DataHandler.build_db.
+    """
+    module, is_package = module_name(rel_path)
+    defs = {}
+    bases = {}
+    imports = {}
+    calls = {}
+
+    def visit(node, scope, owner):
+        for child in ast.iter_child_nodes(node):
+            # a class or function inside a function is not reachable by name, its calls count for the function
+            if isinstance(child, ast.ClassDef) and owner is None:
+                name = f'{scope}.{child.name}' if scope else child.name
+                defs[name] = {'kind': 'class', 'line': child.lineno, 'end': child.end_lineno}
+                bases[name] = [base for base in (call_name(b) for b in child.bases) if base]
+                visit(child, name, owner)
+            elif isinstance(child, FUNCTION_NODES) and owner is None:
+                name = f'{scope}.{child.name}' if scope else child.name
+                kind = 'method' if scope and defs.get(scope, {}).get('kind') == 'class' else 'function'
+                defs[name] = {'kind': kind, 'line': child.lineno, 'end': child.end_lineno}
+                calls[name] = []
+                visit(child, name, name)
+            else:
+                if isinstance(child, ast.Import):
+                    for alias in child.names:
+                        if alias.asname:
+                            imports[alias.asname] = alias.name
+                        else:
+                            # import a.b binds a
+                            head = alias.name.split('.')[0]
+                            imports[head] = head
+                elif isinstance(child, ast.ImportFrom):
+                    source = resolve_relative(module, is_package, child.level, child.module)
+                    for alias in child.names:
+                        if alias.name != '*':
+                            imports[alias.asname or alias.name] = f'{source}.{alias.name}' if source else alias.name
+                elif isinstance(child, ast.Call) and owner is not None:
+                    name = call_name(child.func)
+                    if name:
+                        calls[owner].append(name)
+                visit(child, scope, owner)
+
+    visit(tree, '', None)
+    for owner, found in calls.items():
+        # the same call twice is one edge
+        calls[owner] = list(dict.fromkeys(found))
+    return {'path': rel_path, 'module': module, 'is_package': is_package,
+            'defs': defs, 'bases': bases, 'imports': imports, 'calls': calls}
+
+
+class CallGraph:
+    """
+    The symbol table and call graph of a whole repo, linked from the per-file
+    symbols of extract_python_symbols. Every class, method and function is one
+    node id, the edges are adjacency lists in both directions, so a k-hop
+    neighbourhood only touches the nodes it returns.
+    """
+
+    def __init__(self, file_symbols):
+        self.names = []
+        self.ids = {}
+        self.info = []
+        self.modules = {}
+        self.out_edges = []
+        self.in_edges = []
+        for symbols in file_symbols:
+            self.modules[symbols['module']] = symbols
+            for name, info in symbols['defs'].items():
+                self._add_node(f"{symbols['module']}.{name}" if symbols['module'] else name,
+                               dict(info, path=symbols['path']))
+        self.module_suffixes = self._module_suffixes()
+        self.edge_count = 0
+        # the bases first, self.method() calls are looked up through them
+        for symbols in file_symbols:
+            self._link_bases(symbols)
+        for symbols in file_symbols:
+            self._link_calls(symbols)
+
+    def _add_node(self, name, info):
+        if name in self.ids:
+            return self.ids[name]
+        node_id = len(self.names)
+        self.ids[name] = node_id
+        self.names.append(name)
+        self.info.append(info)
+        self.out_edges.append([])
+        self.in_edges.append([])
+        return node_id
+
+    def _add_edge(self, source, target, kind):
+        if source == target or (target, kind) in self.out_edges[source]:
+            return
+        self.out_edges[source].append((target, kind))
+        self.in_edges[target].append((source, kind))
+        self.edge_count += 1
+
+    def _module_suffixes(self):
+        # src/pkg/mod.py is imported as pkg.mod, map the unique suffixes to the modules
+        suffixes = {}
+        for module in self.modules:
+            parts = module.split('.')
+            for i in range(1, len(parts)):
+                suffixes.setdefault('.'.join(parts[i:]), []).append(module)
+        return {suffix: found[0] for suffix, found in suffixes.items() if len(found) == 1}
+
+    def _split_module(self, dotted):
+        """The longest known module prefix of dotted and the rest of the name."""
+        parts = dotted.split('.')
+        for i in range(len(parts), 0, -1):
+            prefix = '.'.join(parts[:i])
+            module = prefix if prefix in self.modules else self.module_suffixes.get(prefix)
+            if module is not None:
+                return module, parts[i:]
+        return None, parts
+
+    def _member(self, class_id, member, seen=None):
+        """The node of member in the class or in its bases."""
+        name = f'{self.names[class_id]}.{member}'
+        if name in self.ids:
+            return self.ids[name]
+        seen = seen or set()
+        seen.add(class_id)
+        for base_id, kind in self.out_edges[class_id]:
+            if kind == 'inherits' and base_id not in seen:
+                found = self._member(base_id, member, seen)
+                if found is not None:
+                    return found
+        return None
+
+    def resolve(self, dotted, depth=0):
+        """The node id of a fully qualified name, following the re-exports of packages."""
+        if dotted in self.ids:
+            return self.ids[dotted]
+        if depth > MAX_REEXPORT_DEPTH:
+            return None
+        module, rest = self._split_module(dotted)
+        if module is None or not rest:
+            return None
+        symbols = self.modules[module]
+        head = rest[0]
+        if head in symbols['defs']:
+            node_id = self.ids.get(f'{module}.{head}' if module else head)
+            # a method reached through the class, e.g. Class.method or a base class member
+            for member in rest[1:]:
+                if node_id is None or self.info[node_id]['kind'] != 'class':
+                    return None
+                node_id = self._member(node_id, member)
+            return node_id
+        if head in symbols['imports']:
+            return self.resolve('.'.join([symbols['imports'][head]] + rest[1:]), depth + 1)
+        return None
+
+    def _resolve_call(self, symbols, owner, call):
+        module = symbols['module']
+        parts = call.split('.')
+        if parts[0] in ('self', 'cls') and symbols['defs'][owner]['kind'] == 'method':
+            if len(parts) != 2:
+                return None
+            class_id = self.ids.get(f"{module}.{owner.rsplit('.', 1)[0]}" if module else owner.rsplit('.', 1)[0])
+            return self._member(class_id, parts[1]) if class_id is not None else None
+        return self._resolve_name(symbols, parts)
+
+    def _resolve_name(self, symbols, parts):
+        # a bare name is a module level definition or an import, the class attributes are not in scope
+        if parts[0] in symbols['defs']:
+            return self.resolve('.'.join(([symbols['module']] if symbols['module'] else []) + parts))
+        if parts[0] in symbols['imports']:
+            return self.resolve('.'.join([symbols['imports'][parts[0]]] + parts[1:]))
+        return None
+
+    def _link_bases(self, symbols):
+        module = symbols['module']
+        for name, bases in symbols['bases'].items():
+            class_id = self.ids[f'{module}.{name}' if module else name]
+            for base in bases:
+                base_id = self._resolve_name(symbols, base.split('.'))
+                if base_id is not None and self.info[base_id]['kind'] == 'class':
+                    self._add_edge(class_id, base_id, 'inherits')
+
+    def _link_calls(self, symbols):
+        module = symbols['module']
+        for owner, found in symbols['calls'].items():
+            owner_id = self.ids[f'{module}.{owner}' if module else owner]
+            for call in found:
+                target = self._resolve_call(symbols, owner, call)
+                if target is not None:
+                    self._add_edge(owner_id, target, 'calls')
+
+    def find(self, symbol, limit=20):
+        """The qualified names matching symbol exactly or by its last parts, e.g. DataHandler.build_db."""
+        if symbol in self.ids:
+            return [symbol]
+        suffix = '.' + symbol
+        return [name for name in self.names if name.endswith(suffix)][:limit]
+
+    def subgraph(self, symbol, hops=1, direction='both', max_nodes=100, max_edges=300):
+        """
+        The nodes within hops calls of symbol (callees 'out', callers 'in' or 'both')
+        in the GoJS format of parse_python_code, breadth first until max_nodes,
+        with at most max_edges edges between them.
+        """
+        start = self.ids[symbol]
+        depth = {start: 0}
+        queue = deque([start])
+        truncated = False
+        while queue:
+            node_id = queue.popleft()
+            if depth[node_id] >= hops:
+                continue
+            neighbours = []
+            if direction in ('out', 'both'):
+                neighbours += self.out_edges[node_id]
+            if direction in ('in', 'both'):
+                neighbours += self.in_edges[node_id]
+            for other, _ in neighbours:
+                if other in depth:
+                    continue
+                if len(depth) >= max_nodes:
+                    truncated = True
+                    break
+                depth[other] = depth[node_id] + 1
+                queue.append(other)
+
+        links = []
+        for node_id in depth:
+            for target, kind in self.out_edges[node_id]:
+                if target in depth:
+                    if len(links) >= max_edges:
+                        truncated = True
+                        break
+                    links.append({'from': self.names[node_id], 'to': self.names[target], 'category': 'dashed',
+                                  'color': 'gray' if kind == 'inherits' else 'green', 'kind': kind})
+        nodes = []
+        for node_id, hop in depth.items():
+            info = self.info[node_id]
+            nodes.append({'key': self.names[node_id], 'name': self.names[node_id].rsplit('.', 1)[-1],
+                          'class': info['kind'], 'color': KIND_COLORS[info['kind']],
+                          'path': info['path'], 'line': info['line'], 'end_line': info['end'], 'hops': hop})
+        return {'nodeDataArray': nodes, 'linkDataArray': links, 'truncated': truncated}
+
+    def stats(self):
+        return {'modules': len(self.modules), 'symbols': len(self.names), 'edges': self.edge_count}
@@ -0,0 +1,147 @@
+import ast
+import os
+from langchain_core.documents import Document
+from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
+from utils.codegraph import python_symbol_ranges
+from utils.go_codegraph import go_parser, run_go_parser, extract_receiver_type, extract_method_name
+from utils.metrics import logger
+
+
+class CodeChunker:
+    """
+    Split source files at function/class boundaries, one chunk per symbol with its
+    name and line range in the metadata. Module level code between the symbols is
+    grouped into "<module>" chunks, symbols larger than chunk_size are split by
+    method (classes) or by the text splitter. Files of other languages, or which
+    do not parse, go through the previous text splitters. The Go files of a
+    whole repo can be parsed ahead with one request to the parser worker.
+    """
+
+    def __init__(self, chunk_size, chunk_overlap, syntax_aware=True):
+        self.chunk_size = chunk_size
+        self.text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        # the default splitter of TextLoader.load_and_split, which ran before the text splitter
+        self.pre_splitter = RecursiveCharacterTextSplitter()
+        self.languages = {
+            '.py': ('python', self.python_symbols),
+            '.go': ('go', self.go_symbols),
+        } if syntax_aware else {}
+        # path -> raw nodes of the Go files parsed by prefetch_go, each taken once
+        self.go_nodes = {}
+
+    def prefetch_go(self, root_dir):
+        """Parse every .go file under root_dir concurrently in the parser worker, instead of one request per file."""
+        if '.go' not in self.languages:
+            return
+        try:
+            parsed = go_parser.parse_directory(root_dir)
+        except (OSError, TimeoutError) as e:
+            logger.warning(f"Parsing the Go files of {root_dir} at once failed, parsing them one by one: {e}")
+            return
+        self.go_nodes = {os.path.normpath(path): nodes for path, nodes in parsed.items()}
+        logger.info(f"Parsed {len(self.go_nodes)} Go files under {root_dir}")
+
+    def split_documents(self, docs):
+        chunks = []
+        for doc in docs:
+            source = doc.metadata.get('source', '')
+            language = self.languages.get(os.path.splitext(source)[1])
+            symbols = None
+            if language:
+                try:
+                    symbols = language[1](doc)
+                except Exception as e:
+                    logger.warning(f"Falling back to the text splitter for {source}: {e}")
+            if symbols is None:
+                chunks.extend(self.fallback_split([doc]))
+            else:
+                chunks.extend(self.symbol_chunks(doc, language[0], symbols))
+        return chunks
+
+    def fallback_split(self, docs):
+        return self.text_splitter.split_documents(self.pre_splitter.split_documents(docs))
+
+    # [{'name', 'kind', 'start', 'end', 'children'}], 1-based inclusive lines
+    def python_symbols(self, doc):
+        return python_symbol_ranges(ast.parse(doc.page_content))
+
+    def go_symbols(self, doc):
+        symbols = []
+        source = doc.metadata['source']
+        nodes = self.go_nodes.pop(os.path.normpath(source), None)
+        if nodes is None:
+            nodes = run_go_parser(source)
+        for key, node in nodes.items():
+            if node['Type'] == 'import' or not node.get('StartLine'):
+                continue
+            # the repeated names (several init functions) are keyed name#line
+            name = node['Name']
+            if node['Type'] == 'method':
+                key = key.split('#', 1)[0]
+                name = f"{extract_receiver_type(key)}.{extract_method_name(key)}"
+            kind = {'func': 'function'}.get(node['Type'], node['Type'])
+            symbols.append({'name': name, 'kind': kind, 'start': node['StartLine'],
+                            'end': node['EndLine'], 'children': []})
+        # grouped type declarations share lines, keep the first of the overlapping ones
+        symbols.sort(key=lambda s: (s['start'], -s['end']))
+        kept = []
+        for symbol in symbols:
+            if not kept or symbol['start'] > kept[-1]['end']:
+                kept.append(symbol)
+        return kept
+
+    def symbol_chunks(self, doc, language, symbols):
+        lines = doc.page_content.splitlines(keepends=True)
+        segments = []
+        previous_end = 0
+        for symbol in sorted(symbols, key=lambda s: s['start']):
+            if symbol['start'] - 1 > previous_end:
+                segments.append({'name': '<module>', 'kind': 'module', 'start': previous_end + 1,
+                                 'end': symbol['start'] - 1, 'children': []})
+            segments.append(symbol)
+            previous_end = max(previous_end, symbol['end'])
+        if previous_end < len(lines):
+            segments.append({'name': '<module>', 'kind': 'module', 'start': previous_end + 1,
+                             'end': len(lines), 'children': []})
+
+        chunks = []
+        for segment in segments:
+            chunks.extend(self.segment_chunks(doc, language, lines, segment))
+        return chunks
+
+    def segment_chunks(self, doc, language, lines, segment):
+        text = ''.join(lines[segment['start'] - 1:segment['end']])
+        if not text.strip():
+            return []
+        if len(text) <= self.chunk_size:
+            return [self.make_chunk(doc, language, segment, text)]
+
+        if segment['children']:
+            # an oversized class, the header and each method become their own chunks
+            chunks = []
+            pieces = []
+            cursor = segment['start']
+            for child in segment['children']:
+                if child['start'] > cursor:
+                    pieces.append(dict(segment, start=cursor, end=child['start'] - 1, children=[]))
+                pieces.append(child)
+                cursor = child['end'] + 1
+            if cursor <= segment['end']:
+                pieces.append(dict(segment, start=cursor, end=segment['end'], children=[]))
+            for piece in pieces:
+                chunks.extend(self.segment_chunks(doc, language, lines, piece))
+            return chunks
+
+        chunk_doc = self.make_chunk(doc, language, segment, text)
+        return self.text_splitter.split_documents([chunk_doc])
+
+    def make_chunk(self, doc, language, segment, text):
+        metadata = dict(doc.metadata)
+        metadata.update({
+            'language': language,
+            'symbol': segment['name'],
+            'symbol_type': segment['kind'],
+            'start_line': segment['start'],
+            'end_line': segment['end'],
+        })
+        return Document(page_content=text, metadata=metadata)
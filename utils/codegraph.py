@@ -1,11 +1,62 @@
 import ast 
 import os
+from utils.metrics import logger
 
 def parse_python_code(filepath):
     """Parse Python code file, extract classes, methods, global functions, imported modules and their source code, and the call relationships."""
     with open(filepath, 'r', encoding='utf-8') as file:
         source = file.read()
-    node = ast.parse(source)
+    return parse_python_source(source)
+
+def collect_python_calls(tree):
+    """
+    One traversal of the module: returns the classes in ast.walk order and the
+    calls of every method and global function. A call counts for all of its
+    enclosing methods/functions, and the calls of each keep the ast.walk order,
+    sorted by (depth, preorder) afterwards, as walking each body separately would.
+    """
+    classes = []
+    calls = {}
+    owners = []
+    order = 0
+    # (node, depth, is an owner) with the owners popped again by the None marker
+    stack = [(tree, 0, None)]
+    while stack:
+        item, depth, owner = stack.pop()
+        if item is None:
+            owners.pop()
+            continue
+        order += 1
+        if isinstance(item, ast.ClassDef):
+            classes.append((depth, order, item))
+        elif isinstance(item, ast.Call) and owners:
+            name = None
+            if isinstance(item.func, ast.Name):
+                name = item.func.id
+            elif isinstance(item.func, ast.Attribute):
+                name = item.func.attr
+            if name is not None:
+                for current in owners:
+                    calls[current].append((depth, order, name))
+        if owner:
+            owners.append(id(item))
+            calls[id(item)] = []
+            stack.append((None, depth, None))
+        children = list(ast.iter_child_nodes(item))
+        for child in reversed(children):
+            # the methods of a class and the functions at module level own their calls
+            is_owner = isinstance(child, ast.FunctionDef) and isinstance(item, (ast.ClassDef, ast.Module))
+            stack.append((child, depth + 1, is_owner))
+    classes.sort(key=lambda entry: entry[:2])
+    return [entry[2] for entry in classes], {
+        key: [name for _, _, name in sorted(found)] for key, found in calls.items()}
+
+def parse_python_source(source, tree=None):
+    """The code graph of the source of one Python module, see parse_python_code."""
+    node = tree if tree is not None else ast.parse(source)
+    # split once, every class, method and function slices the same lines
+    lines = source.splitlines()
+    class_nodes, calls = collect_python_calls(node)
 
     classes = []
     methods = []
@@ -18,55 +69,31 @@ def parse_python_code(filepath):
     class_inheritance = {}
 
     # Extract classes and methods
-    for item in ast.walk(node):
-        if isinstance(item, ast.ClassDef):
-            class_start_line = item.lineno - 1
-            class_end_line = item.end_lineno
-            class_source = "\n".join(source.splitlines()[class_start_line:class_end_line])
-            classes.append({'key': item.name, 'name': item.name, 'class': 'class', 'color': 'lightblue', 'source': class_source})
-
-            for base in item.bases:
-                if isinstance(base, ast.Name):
-                    class_inheritance[item.name] = base.id
-
-            for method in [n for n in item.body if isinstance(n, ast.FunctionDef)]:
-                method_start_line = method.lineno - 1
-                method_end_line = method.end_lineno
-                method_source = "\n".join(source.splitlines()[method_start_line:method_end_line])
-                methods.append({'key': f"{item.name}.{method.name}", 'name': method.name, 'class': 'method', 'color': 'lightgreen', 'source': method_source})
-                links.append({'from': item.name, 'to': f"{item.name}.{method.name}", 'color': 'blue'})
-
-                method_calls[f"{item.name}.{method.name}"] = []
-                for stmt in ast.walk(method):
-                    if isinstance(stmt, ast.Call):
-                        if isinstance(stmt.func, ast.Name):
-                            method_calls[f"{item.name}.{method.name}"].append(stmt.func.id)
-                        elif isinstance(stmt.func, ast.Attribute):
-                            method_calls[f"{item.name}.{method.name}"].append(stmt.func.attr)
+    for item in class_nodes:
+        class_source = "\n".join(lines[item.lineno - 1:item.end_lineno])
+        classes.append({'key': item.name, 'name': item.name, 'class': 'class', 'color': 'lightblue', 'source': class_source})
+
+        for base in item.bases:
+            if isinstance(base, ast.Name):
+                class_inheritance[item.name] = base.id
+
+        for method in [n for n in item.body if isinstance(n, ast.FunctionDef)]:
+            method_source = "\n".join(lines[method.lineno - 1:method.end_lineno])
+            methods.append({'key': f"{item.name}.{method.name}", 'name': method.name, 'class': 'method', 'color': 'lightgreen', 'source': method_source})
+            links.append({'from': item.name, 'to': f"{item.name}.{method.name}", 'color': 'blue'})
+            method_calls[f"{item.name}.{method.name}"] = calls[id(method)]
 
     # Handle inheritance relationships
     for child, parent in class_inheritance.items():
         links.append({'from': child, 'to': parent, 'category': 'dashed', 'color': 'gray'})
 
-    # Extract global functions
+    # Extract global functions and imported modules, classes, functions, or variables
     for item in node.body:
         if isinstance(item, ast.FunctionDef):
-            function_start_line = item.lineno - 1
-            function_end_line = item.end_lineno
-            function_source = "\n".join(source.splitlines()[function_start_line:function_end_line])
+            function_source = "\n".join(lines[item.lineno - 1:item.end_lineno])
             functions.append({'key': item.name, 'name': item.name, 'class': 'function', 'color': 'lightcoral', 'source': function_source})
-
-            function_calls[item.name] = []
-            for stmt in ast.walk(item):
-                if isinstance(stmt, ast.Call):
-                    if isinstance(stmt.func, ast.Name):
-                        function_calls[item.name].append(stmt.func.id)
-                    elif isinstance(stmt.func, ast.Attribute):
-                        function_calls[item.name].append(stmt.func.attr)
-
-    # Extract imported modules, classes, functions, or variables
-    for item in node.body:
-        if isinstance(item, ast.Import):
+            function_calls[item.name] = calls[id(item)]
+        elif isinstance(item, ast.Import):
             for alias in item.names:
                 imports.append({'key': alias.name, 'name': alias.name, 'class': 'import', 'color': 'lightyellow', 'source': f"import {alias.name}"})
         elif isinstance(item, ast.ImportFrom):
@@ -78,10 +105,10 @@ def parse_python_code(filepath):
 
     # Check which imports are actually called
     used_imports = set()
-    for calls in method_calls.values():
-        used_imports.update(calls)
-    for calls in function_calls.values():
-        used_imports.update(calls)
+    for calls_of in method_calls.values():
+        used_imports.update(calls_of)
+    for calls_of in function_calls.values():
+        used_imports.update(calls_of)
 
     # Filter out unused imports
     imports = [imp for imp in imports if imp['key'] in used_imports]
@@ -97,42 +124,38 @@ def parse_python_code(filepath):
             if callee in method_calls or callee in function_calls or callee in import_calls:
                 links.append({'from': caller, 'to': callee, 'category': 'dashed', 'color': 'green'})
 
-    for import_name, import_module in import_calls.items():
-        if import_name in used_imports:
-            for caller, callees in method_calls.items():
-                if import_name in callees:
-                    links.append({'from': caller, 'to': import_name, 'category': 'dashed', 'color': 'orange'})
-            for caller, callees in function_calls.items():
-                if import_name in callees:
-                    links.append({'from': caller, 'to': import_name, 'category': 'dashed', 'color': 'orange'})
+    # the callers of each import, in one pass over the calls instead of one per import
+    import_callers = {}
+    for caller, callees in list(method_calls.items()) + list(function_calls.items()):
+        for callee in set(callees):
+            if callee in import_calls:
+                import_callers.setdefault(callee, []).append(caller)
+    for import_name in import_calls:
+        for caller in import_callers.get(import_name, []):
+            links.append({'from': caller, 'to': import_name, 'category': 'dashed', 'color': 'orange'})
 
     return {'nodeDataArray': classes + methods + functions + imports, 'linkDataArray': links}
 
+def python_symbol_ranges(tree):
+    """Return the top level functions and classes (with their methods) of a parsed module and their 1-based line ranges, decorators included."""
+    def symbol(item, kind, name):
+        start = min([item.lineno] + [d.lineno for d in item.decorator_list])
+        return {'name': name, 'kind': kind, 'start': start, 'end': item.end_lineno, 'children': []}
+
+    symbols = []
+    for item in tree.body:
+        if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols.append(symbol(item, 'function', item.name))
+        elif isinstance(item, ast.ClassDef):
+            class_symbol = symbol(item, 'class', item.name)
+            for method in item.body:
+                if isinstance(method, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    class_symbol['children'].append(symbol(method, 'method', f"{item.name}.{method.name}"))
+            symbols.append(class_symbol)
+    return symbols
+
 def read_current_repo_path(current_session):
     if current_session:
-        print("=============> path: ", os.path.join("projects", current_session['name']))
+        logger.debug(f"Current repo path: {os.path.join('projects', current_session['name'])}")
         return os.path.join("projects", current_session['name'])
     return None
-
-def build_file_tree(directory):
-    """Build the file tree for the given directory"""
-    file_tree = []
-    for root, dirs, files in os.walk(directory):
-        for d in dirs:
-            dir_path = os.path.join(root, d)
-            file_tree.append({
-                'name': d,
-                'path': dir_path,
-                'type': 'directory',
-                'children': build_file_tree(dir_path)
-            })
-        for f in files:
-            if f.endswith('.py'):
-                file_path = os.path.join(root, f)
-                file_tree.append({
-                    'name': f,
-                    'path': file_path,
-                    'type': 'file'
-                })
-        break  # Only traverse current directory, not recursively
-    return file_tree
\ No newline at end of file
@@ -0,0 +1,251 @@
+import ast
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from utils.codegraph import parse_python_source
+from utils.callgraph import CallGraph, extract_python_symbols
+from utils.metrics import logger, span
+
+# the index sits next to the chroma files of each repo
+CODEGRAPH_INDEX_NAME = 'codegraph.sqlite'
+# below this many changed files the process pool costs more than it saves
+MIN_PARALLEL_FILES = 16
+
+
+def codegraph_index_path(db_dir):
+    return os.path.join(db_dir, CODEGRAPH_INDEX_NAME)
+
+
+def compress_json(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def parse_file_graph(filepath, rel_path, known_sha256=None):
+    """
+    Hash and parse one file, returns (sha256, graph, symbols), the file graph and
+    its symbols for the call graph as compressed JSON. Both are None when the
+    content still hashes to known_sha256, b'' when it does not parse. Runs in the
+    worker processes, so it only takes and returns plain values.
+    """
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+    if sha256 == known_sha256:
+        return sha256, None, None
+    try:
+        source = content.decode('utf-8')
+        tree = ast.parse(source)
+        graph = parse_python_source(source, tree)
+        symbols = extract_python_symbols(tree, rel_path)
+    except (SyntaxError, ValueError, UnicodeDecodeError):
+        return sha256, b'', b''
+    return sha256, compress_json(graph), compress_json(symbols)
+
+
+def iter_python_files(root_dir):
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = sorted(d for d in dirnames if d != '.git')
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                yield os.path.join(dirpath, filename)
+
+
+class CodeGraphIndex:
+    """
+    The Python code graphs of one repo, parsed once at ingestion and kept in a
+    sqlite table next to its vector store: path -> (mtime, size, sha256, zlib
+    compressed graph JSON and symbols). build() only parses the files whose
+    mtime/size changed and whose content hash differs, get() is one primary key
+    lookup and re-parses a single file when it changed on disk since. The repo
+    wide call graph is linked from the stored symbols once per change of the index.
+    """
+
+    def __init__(self, db_dir, root_dir):
+        os.makedirs(db_dir, exist_ok=True)
+        self.path = codegraph_index_path(db_dir)
+        self.root_dir = root_dir
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS graphs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                graph BLOB NOT NULL,
+                symbols BLOB
+            )
+        ''')
+        # the indexes built before the call graph get their symbols with the next build
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(graphs)')]
+        if 'symbols' not in columns:
+            self.conn.execute('ALTER TABLE graphs ADD COLUMN symbols BLOB')
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        # bumped on every write, the call graph is linked again for the next query
+        self.generation = 0
+        self.linked = None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _entries(self):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path, mtime_ns, size, sha256, symbols IS NOT NULL FROM graphs').fetchall()
+        # the rows without symbols are parsed again, as if their file changed
+        return {path: (mtime_ns, size, sha256 if has_symbols else None)
+                for path, mtime_ns, size, sha256, has_symbols in rows}
+
+    def _store(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO graphs (path, mtime_ns, size, sha256, graph, symbols) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+            self.generation += 1
+
+    def build(self, workers=None):
+        """Bring the index up to date with the working tree, returns the counts of the changes."""
+        known = self._entries()
+        seen = set()
+        changed = []
+        with span('codegraph_scan'):
+            for filepath in iter_python_files(self.root_dir):
+                rel_path = os.path.relpath(filepath, self.root_dir)
+                seen.add(rel_path)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                entry = known.get(rel_path)
+                if entry is None or entry[2] is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+                    changed.append((rel_path, stat))
+
+        rows = []
+        touched = []
+        with span('codegraph_parse'):
+            paths = [os.path.join(self.root_dir, rel_path) for rel_path, _ in changed]
+            hashes = [known.get(rel_path, (None, None, None))[2] for rel_path, _ in changed]
+            if len(changed) >= MIN_PARALLEL_FILES and (workers or 0) != 1:
+                # the build runs on an ingestion thread of the server, a forked child could inherit
+                # a lock another thread holds (sqlite, logging, the model pools), spawn starts clean
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                    results = list(executor.map(parse_file_graph, paths, [p for p, _ in changed], hashes,
+                                                chunksize=8))
+            else:
+                results = [parse_file_graph(path, rel_path, sha256)
+                           for path, (rel_path, _), sha256 in zip(paths, changed, hashes)]
+            for (rel_path, stat), (sha256, graph, symbols) in zip(changed, results):
+                if graph is None:
+                    # touched but the same content, only the stat moves on
+                    touched.append((stat.st_mtime_ns, stat.st_size, rel_path))
+                else:
+                    rows.append((rel_path, stat.st_mtime_ns, stat.st_size, sha256, graph, symbols))
+
+        removed = [(rel_path,) for rel_path in known if rel_path not in seen]
+        self._store(rows)
+        with self.lock:
+            self.conn.executemany('UPDATE graphs SET mtime_ns = ?, size = ? WHERE path = ?', touched)
+            self.conn.executemany('DELETE FROM graphs WHERE path = ?', removed)
+            self.conn.commit()
+            if removed:
+                self.generation += 1
+        logger.info(f"Code graph index of {self.root_dir}: {len(rows)} parsed, {len(touched)} unchanged content, "
+                    f"{len(removed)} removed, {len(seen)} files")
+        return {'parsed': len(rows), 'touched': len(touched), 'removed': len(removed), 'files': len(seen)}
+
+    def get(self, rel_path):
+        """The graph JSON (bytes) of the file, None when it is no Python file of the repo or does not parse."""
+        filepath = os.path.join(self.root_dir, rel_path)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT mtime_ns, size, sha256, graph, symbols FROM graphs WHERE path = ?', (rel_path,)).fetchone()
+        if row is not None and row[:2] == (stat.st_mtime_ns, stat.st_size):
+            self.hits += 1
+            graph = row[3]
+        else:
+            self.misses += 1
+            sha256, graph, symbols = parse_file_graph(filepath, rel_path, row[2] if row and row[4] else None)
+            if graph is None:
+                graph, symbols = row[3], row[4]
+            self._store([(rel_path, stat.st_mtime_ns, stat.st_size, sha256, graph, symbols)])
+        return zlib.decompress(graph) if graph else None
+
+    def call_graph(self):
+        """The repo wide CallGraph, linked again only when the index changed since the last call."""
+        with self.lock:
+            if self.linked is not None and self.linked[0] == self.generation:
+                return self.linked[1]
+            generation = self.generation
+            rows = self.conn.execute('SELECT symbols FROM graphs WHERE symbols IS NOT NULL').fetchall()
+        with span('callgraph_link'):
+            graph = CallGraph([json.loads(zlib.decompress(row[0])) for row in rows if row[0]])
+        with self.lock:
+            if self.generation == generation:
+                self.linked = (generation, graph)
+        return graph
+
+    def stats(self):
+        with self.lock:
+            files, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(graph)), 0) FROM graphs').fetchone()
+        stats = {'path': self.path, 'files': files, 'compressed_bytes': size, 'hits': self.hits, 'misses': self.misses}
+        if self.linked is not None:
+            stats['call_graph'] = self.linked[1].stats()
+        return stats
+
+
+# one open index per repo, shared by the ingest jobs and the /data requests
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def open_codegraph_index(db_dir, root_dir):
+    path = codegraph_index_path(db_dir)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        # the vector store directory may have been removed for a rebuild
+        if index is not None and not os.path.exists(path):
+            index.close()
+            index = None
+        if index is None:
+            index = _indexes[path] = CodeGraphIndex(db_dir, root_dir)
+        return index
+
+
+def repo_codegraph_index(repo_name, project_dir, vectorstore_dir):
+    """The index of the repo, None when it was not built yet."""
+    db_dir = os.path.join(vectorstore_dir, repo_name)
+    if not os.path.exists(codegraph_index_path(db_dir)):
+        return None
+    return open_codegraph_index(db_dir, os.path.join(project_dir, repo_name))
+
+
+def indexed_graph(filepath, project_dir, vectorstore_dir):
+    """
+    The indexed graph JSON of projects/<repo>/<path>, None when the file is not
+    inside a repo with a code graph index (the caller parses it itself then).
+    """
+    rel_path = os.path.relpath(os.path.abspath(filepath), os.path.abspath(project_dir))
+    parts = rel_path.split(os.sep)
+    if len(parts) < 2 or parts[0] in ('..', '.'):
+        return None
+    index = repo_codegraph_index(parts[0], project_dir, vectorstore_dir)
+    if index is None:
+        return None
+    return index.get(os.path.join(*parts[1:]))
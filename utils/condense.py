@@ -0,0 +1,138 @@
+import contextvars
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from utils.metrics import logger, observe
+
+# always: condense every follow-up question, like ConversationalRetrievalChain
+# auto: skip the condensing call for self-contained questions
+# parallel: like auto, and retrieve with the raw question while condensing
+STRATEGIES = ('always', 'auto', 'parallel')
+
+# words pointing back at the earlier turns
+REFERENCE_RE = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|above|previous|previously|"
+    r"earlier|same|again|else|instead|former|latter)\b", re.I)
+FOLLOW_UP_RE = re.compile(r"^\s*(and|but|or|so|then|also|what about|how about|what if|ok|okay)\b", re.I)
+
+
+def is_self_contained(question, min_words=4):
+    """A cheap check that the question can be answered without the chat history."""
+    if len(question.split()) < min_words:
+        return False
+    return not FOLLOW_UP_RE.match(question) and not REFERENCE_RE.search(question)
+
+
+def format_history(chat_history):
+    return "\n".join(f"Human: {human}\nAssistant: {ai}" for human, ai in chat_history)
+
+
+def merge_documents(first, second):
+    """Interleave two result lists without duplicates, keeping as many documents as the longer one."""
+    merged, seen = [], set()
+    for pair in zip(first, second):
+        for doc in pair:
+            key = (doc.metadata.get('source'), doc.page_content)
+            if key not in seen:
+                seen.add(key)
+                merged.append(doc)
+    longer = first if len(first) > len(second) else second
+    for doc in longer[min(len(first), len(second)):]:
+        key = (doc.metadata.get('source'), doc.page_content)
+        if key not in seen:
+            seen.add(key)
+            merged.append(doc)
+    return merged[:max(len(first), len(second))]
+
+
+class QuestionCondenser:
+    """
+    Turns a follow-up question into a standalone one before the retrieval. The
+    condensing call is a full LLM round trip, so the strategy decides when it
+    is skipped, and the time of each stage is recorded to see what is saved.
+    """
+
+    def __init__(self, strategy='auto', max_workers=4):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown condense strategy {strategy!r}, expected one of {STRATEGIES}")
+        self.strategy = strategy
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='condense')
+        self.lock = threading.Lock()
+        self.metrics = {
+            'turns': 0,
+            'no_history': 0,
+            'self_contained': 0,
+            'condensed': 0,
+            'parallel': 0,
+            'condense_seconds_total': 0.0,
+            'retrieve_seconds_total': 0.0,
+            'hidden_retrieve_seconds_total': 0.0,
+        }
+
+    def condense(self, model, query, chat_history):
+        prompt = CONDENSE_QUESTION_PROMPT.format(chat_history=format_history(chat_history), question=query)
+        return model.invoke(prompt).content
+
+    def mode(self, query, chat_history):
+        if not chat_history:
+            return 'no_history'
+        if self.strategy != 'always' and is_self_contained(query):
+            return 'self_contained'
+        return 'parallel' if self.strategy == 'parallel' else 'condensed'
+
+    def retrieve(self, model, retriever, query, chat_history):
+        """Return (question, docs, timings) where question is the one the answer is generated for."""
+        mode = self.mode(query, chat_history)
+        timings = {'mode': mode, 'condense_seconds': 0.0, 'retrieve_seconds': 0.0, 'hidden_retrieve_seconds': 0.0}
+        started = time.perf_counter()
+
+        def timed_invoke(question):
+            begin = time.perf_counter()
+            docs = retriever.invoke(question)
+            seconds = time.perf_counter() - begin
+            observe('retrieve', seconds)
+            return docs, seconds
+
+        if mode in ('no_history', 'self_contained'):
+            question = query
+            docs, timings['retrieve_seconds'] = timed_invoke(query)
+        else:
+            # run in a copy of the context to keep the trace id of the request
+            raw = (self.executor.submit(contextvars.copy_context().run, timed_invoke, query)
+                   if mode == 'parallel' else None)
+            begin = time.perf_counter()
+            question = self.condense(model, query, chat_history)
+            timings['condense_seconds'] = time.perf_counter() - begin
+            observe('condense', timings['condense_seconds'])
+            docs, timings['retrieve_seconds'] = timed_invoke(question)
+            if raw is not None:
+                raw_docs, raw_seconds = raw.result()
+                # the raw retrieval ran while the question was condensed
+                timings['hidden_retrieve_seconds'] = min(raw_seconds, timings['condense_seconds'])
+                docs = merge_documents(docs, raw_docs)
+        timings['total_seconds'] = time.perf_counter() - started
+
+        with self.lock:
+            self.metrics['turns'] += 1
+            self.metrics[mode] += 1
+            self.metrics['condense_seconds_total'] += timings['condense_seconds']
+            self.metrics['retrieve_seconds_total'] += timings['retrieve_seconds']
+            self.metrics['hidden_retrieve_seconds_total'] += timings['hidden_retrieve_seconds']
+        logger.info(f"Condense mode={mode} condense={timings['condense_seconds'] * 1000:.1f} ms "
+                    f"retrieve={timings['retrieve_seconds'] * 1000:.1f} ms")
+        return question, docs, timings
+
+    def stats(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        condensed = metrics['condensed'] + metrics['parallel']
+        avg_condense = metrics['condense_seconds_total'] / condensed if condensed else 0.0
+        metrics.update({
+            'strategy': self.strategy,
+            'avg_condense_seconds': avg_condense,
+            # each skipped follow-up saves one condensing round trip
+            'estimated_saved_seconds': metrics['self_contained'] * avg_condense,
+        })
+        return metrics
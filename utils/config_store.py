@@ -0,0 +1,196 @@
+import configparser
+import os
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+
+_UNSET = object()
+
+
+class ConfigSnapshot:
+    """
+    A read-only view of one version of an ini file, with the ConfigParser getters
+    (get/getint/getfloat/getboolean with fallback, sections, items, [section]).
+    """
+
+    def __init__(self, sections, version):
+        self._sections = MappingProxyType({name: MappingProxyType(dict(values)) for name, values in sections.items()})
+        self.version = version
+
+    def sections(self):
+        return list(self._sections)
+
+    def has_section(self, section):
+        return section in self._sections
+
+    def has_option(self, section, option):
+        return option in self._sections.get(section, {})
+
+    def items(self, section):
+        if section not in self._sections:
+            raise configparser.NoSectionError(section)
+        return list(self._sections[section].items())
+
+    def as_dict(self):
+        return {section: dict(values) for section, values in self._sections.items()}
+
+    def __getitem__(self, section):
+        if section not in self._sections:
+            raise KeyError(section)
+        return self._sections[section]
+
+    def get(self, section, option, fallback=_UNSET):
+        values = self._sections.get(section)
+        if values is None:
+            if fallback is _UNSET:
+                raise configparser.NoSectionError(section)
+            return fallback
+        if option not in values:
+            if fallback is _UNSET:
+                raise configparser.NoOptionError(option, section)
+            return fallback
+        return values[option]
+
+    def _convert(self, section, option, convert, fallback):
+        if fallback is not _UNSET and not self.has_option(section, option):
+            return fallback
+        return convert(self.get(section, option))
+
+    def getint(self, section, option, fallback=_UNSET):
+        return self._convert(section, option, int, fallback)
+
+    def getfloat(self, section, option, fallback=_UNSET):
+        return self._convert(section, option, float, fallback)
+
+    def getboolean(self, section, option, fallback=_UNSET):
+        def to_bool(value):
+            if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+                raise ValueError(f"Not a boolean: {value}")
+            return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+        return self._convert(section, option, to_bool, fallback)
+
+
+class ConfigStore:
+    """
+    One ini file held in memory as an immutable, versioned snapshot. The file is
+    stat'ed at most every check_interval seconds and reloaded when its mtime or
+    size changed, writes go through a lock and replace the file atomically.
+    Values derived from a snapshot, like compiled prompt templates, are cached
+    per version with cached().
+
+    missing_section names the section of a file written without a header.
+    """
+
+    def __init__(self, path, check_interval=1.0, missing_section=None):
+        self.path = path
+        self.check_interval = check_interval
+        self.missing_section = missing_section
+        self.lock = threading.RLock()
+        self.version = 0
+        self.file_state = None
+        self.checked_at = 0.0
+        self.current = None
+        self.derived = {}
+        self.reloads = 0
+        self._reload()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _parse(self):
+        parser = configparser.ConfigParser()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            if self.missing_section and not content.lstrip().startswith('['):
+                content = f'[{self.missing_section}]\n' + content
+            parser.read_string(content, source=self.path)
+        return parser
+
+    def _reload(self):
+        with self.lock:
+            self.file_state = self._stat()
+            parser = self._parse()
+            self.version += 1
+            self.reloads += 1
+            self.current = ConfigSnapshot({s: dict(parser.items(s)) for s in parser.sections()}, self.version)
+            self.derived = {}
+            self.checked_at = time.monotonic()
+            return self.current
+
+    def snapshot(self):
+        """The current snapshot, reloaded first when the file changed on disk."""
+        now = time.monotonic()
+        if now - self.checked_at >= self.check_interval:
+            with self.lock:
+                self.checked_at = now
+                if self._stat() != self.file_state:
+                    return self._reload()
+        return self.current
+
+    def cached(self, key, build):
+        """build() once per snapshot version, e.g. a compiled prompt template."""
+        snapshot = self.snapshot()
+        with self.lock:
+            entry = self.derived.get(key)
+            if entry is not None and entry[0] == snapshot.version:
+                return entry[1]
+        value = build()
+        with self.lock:
+            if self.current.version == snapshot.version:
+                self.derived[key] = (snapshot.version, value)
+        return value
+
+    def _write(self, parser):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.path), dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                parser.write(f)
+            if os.path.exists(self.path):
+                os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self._reload()
+
+    def update(self, changes):
+        """Set {section: {option: value}} on top of the file, returns the new snapshot."""
+        with self.lock:
+            parser = self._parse()
+            for section, values in changes.items():
+                if not parser.has_section(section):
+                    parser.add_section(section)
+                for option, value in values.items():
+                    parser.set(section, option, value)
+            return self._write(parser)
+
+    def replace_section(self, section, values):
+        """Replace the whole section with values."""
+        with self.lock:
+            parser = self._parse()
+            if parser.has_section(section):
+                parser.remove_section(section)
+            parser[section] = values
+            return self._write(parser)
+
+    def remove_option(self, section, option):
+        """Remove the option, returns False when it does not exist."""
+        with self.lock:
+            parser = self._parse()
+            if not parser.has_option(section, option):
+                return False
+            parser.remove_option(section, option)
+            self._write(parser)
+            return True
+
+    def stats(self):
+        return {'path': self.path, 'version': self.version, 'reloads': self.reloads,
+                'derived': len(self.derived)}
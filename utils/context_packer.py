@@ -0,0 +1,262 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from utils.metrics import observe
+
+# a block that does not fit is cut down to the rest of the budget if that leaves this many tokens
+MIN_TRUNCATED_TOKENS = 64
+
+
+def parse_budgets(text):
+    """Parse "llamacpp=4000, ollama:qwen2.5:14b=6000" into {key: tokens}, split at the last =."""
+    budgets = {}
+    for item in text.split(','):
+        if '=' in item:
+            key, tokens = item.rsplit('=', 1)
+            budgets[key.strip()] = int(tokens)
+    return budgets
+
+
+class TokenCounter:
+    """tiktoken's cl100k_base when it is installed, otherwise about 4 characters per token."""
+
+    def __init__(self, encoding_name='cl100k_base'):
+        self.encoding_name = encoding_name
+        self.encoding = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def _load(self):
+        with self.lock:
+            if not self.loaded:
+                try:
+                    import tiktoken
+                    self.encoding = tiktoken.get_encoding(self.encoding_name)
+                except Exception:
+                    self.encoding = None
+                self.loaded = True
+        return self.encoding
+
+    def __call__(self, text):
+        encoding = self.encoding if self.loaded else self._load()
+        if encoding is None:
+            return (len(text) + 3) // 4
+        return len(encoding.encode(text, disallowed_special=()))
+
+
+class ContextBlock:
+    def __init__(self, source, text, score, rank, start_line=None, end_line=None, symbol=None):
+        self.source = source
+        self.text = text
+        self.score = score
+        self.rank = rank
+        self.start_line = start_line
+        self.end_line = end_line
+        self.symbol = symbol
+
+    def header(self, root=None):
+        source = self.source or 'unknown'
+        if root and self.source:
+            source = os.path.relpath(self.source, root)
+        details = []
+        if self.symbol and self.symbol != '<module>':
+            details.append(self.symbol)
+        if self.start_line and self.end_line:
+            details.append(f"lines {self.start_line}-{self.end_line}")
+        return f"File: {source} ({', '.join(details)})" if details else f"File: {source}"
+
+
+def text_overlap(first, second, min_overlap):
+    """The length of the longest end of first that starts second, 0 below min_overlap."""
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    probe = second[:min_overlap]
+    position = first.find(probe)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+def normalized_hash(text):
+    return hashlib.sha1(re.sub(r'\s+', ' ', text).strip().encode('utf-8')).hexdigest()
+
+
+class ContextPacker:
+    """
+    Builds the context of a question from the retrieved documents: exact and
+    contained duplicates are dropped, chunks of the same file which overlap
+    (chunk_overlap) or follow each other (line ranges) are merged into one block,
+    the metadata is reduced to a path/symbol/lines header, and the blocks with the
+    most score per token are packed into the token budget. The best ranked block
+    always goes in, cut to the budget if needed. The blocks keep their retrieval
+    order in the context.
+    """
+
+    def __init__(self, default_budget=3000, budgets=None, min_overlap=20, counter=None):
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.min_overlap = min_overlap
+        self.count_tokens = counter or TokenCounter()
+        self.lock = threading.Lock()
+        self.metrics = {'requests': 0, 'documents_in': 0, 'blocks_out': 0,
+                        'duplicates_dropped': 0, 'chunks_merged': 0, 'tokens_in': 0, 'tokens_out': 0}
+
+    def budget(self, provider, model_name=None):
+        """The context budget of provider:model, else of the provider, else the default."""
+        return self.budgets.get(f"{provider}:{model_name}", self.budgets.get(provider, self.default_budget))
+
+    def blocks(self, docs):
+        blocks = []
+        for rank, doc in enumerate(docs):
+            metadata = doc.metadata or {}
+            # the reranker scores, otherwise the retrieval order
+            score = metadata.get('relevance_score')
+            blocks.append(ContextBlock(
+                metadata.get('source'), doc.page_content, float(score) if score is not None else 1.0 / (rank + 1),
+                rank, metadata.get('start_line'), metadata.get('end_line'), metadata.get('symbol')))
+        return blocks
+
+    def _merge_pair(self, first, second):
+        """Merge second into first when they overlap or follow each other, returns False otherwise."""
+        if second.text in first.text:
+            pass
+        elif first.text in second.text:
+            first.text = second.text
+        else:
+            overlap = text_overlap(first.text, second.text, self.min_overlap)
+            if overlap:
+                first.text += second.text[overlap:]
+            elif (first.start_line and second.start_line and first.end_line and
+                  second.start_line == first.end_line + 1):
+                first.text = first.text.rstrip('\n') + '\n' + second.text
+            else:
+                return False
+        if first.start_line and second.start_line:
+            first.start_line = min(first.start_line, second.start_line)
+            first.end_line = max(first.end_line or 0, second.end_line or 0)
+        if first.symbol != second.symbol:
+            first.symbol = None
+        first.score += second.score
+        first.rank = min(first.rank, second.rank)
+        return True
+
+    def deduplicate(self, blocks):
+        seen = set()
+        unique = []
+        for block in blocks:
+            key = normalized_hash(block.text)
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(block)
+        return unique
+
+    def merge(self, blocks):
+        by_source = {}
+        for block in blocks:
+            by_source.setdefault(block.source, []).append(block)
+        merged = []
+        for source_blocks in by_source.values():
+            # in file order, so a chunk can only continue the one before it
+            source_blocks.sort(key=lambda b: (b.start_line or 0, b.rank))
+            changed = True
+            while changed and len(source_blocks) > 1:
+                changed = False
+                for i in range(len(source_blocks)):
+                    for j in range(len(source_blocks)):
+                        if i != j and self._merge_pair(source_blocks[i], source_blocks[j]):
+                            del source_blocks[j]
+                            changed = True
+                            break
+                    if changed:
+                        break
+            merged.extend(source_blocks)
+        return merged
+
+    def _truncate(self, block, header, tokens):
+        """The first lines of block which fit in tokens together with the header."""
+        lines = block.text.splitlines()
+        kept = []
+        used = self.count_tokens(header) + 1
+        for line in lines:
+            line_tokens = self.count_tokens(line) + 1
+            if used + line_tokens > tokens:
+                break
+            kept.append(line)
+            used += line_tokens
+        return '\n'.join(kept)
+
+    def _cut(self, text, tokens):
+        """The longest start of text within tokens, for the best block when not even its first line fits."""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle]) <= tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def pack(self, docs, budget=None, root=None):
+        """The context string of docs within budget tokens."""
+        started = time.perf_counter()
+        budget = budget or self.default_budget
+        blocks = self.blocks(docs)
+        unique = self.deduplicate(blocks)
+        merged = self.merge(unique)
+
+        sized = []
+        for block in merged:
+            header = block.header(root)
+            text = f"{header}\n{block.text}"
+            sized.append((block, header, text, self.count_tokens(text)))
+
+        chosen = []
+        remaining = budget
+        best = min(sized, key=lambda entry: entry[0].rank) if sized else None
+        # the most relevant content per token first, the best ranked block before all
+        ordered = sorted(sized, key=lambda entry: (entry is not best, -entry[0].score / max(1, entry[3])))
+        for entry in ordered:
+            block, header, text, tokens = entry
+            if tokens <= remaining:
+                chosen.append((block.rank, text))
+                remaining -= tokens
+                continue
+            if entry is not best and remaining < MIN_TRUNCATED_TOKENS:
+                continue
+            body = self._truncate(block, header, remaining)
+            if body:
+                text = f"{header}\n{body}"
+            elif entry is best:
+                # the header and the first line do not fit, the best block still goes in
+                text = self._cut(text, remaining)
+            else:
+                continue
+            chosen.append((block.rank, text))
+            remaining -= self.count_tokens(text)
+        chosen.sort(key=lambda entry: entry[0])
+        context = "\n\n".join(text for _, text in chosen)
+        tokens_in = sum(self.count_tokens(doc.page_content) for doc in docs)
+
+        with self.lock:
+            self.metrics['requests'] += 1
+            self.metrics['documents_in'] += len(docs)
+            self.metrics['blocks_out'] += len(chosen)
+            self.metrics['duplicates_dropped'] += len(blocks) - len(unique)
+            self.metrics['chunks_merged'] += len(unique) - len(merged)
+            self.metrics['tokens_in'] += tokens_in
+            self.metrics['tokens_out'] += budget - remaining
+        observe('pack', time.perf_counter() - started)
+        return context
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.metrics)
+        stats['default_budget'] = self.default_budget
+        stats['budgets'] = dict(self.budgets)
+        stats['tiktoken'] = getattr(self.count_tokens, 'encoding', None) is not None
+        return stats
@@ -0,0 +1,129 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import psycopg2
+from psycopg2 import pool
+
+
+class DatabasePool:
+    """
+    A psycopg2 connection pool opened at startup. The queries run on a dedicated
+    executor with one thread per connection, so the async handlers await them
+    instead of blocking the event loop. Connections idle for longer than
+    health_check_interval seconds are checked with SELECT 1 before they are used.
+    """
+
+    def __init__(self, min_size=1, max_size=10, health_check_interval=30, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs
+        self.pool = None
+        self.executor = None
+        self.slots = threading.BoundedSemaphore(self.max_size)
+        self.last_used = {}
+        self.lock = threading.Lock()
+        self.metrics = {
+            'checkouts': 0,
+            'in_use': 0,
+            'wait_seconds_total': 0.0,
+            'health_checks': 0,
+            'reconnects': 0,
+            'errors': 0,
+        }
+
+    def open(self):
+        if self.pool is None:
+            self.pool = pool.ThreadedConnectionPool(self.min_size, self.max_size, **self.connect_kwargs)
+            self.executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix='db')
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self.last_used.get(id(conn), 0) < self.health_check_interval:
+            return True
+        with self.lock:
+            self.metrics['health_checks'] += 1
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Check out a healthy connection, commit on success and roll back on errors."""
+        if self.pool is None:
+            self.open()
+        started = time.monotonic()
+        self.slots.acquire()
+        try:
+            conn = self.pool.getconn()
+            reconnected = not self._healthy(conn)
+            if reconnected:
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            with self.lock:
+                self.metrics['reconnects'] += reconnected
+                self.metrics['checkouts'] += 1
+                self.metrics['in_use'] += 1
+                self.metrics['wait_seconds_total'] += time.monotonic() - started
+            broken = False
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                with self.lock:
+                    self.metrics['errors'] += 1
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+                raise
+            finally:
+                self.last_used[id(conn)] = time.monotonic()
+                with self.lock:
+                    self.metrics['in_use'] -= 1
+                self.pool.putconn(conn, close=broken or conn.closed)
+        finally:
+            self.slots.release()
+
+    def run_sync(self, func, *args):
+        """Call func(cursor, *args) in a transaction on the calling thread."""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                return func(cursor, *args)
+
+    async def run(self, func, *args):
+        """Call func(cursor, *args) in a transaction on the database executor."""
+        if self.pool is None:
+            self.open()
+        loop = asyncio.get_running_loop()
+        # keep the context, e.g. the trace id of the request, on the executor thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, partial(context.run, self.run_sync, func, *args))
+
+    def stats(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics.update({
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'open': self.pool is not None,
+            'avg_wait_seconds': metrics['wait_seconds_total'] / metrics['checkouts'] if metrics['checkouts'] else 0.0,
+        })
+        return metrics
@@ -0,0 +1,171 @@
+import fnmatch
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_IGNORE = ['.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv',
+                  '.mypy_cache', '.pytest_cache', '.tox', '.idea', '.vscode']
+
+
+def parse_patterns(text):
+    """Parse ".git, node_modules, build/*" into a list of patterns."""
+    return [pattern.strip() for pattern in text.split(',') if pattern.strip()]
+
+
+def child_path(rel, name):
+    """The path relative to the root of name in the directory rel ('.' for the root)."""
+    return os.path.normpath(os.path.join(rel, name))
+
+
+class DirectoryTree:
+    """
+    One directory level at a time of the source files (extensions) of a repo.
+    The scan of each directory, its matching files and sub directories, is kept
+    until the mtime of the directory changes. The number of matching files under
+    each directory is summed once per repo, by build() at ingestion or else by
+    the first listing, and the change a rescan finds is carried to the counts of
+    the directory and of all its parents; the directories without any are left
+    out. The scans and counts of the max_repos most recently used repos are
+    kept. Names or paths relative to the root matching an ignore pattern are
+    skipped.
+    """
+
+    def __init__(self, extensions, ignore=None, page_size=200, max_repos=8):
+        self.extensions = tuple(extensions)
+        self.ignore = list(DEFAULT_IGNORE if ignore is None else ignore)
+        self.page_size = page_size
+        self.max_repos = max(1, max_repos)
+        self.lock = threading.Lock()
+        # real root -> {'scans': {relative directory: (mtime_ns, [file names], [sub directory names])},
+        #               'counts': {relative directory: matching files below it}}, least recently used first
+        self.repos = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def is_ignored(self, rel_path, name):
+        rel_path = rel_path.replace(os.sep, '/')
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern) for pattern in self.ignore)
+
+    def _repo(self, root, repo=None):
+        """The kept state of root, replaced by repo when given."""
+        key = os.path.realpath(root)
+        with self.lock:
+            if repo is None:
+                repo = self.repos.get(key) or {'scans': {}, 'counts': {}}
+            self.repos[key] = repo
+            self.repos.move_to_end(key)
+            while len(self.repos) > self.max_repos:
+                self.repos.popitem(last=False)
+        return repo
+
+    def _scan(self, root, repo, rel):
+        directory = os.path.join(root, rel)
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            scan = repo['scans'].get(rel)
+        if scan is not None and scan[0] == mtime_ns:
+            self.hits += 1
+            return scan
+        self.misses += 1
+        files = []
+        dirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if self.is_ignored(child_path(rel, entry.name), entry.name):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif entry.name.endswith(self.extensions) and entry.is_file():
+                        files.append(entry.name)
+        except OSError:
+            return None
+        old, scan = scan, (mtime_ns, sorted(files), sorted(dirs))
+        with self.lock:
+            repo['scans'][rel] = scan
+        if old is not None:
+            self._propagate(root, repo, rel, old, scan)
+        return scan
+
+    def _propagate(self, root, repo, rel, old, new):
+        """Move the counts of a rescanned directory and of all its parents up to the root by its change."""
+        # the new sub directories are counted before the lock is taken
+        delta = len(new[1]) - len(old[1]) + sum(self._count(root, repo, child_path(rel, name))
+                                                for name in new[2] if name not in old[2])
+        with self.lock:
+            counts = repo['counts']
+            for name in old[2]:
+                if name not in new[2]:
+                    removed = counts.pop(child_path(rel, name), None)
+                    # never counted, the sums above are summed again when they are read
+                    delta = None if removed is None or delta is None else delta - removed
+            while True:
+                if delta is None:
+                    counts.pop(rel, None)
+                elif rel in counts:
+                    counts[rel] += delta
+                if rel == '.':
+                    break
+                rel = os.path.dirname(rel) or '.'
+
+    def _count(self, root, repo, rel):
+        with self.lock:
+            total = repo['counts'].get(rel)
+        if total is not None:
+            return total
+        scan = self._scan(root, repo, rel)
+        total = 0
+        if scan is not None:
+            total = len(scan[1]) + sum(self._count(root, repo, child_path(rel, name))
+                                       for name in scan[2])
+        with self.lock:
+            repo['counts'][rel] = total
+        return total
+
+    def count(self, root, directory):
+        """The number of matching files under directory."""
+        return self._count(root, self._repo(root), os.path.relpath(directory, root))
+
+    def build(self, root):
+        """Scan the whole repo and sum the counts of every directory, replacing what was kept of it."""
+        repo = {'scans': {}, 'counts': {}}
+        total = self._count(root, repo, '.')
+        self._repo(root, repo)
+        return total
+
+    def list(self, root, path=None, offset=0, limit=None):
+        """
+        The entries of path (root when None), the non empty directories first, as
+        {'name', 'path', 'type', 'files'} with at most limit (page_size) entries
+        from offset. next_offset is None on the last page.
+        """
+        directory = os.path.normpath(path or root)
+        real_root = os.path.realpath(root)
+        if os.path.commonpath([real_root, os.path.realpath(directory)]) != real_root:
+            raise ValueError(f"{path} is outside of {root}")
+        repo = self._repo(root)
+        rel = os.path.relpath(directory, root)
+        scan = self._scan(root, repo, rel)
+        if scan is None:
+            raise FileNotFoundError(directory)
+
+        entries = []
+        for name in scan[2]:
+            files = self._count(root, repo, child_path(rel, name))
+            if files:
+                entries.append({'name': name, 'path': os.path.join(directory, name), 'type': 'directory', 'files': files})
+        entries += [{'name': name, 'path': os.path.join(directory, name), 'type': 'file'} for name in scan[1]]
+
+        limit = min(limit or self.page_size, self.page_size)
+        offset = max(0, offset)
+        page = entries[offset:offset + limit]
+        next_offset = offset + limit if offset + limit < len(entries) else None
+        return {'path': directory, 'entries': page, 'offset': offset, 'total': len(entries), 'next_offset': next_offset}
+
+    def stats(self):
+        with self.lock:
+            return {'repos': len(self.repos), 'directories': sum(len(repo['scans']) for repo in self.repos.values()),
+                    'hits': self.hits, 'misses': self.misses}
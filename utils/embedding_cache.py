@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_namespace(provider, model_name, encode_kwargs=None):
+    """Everything besides the text that changes the vector of a chunk."""
+    settings = json.dumps([provider, model_name, encode_kwargs or {}], sort_keys=True, default=str)
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+
+def embedding_key(namespace, text):
+    return hashlib.sha256(f"{namespace}\0{text}".encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class EmbeddingCacheStore:
+    """
+    On-disk vector cache: one float32 memory-mapped slab per dimension holds the
+    vectors, a small sqlite table maps the content keys to slab slots and keeps
+    the last access time for the LRU eviction once max_size_mb is exceeded.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=2048):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS free_slots (
+                dim INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                PRIMARY KEY (dim, slot)
+            )
+        ''')
+        self.conn.commit()
+        self.slabs = {}
+        self.next_slots = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _slab_path(self, dim):
+        return os.path.join(self.cache_dir, f'vectors_{dim}.f32')
+
+    def _slab(self, dim, min_capacity=0):
+        slab = self.slabs.get(dim)
+        if slab is not None and slab.shape[0] >= min_capacity:
+            return slab
+        path = self._slab_path(dim)
+        row_bytes = dim * 4
+        capacity = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        if capacity < min_capacity or capacity == 0:
+            capacity = max(min_capacity, capacity * 2, 1024)
+            with open(path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        if slab is not None:
+            slab.flush()
+        slab = np.memmap(path, dtype=np.float32, mode='r+', shape=(capacity, dim))
+        self.slabs[dim] = slab
+        return slab
+
+    def get_many(self, keys):
+        """Return {key: vector} for the cached keys."""
+        found = {}
+        if not keys:
+            return found
+        with self.lock:
+            rows = []
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ','.join('?' * len(part))
+                rows.extend(self.conn.execute(
+                    f'SELECT key, dim, slot FROM entries WHERE key IN ({placeholders})', part).fetchall())
+            for key, dim, slot in rows:
+                found[key] = self._slab(dim)[slot].tolist()
+            now = time.time()
+            self.conn.executemany('UPDATE entries SET last_access = ? WHERE key = ?',
+                                  [(now, key) for key in found])
+            self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store [(key, vector)] pairs, evicting the least recently used entries if needed."""
+        if not items:
+            return
+        with self.lock:
+            now = time.time()
+            for key, vector in items:
+                vector = np.asarray(vector, dtype=np.float32)
+                dim = vector.shape[0]
+                if self.conn.execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone():
+                    continue
+                slot = self._take_slot(dim)
+                self._slab(dim, slot + 1)[slot] = vector
+                self.conn.execute('INSERT INTO entries (key, dim, slot, last_access) VALUES (?, ?, ?, ?)',
+                                  (key, dim, slot, now))
+            for slab in self.slabs.values():
+                slab.flush()
+            self._evict()
+            self.conn.commit()
+
+    def _take_slot(self, dim):
+        row = self.conn.execute('SELECT slot FROM free_slots WHERE dim = ? LIMIT 1', (dim,)).fetchone()
+        if row:
+            self.conn.execute('DELETE FROM free_slots WHERE dim = ? AND slot = ?', (dim, row[0]))
+            return row[0]
+        if dim not in self.next_slots:
+            top = self.conn.execute('''
+                SELECT MAX(slot) FROM (SELECT slot FROM entries WHERE dim = ?
+                                       UNION ALL SELECT slot FROM free_slots WHERE dim = ?)
+            ''', (dim, dim)).fetchone()[0]
+            self.next_slots[dim] = 0 if top is None else top + 1
+        slot = self.next_slots[dim]
+        self.next_slots[dim] = slot + 1
+        return slot
+
+    def _size_bytes(self):
+        row = self.conn.execute('SELECT COALESCE(SUM(dim), 0) FROM entries').fetchone()
+        return row[0] * 4
+
+    def _evict(self):
+        size = self._size_bytes()
+        while size > self.max_bytes:
+            rows = self.conn.execute(
+                'SELECT key, dim, slot FROM entries ORDER BY last_access LIMIT 256').fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, dim, slot in rows:
+                victims.append((key, dim, slot))
+                size -= dim * 4
+                if size <= self.max_bytes:
+                    break
+            self.conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _, _ in victims])
+            self.conn.executemany('INSERT OR IGNORE INTO free_slots (dim, slot) VALUES (?, ?)',
+                                  [(dim, slot) for _, dim, slot in victims])
+            self.evictions += len(victims)
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            size = self._size_bytes()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': entries,
+            'size_bytes': size,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper which only computes the vectors missing from the cache store."""
+
+    def __init__(self, underlying, store, provider, model_name, encode_kwargs=None):
+        self.underlying = underlying
+        self.store = store
+        self.provider = provider
+        self.model_name = model_name
+        self.namespace = embedding_namespace(provider, model_name, encode_kwargs)
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.namespace, text) for text in texts]
+        found = self.store.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(list(computed.items()))
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        # queries keep their own namespace, some models embed them differently
+        key = embedding_key(self.namespace, 'query\0' + text)
+        found = self.store.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.underlying.embed_query(text)
+        self.store.put_many([(key, vector)])
+        return vector
+
+    def __repr__(self):
+        return f"CachedEmbeddings({self.underlying!r})"
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_cache_store(cache_dir, max_size_mb):
+    """One store per cache dir and process, shared by every wrapped model."""
+    with _stores_lock:
+        store = _stores.get(cache_dir)
+        if store is None:
+            store = _stores[cache_dir] = EmbeddingCacheStore(cache_dir, max_size_mb)
+        return store
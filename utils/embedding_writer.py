@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import logger, span
+
+# written next to the vector store files while an ingestion is running
+CHECKPOINT_NAME = 'ingest_checkpoint.json'
+
+
+def checkpoint_path(db_dir):
+    return os.path.join(db_dir, CHECKPOINT_NAME)
+
+
+def has_checkpoint(db_dir):
+    return os.path.exists(checkpoint_path(db_dir))
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def chunk_id(source, ordinal, text):
+    """Stable id of a chunk, so a resumed or repeated write upserts instead of duplicating."""
+    digest = hashlib.sha256(f"{source}\0{ordinal}\0{text}".encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()[:32]
+
+
+class BatchedVectorWriter:
+    """
+    Embed and upsert chunk batches into a vector backend. The embedding of batch N+1
+    runs on a worker thread while batch N is written, and with a checkpoint path
+    every committed batch is recorded so an interrupted ingestion skips them on
+    the next run.
+    """
+
+    def __init__(self, db, embedding_model, checkpoint=None, batch_size=None, on_progress=None, on_batch=None):
+        self.db = db
+        self.embedding_model = embedding_model
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        # on_batch(ids, texts, metadatas) sees every batch, the resumed ones included
+        self.on_batch = on_batch
+        self.source_ordinals = {}
+        self.chunks = 0
+        self.batches = 0
+        self.skipped_batches = 0
+        self.resume_from = None
+        self.resumed_chunks = 0
+
+    def _prepare(self, batch):
+        ids, texts, metadatas = [], [], []
+        for doc in batch:
+            source = doc.metadata.get('source', '')
+            ordinal = self.source_ordinals.get(source, 0)
+            self.source_ordinals[source] = ordinal + 1
+            ids.append(chunk_id(source, ordinal, doc.page_content))
+            texts.append(doc.page_content)
+            metadatas.append(doc.metadata)
+        return ids, texts, metadatas
+
+    def _embed(self, ids, texts, metadatas):
+        with span('embed'):
+            return ids, texts, metadatas, self.embedding_model.embed_documents(texts)
+
+    def _commit(self, ids, texts, metadatas, embeddings):
+        with span('upsert'):
+            self.db.upsert(ids, embeddings, metadatas, texts)
+        self.batches += 1
+        self.chunks += len(ids)
+        if self.checkpoint:
+            save_checkpoint(self.checkpoint, {'batches': self.batches, 'chunks': self.chunks,
+                                              'batch_size': self.batch_size})
+        self._report()
+
+    def _report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = (self.chunks - self.resumed_chunks) / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Indexed batch {self.batches}: {self.chunks} chunks, {rate:.1f} chunks/s")
+        if self.on_progress:
+            self.on_progress(batches=self.batches, chunks=self.chunks, chunks_per_second=rate)
+
+    def begin(self):
+        """Load or create the checkpoint, returns the number of batches to skip."""
+        if self.resume_from is not None:
+            return self.resume_from
+        self.resume_from = 0
+        if not self.checkpoint:
+            return 0
+        previous = load_checkpoint(self.checkpoint)
+        if previous and previous.get('batch_size') == self.batch_size:
+            self.batches = previous.get('batches', 0)
+            self.chunks = self.resumed_chunks = previous.get('chunks', 0)
+            logger.info(f"Resuming ingestion after {self.batches} committed batches")
+            self.resume_from = self.batches
+            return self.resume_from
+        save_checkpoint(self.checkpoint, {'batches': 0, 'chunks': 0, 'batch_size': self.batch_size})
+        return 0
+
+    def write(self, batches):
+        skip = self.begin()
+        self.started = time.perf_counter()
+        pending = None
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            for index, batch in enumerate(batches):
+                # the ids depend on the ordinals, so prepare the skipped batches as well
+                prepared = self._prepare(batch)
+                if self.on_batch:
+                    self.on_batch(*prepared)
+                if index < skip:
+                    self.skipped_batches += 1
+                    continue
+                future = pool.submit(self._embed, *prepared)
+                if pending is not None:
+                    self._commit(*pending.result())
+                pending = future
+            if pending is not None:
+                self._commit(*pending.result())
+        return {'batches': self.batches, 'chunks': self.chunks, 'skipped_batches': self.skipped_batches,
+                'seconds': round(time.perf_counter() - self.started, 3)}
+
+    def finish(self):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
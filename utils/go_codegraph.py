@@ -1,8 +1,17 @@
+import itertools
 import json
+import logging
 import os
 import subprocess
-from typing import Dict, List, Any
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Optional
 import re
+from utils.metrics import logger
+
+PARSER_PATH = './parser'
+# the -serve protocol the worker speaks, ./parser -version prints the one of the binary
+SERVE_PROTOCOL = 1
 
 
 def process_nodes(nodes: Dict[str, Any]) -> Dict[str, Any]:
@@ -11,8 +20,11 @@ def process_nodes(nodes: Dict[str, Any]) -> Dict[str, Any]:
     methods = {}
     types = {}
 
+    # the nodes carry their source code, only format them when debugging
+    debug = logger.isEnabledFor(logging.DEBUG)
     for key, node in nodes.items():
-        print(f"Processing node: {key} -> {node}")
+        if debug:
+            logger.debug(f"Processing node: {key} -> {node}")
 
         if node["Type"] == "import":
             node_data = {
@@ -75,7 +87,6 @@ def process_nodes(nodes: Dict[str, Any]) -> Dict[str, Any]:
 
     for node_key, node in nodes.items():
         for call in node["Calls"]:
-            print(f"Checking call from {node_key} to {call}")
             if call in nodes:
                 link = {
                     "from": node_key,
@@ -84,12 +95,12 @@ def process_nodes(nodes: Dict[str, Any]) -> Dict[str, Any]:
                     "color": "green"
                 }
                 linkDataArray.append(link)
-                print(f"Link added: {link}")
-            else:
-                print(f"Call {call} not found in nodes")
+                if debug:
+                    logger.debug(f"Link added: {link}")
+            elif debug:
+                logger.debug(f"Call {call} not found in nodes")
 
-    print(f"Final nodeDataArray: {nodeDataArray}")
-    print(f"Final linkDataArray: {linkDataArray}")
+    logger.debug(f"Parsed {len(nodeDataArray)} Go nodes and {len(linkDataArray)} links")
 
     return {"nodeDataArray": nodeDataArray, "linkDataArray": linkDataArray}
 
@@ -110,38 +121,194 @@ def extract_method_name(key: str) -> str:
     return key.split(".")[-1]
 
 
+class GoParserError(Exception):
+    """The parser could not parse the file, e.g. a syntax error."""
+
+
+class PendingRequest:
+    def __init__(self, process, is_directory=False):
+        self.future = Future()
+        self.process = process
+        self.is_directory = is_directory
+        self.results = []
+
+
+class GoParserWorker:
+    """
+    One long running ./parser -serve process shared by all the threads. The
+    requests are written as {"id", "path"} JSON lines and a reader thread hands
+    each result line to the request of its id, so the requests of many threads
+    are in flight at once and the parser works on them in parallel. The process
+    is started on first use and again after it died. Before the first start the
+    protocol of the binary is checked with -version, a parser built before the
+    -serve mode has none and the callers run it once per file instead.
+    """
+
+    def __init__(self, parser_path: str = PARSER_PATH, timeout: float = 30.0):
+        self.parser_path = parser_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # writes only, the reader must never wait for a blocked write
+        self.write_lock = threading.Lock()
+        self.process = None
+        self.pid = None
+        self.pending: Dict[int, PendingRequest] = {}
+        self.ids = itertools.count()
+        self.unsupported = False
+        self.protocol = None
+        self.restarts = 0
+        self.requests = 0
+
+    def _check_protocol(self):
+        try:
+            result = subprocess.run([self.parser_path, '-version'], capture_output=True, text=True, timeout=10)
+        except subprocess.TimeoutExpired as e:
+            raise ConnectionError(f"{self.parser_path} -version did not answer") from e
+        try:
+            self.protocol = int(result.stdout.strip()) if result.returncode == 0 else 0
+        except ValueError:
+            self.protocol = 0
+        if self.protocol < SERVE_PROTOCOL:
+            self.unsupported = True
+            logger.warning(f"{self.parser_path} has no -serve mode, parsing one process per file")
+
+    def _ensure_process(self):
+        if self.protocol is None:
+            self._check_protocol()
+        if self.unsupported:
+            raise ConnectionError(f"{self.parser_path} has no -serve mode, rebuild it with go build -o parser parser.go")
+        # a forked process (e.g. a process pool) starts its own worker
+        if self.process is None or self.process.poll() is not None or self.pid != os.getpid():
+            if self.process is not None:
+                self.restarts += 1
+            self.process = subprocess.Popen([self.parser_path, '-serve'], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, text=True, bufsize=1)
+            self.pid = os.getpid()
+            threading.Thread(target=self._read, args=(self.process,), daemon=True).start()
+            logger.info(f"Started the Go parser worker, pid {self.process.pid}")
+        return self.process
+
+    def _read(self, process):
+        for line in process.stdout:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Unexpected output of the Go parser: {line.strip()}")
+                continue
+            with self.lock:
+                request = self.pending.get(result.get('id'))
+                # a file is answered by one line, a directory by one per file and the done line
+                if request is not None and (result.get('done') or not request.is_directory):
+                    del self.pending[result['id']]
+            if request is None:
+                continue
+            if not result.get('done'):
+                request.results.append(result)
+            if result.get('done') or not request.is_directory:
+                request.future.set_result(request.results)
+
+        # the process is gone, nothing will answer its open requests, the next one starts a new process
+        with self.lock:
+            if process is self.process:
+                # poll() may not see the exit yet, never write to this process again
+                self.process = None
+                self.restarts += 1
+                logger.warning(f"The Go parser worker, pid {process.pid}, exited")
+            stale = [key for key, request in self.pending.items() if request.process is process]
+            requests = [self.pending.pop(key) for key in stale]
+        for request in requests:
+            request.future.set_exception(ConnectionError('The Go parser process exited'))
+
+    def _submit(self, request: Dict[str, Any], is_directory: bool = False):
+        with self.lock:
+            process = self._ensure_process()
+            request_id = next(self.ids)
+            pending = self.pending[request_id] = PendingRequest(process, is_directory)
+            self.requests += 1
+        try:
+            with self.write_lock:
+                process.stdin.write(json.dumps(dict(request, id=request_id)) + '\n')
+                process.stdin.flush()
+        except OSError as e:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise ConnectionError(f"Writing to the Go parser failed: {e}") from e
+        return request_id, pending.future
+
+    def _wait(self, request_id: int, future: Future, timeout: float):
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # a late answer finds no request and is dropped
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise
+
+    def parse(self, filepath: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """The raw nodes of one file, as ./parser <file> prints them."""
+        result = self._wait(*self._submit({'path': filepath}), timeout or self.timeout)[0]
+        if 'error' in result:
+            raise GoParserError(result['error'])
+        return result['nodes']
+
+    def parse_directory(self, directory: str, timeout: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """{path: raw nodes} of every .go file under directory, parsed concurrently by the worker."""
+        results = self._wait(*self._submit({'dir': directory}, is_directory=True), timeout or self.timeout * 10)
+        parsed = {}
+        for result in results:
+            if 'error' in result:
+                logger.warning(f"Error parsing {result['path']}: {result['error']}")
+            else:
+                parsed[result['path']] = result['nodes']
+        return parsed
+
+    def close(self):
+        with self.lock:
+            process, self.process = self.process, None
+        if process is not None and process.poll() is None:
+            process.stdin.close()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            running = self.process is not None and self.process.poll() is None
+            return {'running': running, 'pid': self.process.pid if running else None,
+                    'requests': self.requests, 'in_flight': len(self.pending), 'restarts': self.restarts,
+                    'unsupported': self.unsupported, 'protocol': self.protocol}
+
+
+go_parser = GoParserWorker()
+
+
+def run_go_parser_once(filepath: str) -> Dict[str, Any]:
+    """Run the parser binary on one file and return its raw nodes."""
+    result = subprocess.run([PARSER_PATH, filepath], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip())
+
+
+def run_go_parser(filepath: str) -> Dict[str, Any]:
+    """The raw nodes of one file from the shared parser worker, one process per file if it is not available."""
+    try:
+        return go_parser.parse(filepath)
+    except GoParserError as e:
+        # a parse error as the one shot run reports it
+        raise subprocess.CalledProcessError(1, [PARSER_PATH, filepath], stderr=str(e)) from e
+    except (OSError, TimeoutError) as e:
+        (logger.debug if go_parser.unsupported else logger.warning)(
+            f"Go parser worker unavailable, running it once for {filepath}: {e}")
+        return run_go_parser_once(filepath)
+
+
 def parse_go_code(filepath: str) -> Dict[str, Any]:
     try:
-        result = subprocess.run(['./parser', filepath], capture_output=True, text=True, check=True)
-        output = result.stdout.strip()
-        nodes = json.loads(output)
+        nodes = run_go_parser(filepath)
         return process_nodes(nodes)
     except subprocess.CalledProcessError as e:
-        print(f"Error running parser: {e.stderr}")
+        logger.error(f"Error running parser: {e.stderr}")
         return {"nodeDataArray": [], "linkDataArray": []}
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
+        logger.error(f"Error decoding JSON: {e}")
         return {"nodeDataArray": [], "linkDataArray": []}
-
-
-def go_build_file_tree(directory: str) -> List[Dict[str, Any]]:
-    file_tree = []
-    for root, dirs, files in os.walk(directory):
-        for d in dirs:
-            dir_path = os.path.join(root, d)
-            file_tree.append({
-                'name': d,
-                'path': dir_path,
-                'type': 'directory',
-                'children': go_build_file_tree(dir_path)
-            })
-        for f in files:
-            if f.endswith('.go'):
-                file_path = os.path.join(root, f)
-                file_tree.append({
-                    'name': f,
-                    'path': file_path,
-                    'type': 'file'
-                })
-        break  # Only traverse current directory, not recursively
-    return file_tree
@@ -1,32 +1,81 @@
-from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.vectorstores import Chroma
 import git
 import os
 from queue import Queue
 import shutil
 from urllib.parse import urlparse
-import configparser
-from langchain.chains import ConversationalRetrievalChain
 from langchain_core.prompts.prompt import PromptTemplate
 from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from langchain.chains import ConversationChain
-from cachetools import cached, TTLCache
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import FlashrankRerank
+from utils.index_manifest import (
+    file_sha256,
+    load_manifest,
+    save_manifest,
+    diff_manifest,
+)
+from utils.ingest_pipeline import IngestPipeline, default_workers
+from utils.code_chunker import CodeChunker
+from utils.embedding_writer import BatchedVectorWriter, checkpoint_path, has_checkpoint
+from utils.store_registry import VectorStoreRegistry, embedding_identity
+from utils.answer_cache import AnswerCache, fingerprint
+from utils.lexical_index import LexicalIndex, LexicalIndexBuilder, lexical_dir
+from utils.hybrid_retriever import HybridRetriever
+from utils.reranker import RerankerService, RerankingRetriever
+from utils.condense import QuestionCondenser
+from utils.metrics import logger, span
+from utils.config_store import ConfigStore
+from utils.repo_cache import clone_repo, is_shallow, sparse_patterns, update_mirror
+from utils.codegraph_index import open_codegraph_index
+from utils.context_packer import ContextPacker, parse_budgets
+from utils.vector_backends import open_vector_backend
 
 # read from the config.ini
 config_path = os.path.join('config', 'config.ini')
 prompt_templates_path = 'config/prompt_templates.ini'
-config = configparser.ConfigParser()
-config.read(config_path)
+# the config files stay in memory, they are reloaded when they change on disk
+config_store = ConfigStore(config_path)
+prompt_store = ConfigStore(prompt_templates_path, missing_section='qa_prompt_templates')
+config = config_store.snapshot()
 vectorstore_dir = config.get('the_project_dirs', 'vectorstore_dir')
 sessions_dir = config.get('the_project_dirs', 'sessions_dir')
 project_dir = config.get('the_project_dirs', 'project_dir')
 max_dir_depth = config.get('for_loop_dirs_depth', 'max_dir_depth')
 chunk_size = config.get('chunk_setting', 'chunk_size')
 chunk_overlap = config.get('chunk_setting', 'chunk_overlap')
+code_chunking = config.getboolean('chunk_setting', 'code_chunking', fallback=True)
 base_url = config.get('ollama_llm_models', 'base_url')
+load_workers = config.getint('ingest_setting', 'load_workers', fallback=default_workers())
+load_executor = config.get('ingest_setting', 'load_executor', fallback='thread')
+ingest_batch_size = config.getint('ingest_setting', 'batch_size', fallback=256)
+max_inflight_files = config.getint('ingest_setting', 'max_inflight_files', fallback=64)
+max_open_stores = config.getint('vectorstore_registry', 'max_stores', fallback=8)
+max_open_stores_mb = config.getfloat('vectorstore_registry', 'max_memory_mb', fallback=0)
+vector_backend = config.get('vector_backend', 'backend', fallback='chroma')
+ann_dtype = config.get('vector_backend', 'dtype', fallback='int8')
+ann_nlist = config.getint('vector_backend', 'nlist', fallback=0)
+ann_nprobe = config.getint('vector_backend', 'nprobe', fallback=0)
+hybrid_retrieval = config.getboolean('retrieval_setting', 'hybrid', fallback=True)
+retrieval_k = config.getint('retrieval_setting', 'k', fallback=3)
+retrieval_fetch_k = config.getint('retrieval_setting', 'fetch_k', fallback=20)
+rrf_k = config.getint('retrieval_setting', 'rrf_k', fallback=60)
+clone_depth = config.getint('git_setting', 'clone_depth', fallback=1)
+clone_blob_filter = config.getboolean('git_setting', 'blob_filter', fallback=True)
+clone_sparse_checkout = config.getboolean('git_setting', 'sparse_checkout', fallback=True)
+mirror_dir = config.get('git_setting', 'mirror_dir', fallback='cache_mirrors') \
+    if config.getboolean('git_setting', 'mirror_cache', fallback=True) else None
+codegraph_index_enabled = config.getboolean('codegraph_setting', 'index', fallback=True)
+codegraph_workers = config.getint('codegraph_setting', 'workers', fallback=0) or None
+context_packing = config.getboolean('context_packing', 'enabled', fallback=True)
+context_packer = ContextPacker(
+    default_budget=config.getint('context_packing', 'default_budget', fallback=3000),
+    budgets=parse_budgets(config.get('context_packing', 'model_budgets', fallback='')),
+    min_overlap=config.getint('context_packing', 'min_overlap', fallback=20),
+)
+rerank_by_default = config.getboolean('rerank_setting', 'by_default', fallback=False)
+rerank_candidate_k = config.getint('rerank_setting', 'candidate_k', fallback=30)
+rerank_top_n = config.getint('rerank_setting', 'top_n', fallback=5)
+rerank_preload = config.getboolean('rerank_setting', 'preload', fallback=True)
+answer_cache_enabled = config.getboolean('answer_cache', 'enabled', fallback=True)
+answer_cache_persist_path = config.get('answer_cache', 'persist_path', fallback='') or None
 encode_kwargs = {"normalize_embeddings": False}
 model_kwargs = {"device": "cuda:0"}  
 allowed_extensions = ['.py', '.md', '.js',
@@ -70,15 +119,50 @@ def documents_to_string(documents):
     return '\n\n'.join(doc_strings)
 
 
-def load_prompt_templates(path):
-    config = configparser.ConfigParser()
-    config.read(path)
-    return {section: dict(config.items(section)) for section in config.sections()}
+# the text of the template selected by the option of [prompt_templates]
+def selected_prompt_template(option):
+    name = config_store.snapshot().get('prompt_templates', option)
+    return prompt_store.snapshot().get('qa_prompt_templates', name)
+
+# the compiled templates are built once per template text and templates file version
+def qa_chat_prompt():
+    qa_template = selected_prompt_template('qa_selected_prompt')
+    return prompt_store.cached(('qa_chat', qa_template), lambda: ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(qa_template),
+        HumanMessagePromptTemplate.from_template("{question}")]))
+
+def code_prompt():
+    code_template = selected_prompt_template('code_selected_prompt')
+    return prompt_store.cached(('code', code_template), lambda: PromptTemplate(
+        input_variables=["input", "history"], template=code_template))
+
+answer_cache = AnswerCache(
+    maxsize=config.getint('answer_cache', 'maxsize', fallback=1000),
+    ttl=config.getint('answer_cache', 'ttl', fallback=3600),
+    persist_path=answer_cache_persist_path,
+    semantic=config.getboolean('answer_cache', 'semantic', fallback=False),
+    semantic_threshold=config.getfloat('answer_cache', 'semantic_threshold', fallback=0.95),
+)
+
+# the opened stores and retrievers, shared by all the requests
+store_registry = VectorStoreRegistry(max_stores=max_open_stores, max_memory_mb=max_open_stores_mb)
+
+# decides when the follow-up questions are rephrased with the chat history
+question_condenser = QuestionCondenser(strategy=config.get('condense_setting', 'strategy', fallback='auto'))
+
+# the reranker model stays loaded, the requests of all the chats are batched on it
+reranker_service = RerankerService(
+    model_name=config.get('rerank_setting', 'model', fallback='') or None,
+    max_batch=config.getint('rerank_setting', 'max_batch', fallback=8),
+    max_wait_ms=config.getfloat('rerank_setting', 'max_wait_ms', fallback=5),
+)
+
+class IndexBuildInProgress(Exception):
+    """The index of the repo has an unfinished build, only its ingestion job resumes it."""
 
-cache = TTLCache(maxsize=100, ttl=300)
 
 class DataHandler:
-    def __init__(self, git_url, chat_model, embedding_model) -> None:
+    def __init__(self, git_url, chat_model, embedding_model, condense_model=None) -> None:
         self.git_url = git_url
         last_part = git_url.split('/')[-1]
         self.repo_name = last_part.rsplit('.', 1)[0]
@@ -92,7 +176,16 @@ class DataHandler:
         self.download_path = os.path.join(project_dir, self.repo_name) 
         self.model = chat_model
         self.embedding_model = embedding_model     
+        # a smaller model for rephrasing the follow-up questions, the chat model if None
+        self.condense_model = condense_model
         self.ChatQueue =  Queue(maxsize=2)
+        # called with (stage, **info) while the repo is ingested
+        self.progress_callback = None
+        self.index_version = None
+
+    def report_progress(self, stage, **info):
+        if self.progress_callback:
+            self.progress_callback(stage, **info)
 
     # check the db dir exist or not
     def db_exists(self):
@@ -110,190 +203,546 @@ class DataHandler:
 
         # upload situation
         if not url_parts.scheme:
-            print("Local repository detected, skipping cloning process.")
+            logger.info("Local repository detected, skipping cloning process.")
         else:
             # git clone
             if not os.path.exists(self.download_path):
-                print(f"Cloning from Git URL: {self.git_url}")
+                self.report_progress('clone')
+                logger.info(f"Cloning from Git URL: {self.git_url}")
                 try:
-                    git.Repo.clone_from(self.git_url, self.download_path)
-                    print("Repository cloned successfully.")
+                    with span('clone'):
+                        clone_repo(self.git_url, self.download_path, depth=clone_depth,
+                                   blob_filter=clone_blob_filter,
+                                   patterns=sparse_patterns(allowed_extensions) if clone_sparse_checkout else None,
+                                   mirror_dir=mirror_dir)
+                    logger.info("Repository cloned successfully.")
                 except Exception as e:
-                    print(f"Failed to clone repository. Error: {e}")
+                    logger.error(f"Failed to clone repository. Error: {e}")
+                    # a partial clone would be taken for the repo by the next load
+                    remove_directory(self.download_path)
+                    raise
+        if not os.path.isdir(self.download_path):
+            raise FileNotFoundError(f"No repository at {self.download_path}")
 
-    # load the projects
-    def load_files(self, root_dir=None, current_depth=0, base_depth=0):
+    # the cloned/uploaded files go to the index, keep the same rule for build and refresh
+    def is_uploaded_repo(self):
+        return "UploadedRepo" in self.git_url
+
+    def is_indexable(self, filename):
+        if self.is_uploaded_repo():
+            return True  # not limit for the file extension
+        return any(filename.endswith(ext) for ext in allowed_extensions)
+
+    def iter_indexable_files(self, root_dir=None, current_depth=0, base_depth=0):
         if root_dir is None:
             root_dir = self.download_path
-        self.docs = []
-        
-        print("Loading files from:", root_dir)
-        
+
         # github projects
-        if "UploadedRepo" not in self.git_url:
-            for dirpath, _, filenames in os.walk(root_dir):
-                for filename in filenames:
-                    if any(filename.endswith(ext) for ext in allowed_extensions):
-                        file_path = os.path.join(dirpath, filename)
-                        try:
-                            loader = TextLoader(file_path, encoding='utf-8')
-                            self.docs.extend(loader.load_and_split())
-                        except Exception as e:
-                            print(f"Error loading file {file_path}: {e}")
+        if not self.is_uploaded_repo():
+            for dirpath, dirnames, filenames in os.walk(root_dir):
+                # keep a stable order, the resume checkpoints count batches
+                dirnames[:] = sorted(d for d in dirnames if d != '.git')
+                for filename in sorted(filenames):
+                    if self.is_indexable(filename):
+                        yield os.path.join(dirpath, filename)
         else:
             # sosreport project or directories upload
             if current_depth - base_depth > int(max_dir_depth):
                 return  # over the dir depth, then stop
-            
-            for entry in os.scandir(root_dir):
+
+            for entry in sorted(os.scandir(root_dir), key=lambda e: e.name):
                 if entry.is_symlink():
                     continue  # skip the soft link(should be for windows)
                 elif entry.is_dir():
                     if entry.name == 'boot':
                         base_depth = current_depth  # start from boot
-                    self.load_files(entry.path, current_depth + 1, base_depth)
+                    yield from self.iter_indexable_files(entry.path, current_depth + 1, base_depth)
                 elif entry.is_file():
-                    # not limit for the file extension
-                    try:
-                        loader = TextLoader(entry.path, encoding='utf-8')
-                        self.docs.extend(loader.load_and_split())
-                    except Exception as e:
-                        print(f"Error loading file {entry.path}: {e}")
+                    yield entry.path
+
+    # the streaming ingestion pipeline, docs and texts are generators over it
+    def new_pipeline(self):
+        splitter = CodeChunker(int(chunk_size), int(chunk_overlap), syntax_aware=code_chunking)
+        self.pipeline = IngestPipeline(splitter,
+                                       workers=load_workers,
+                                       batch_size=ingest_batch_size,
+                                       max_inflight=max_inflight_files,
+                                       executor=load_executor)
+        return self.pipeline
+
+    # load the projects
+    def load_files(self, root_dir=None, file_paths=None):
+        if root_dir is None:
+            root_dir = self.download_path
+
+        logger.info(f"Loading files from: {root_dir}")
+        self.report_progress('load')
+        pipeline = self.new_pipeline()
+        if file_paths is None:
+            file_paths = self.iter_indexable_files(root_dir)
+            # a whole repo, its Go files go to the parser in one directory request
+            pipeline.splitter.prefetch_go(root_dir)
+        self.docs = pipeline.load_documents(file_paths)
 
     # split all the files
     def split_files(self):
-        text_splitter = CharacterTextSplitter(chunk_size=int(chunk_size), chunk_overlap=int(chunk_overlap))
-        self.texts = text_splitter.split_documents(self.docs)
+        self.report_progress('split')
+        self.texts = self.pipeline.split_documents(self.docs)
 
-    # store the all file chunk into chromadb
-    def store_chroma(self):  
+    # the chunks in bounded batches
+    def iter_text_batches(self):
+        return self.pipeline.batches(self.texts)
+
+    # store the all file chunk into the vector backend, and their postings into the lexical index
+    def store_vectors(self, db=None, resumable=True, lexical_builder=None):
         if not os.path.exists(self.db_dir):
             os.makedirs(self.db_dir)
-        print("eb:", self.embedding_model)
-        db = Chroma.from_documents(self.texts, self.embedding_model, persist_directory=self.db_dir) 
-        db.persist()  
-        return db  
-        
-    # load 
-    def load_into_db(self):
-        if not os.path.exists(self.db_dir): 
-            ## Create and load
-            self.load_files()
+        logger.debug(f"Embedding model: {self.embedding_model}")
+        if lexical_builder is None:
+            lexical_builder = LexicalIndexBuilder()
+        writer = BatchedVectorWriter(db, self.embedding_model,
+                                     checkpoint=checkpoint_path(self.db_dir) if resumable else None,
+                                     batch_size=ingest_batch_size,
+                                     on_progress=self.report_embed_progress,
+                                     on_batch=lexical_builder.add_many)
+        # mark the ingestion as unfinished before the store files appear
+        writer.begin()
+        if db is None:
+            db = writer.db = self.open_store()
+        self.report_progress('embed')
+        stats = writer.write(self.iter_text_batches())
+        self.report_progress('persist')
+        with span('persist'):
+            db.persist()
+            lexical_builder.save(lexical_dir(self.db_dir))
+        writer.finish()
+        logger.info(f"Ingestion stats for {self.repo_name}: {self.pipeline.report()}, write: {stats}")
+        return db
+
+    # the postings of the chunks already in the store, for the indexes built before the lexical index
+    def lexical_builder_from_store(self, exclude_sources=(), page_size=1000):
+        exclude_sources = set(exclude_sources)
+        builder = LexicalIndexBuilder()
+        offset = 0
+        while True:
+            result = self.db.get(limit=page_size, offset=offset)
+            if not result['ids']:
+                break
+            for doc_id, text, metadata in zip(result['ids'], result['documents'], result['metadatas']):
+                source = (metadata or {}).get('source', '')
+                if source not in exclude_sources:
+                    builder.add(doc_id, text, source)
+            offset += len(result['ids'])
+        return builder
+
+    def report_embed_progress(self, **info):
+        # loading and splitting stream into the writer, report their counters too
+        self.report_progress('embed', files=self.pipeline.stats['load'].items, **info)
+
+    # the head commit of the cloned repo, None for the uploaded ones
+    def repo_head_commit(self):
+        try:
+            return git.Repo(self.download_path).head.commit.hexsha
+        except Exception:
+            return None
+
+    # fetch the remote and fast forward the clone to its tracking branch
+    def git_pull_repo(self):
+        if self.is_uploaded_repo() or not urlparse(self.git_url).scheme:
+            return None
+        try:
+            repo = git.Repo(self.download_path)
+            tracking = repo.active_branch.tracking_branch()
+            if mirror_dir:
+                # the new objects land in the shared mirror, the clone borrows them from there
+                update_mirror(mirror_dir, self.git_url)
+            # keep a shallow clone shallow
+            repo.remotes.origin.fetch(**({'depth': max(clone_depth, 1)} if is_shallow(repo) else {}))
+            if tracking is not None:
+                repo.head.reset(tracking.commit, index=True, working_tree=True)
+            return repo.head.commit.hexsha
+        except Exception as e:
+            logger.warning(f"Failed to update repository {self.download_path}. Error: {e}")
+            return self.repo_head_commit()
+
+    # the files changed between two commits, relative to the repo root
+    def git_changed_files(self, old_commit, new_commit):
+        repo = git.Repo(self.download_path)
+        output = repo.git.diff('--name-only', '--no-renames', old_commit, new_commit)
+        return [os.path.normpath(path) for path in output.splitlines() if path]
+
+    # {relative path: sha256} of every file that goes into the index
+    def scan_file_hashes(self):
+        file_hashes = {}
+        for file_path in self.iter_indexable_files():
+            try:
+                file_hashes[os.path.relpath(file_path, self.download_path)] = file_sha256(file_path)
+            except OSError as e:
+                logger.warning(f"Error hashing file {file_path}: {e}")
+        return file_hashes
+
+    # remove all the chunks which were loaded from the file
+    def delete_file_vectors(self, rel_path):
+        source = os.path.join(self.download_path, rel_path)
+        ids = self.db.get(where={"source": source})['ids']
+        if ids:
+            self.db.delete(ids)
+        return len(ids)
+
+    # build the whole index and record the manifest for the later refresh
+    def build_db(self):
+        self.load_files()
+        self.split_files()
+        self.db = self.store_vectors()
+        manifest = save_manifest(self.db_dir, self.scan_file_hashes(), commit=self.repo_head_commit(),
+                                 previous=load_manifest(self.db_dir))
+        self.index_version = manifest['version']
+        self.build_codegraph_index()
+
+    # parse the Python files into the code graph index, only the changed ones after the first time
+    def build_codegraph_index(self):
+        if not codegraph_index_enabled or not os.path.isdir(self.download_path):
+            return None
+        self.report_progress('codegraph')
+        try:
+            with span('codegraph'):
+                return open_codegraph_index(self.db_dir, self.download_path).build(workers=codegraph_workers)
+        except Exception as e:
+            logger.error(f"Error building the code graph index of {self.repo_name}: {e}")
+            return None
+
+    # re-embed only the files which changed since the last index
+    def refresh_db(self):
+        if not self.db_exists() or has_checkpoint(self.db_dir):
+            self.load_into_db(resume=True)
+            return {"added": None, "modified": None, "removed": None, "rebuilt": True}
+
+        manifest = load_manifest(self.db_dir)
+        if manifest is None:
+            # the index was built before the manifest existed, nothing to diff against
+            logger.warning(f"No index manifest in {self.db_dir}, rebuilding the index.")
+            store_registry.invalidate(self.repo_name)
+            remove_directory(self.db_dir)
+            self.load_into_db(resume=True)
+            return {"added": None, "modified": None, "removed": None, "rebuilt": True}
+
+        old_files = manifest.get('files', {})
+        old_commit = manifest.get('commit')
+        head = self.git_pull_repo()
+        if head and old_commit and head == old_commit:
+            new_files = old_files
+        elif head and old_commit:
+            # only hash the files that git reports as changed
+            new_files = dict(old_files)
+            try:
+                changed_files = self.git_changed_files(old_commit, head)
+            except Exception as e:
+                logger.warning(f"Failed to diff {old_commit}..{head}, scanning all files. Error: {e}")
+                changed_files = None
+            if changed_files is None:
+                new_files = self.scan_file_hashes()
+            else:
+                for rel_path in changed_files:
+                    file_path = os.path.join(self.download_path, rel_path)
+                    if os.path.isfile(file_path) and self.is_indexable(os.path.basename(rel_path)):
+                        new_files[rel_path] = file_sha256(file_path)
+                    else:
+                        new_files.pop(rel_path, None)
+        else:
+            new_files = self.scan_file_hashes()
+
+        added, modified, removed = diff_manifest(old_files, new_files)
+        logger.info(f"Refreshing {self.repo_name}: {len(added)} added, {len(modified)} modified, {len(removed)} removed")
+
+        self.db = self.open_store()
+        stale_sources = [os.path.join(self.download_path, p) for p in modified + removed]
+        lexical_path = lexical_dir(self.db_dir)
+        if LexicalIndex.exists(lexical_path):
+            lexical_builder = LexicalIndex(lexical_path).to_builder(exclude_sources=stale_sources)
+        else:
+            lexical_builder = self.lexical_builder_from_store(exclude_sources=stale_sources)
+        for rel_path in modified + removed:
+            self.delete_file_vectors(rel_path)
+
+        changed = added + modified
+        if changed:
+            self.load_files(file_paths=[os.path.join(self.download_path, p) for p in changed])
             self.split_files()
-            self.db = self.store_chroma()
+            self.store_vectors(self.db, resumable=False, lexical_builder=lexical_builder)
         else:
-            print("start-->chromadb")
-            # Just load the DB
-            self.db = Chroma(persist_directory=self.db_dir, embedding_function=self.embedding_model)
-            print("end-->chromadb")
-        
-        self.retriever = self.db.as_retriever()
-        self.retriever.search_kwargs['k'] = 3
-        self.retriever.search_type = 'similarity'
+            lexical_builder.save(lexical_path)
+        if changed or removed or head != old_commit:
+            manifest = save_manifest(self.db_dir, new_files, commit=head, previous=manifest)
+        self.index_version = manifest['version']
+        self.build_codegraph_index()
+
+        self.setup_retriever()
+        self.register_store()
+        return {"added": len(added), "modified": len(modified), "removed": len(removed), "rebuilt": False}
+
+    # load, resume=True only from the ingestion job, a chat must not build next to it
+    def load_into_db(self, resume=False):
+        if has_checkpoint(self.db_dir) and not resume:
+            raise IndexBuildInProgress(f"The index of {self.repo_name} is being built")
+        if not os.path.exists(self.db_dir) or has_checkpoint(self.db_dir):
+            ## Create and load, or resume an interrupted ingestion
+            self.build_db()
+            self.setup_retriever()
+            self.register_store()
+        else:
+            # Just load the DB, reuse it when another request already opened it
+            entry = store_registry.get_or_open(self.store_key(), self.open_store_and_retriever, self.db_dir)
+            self.db = entry.db
+            self.retriever = entry.retriever
+            self.index_version = entry.version
+
+    def open_store(self):
+        return open_vector_backend(self.db_dir, self.embedding_model, backend=vector_backend,
+                                   dtype=ann_dtype, nlist=ann_nlist, nprobe=ann_nprobe)
+
+    def open_store_and_retriever(self):
+        with span('store_open'):
+            self.db = self.open_store()
+            self.setup_retriever()
+        manifest = load_manifest(self.db_dir)
+        return self.db, self.retriever, manifest['version'] if manifest else 0
+
+    def setup_retriever(self):
+        lexical_path = lexical_dir(self.db_dir)
+        if hybrid_retrieval and LexicalIndex.exists(lexical_path):
+            self.retriever = HybridRetriever(vectorstore=self.db, lexical_index=LexicalIndex(lexical_path),
+                                             k=retrieval_k, fetch_k=retrieval_fetch_k, rrf_k=rrf_k)
+            return
+        self.retriever = self.db.as_retriever(k=retrieval_k)
+
+    def store_key(self):
+        return (self.repo_name, embedding_identity(self.embedding_model))
+
+    # replace the registry entries of the repo with the freshly built store
+    def register_store(self):
+        store_registry.invalidate(self.repo_name)
+        store_registry.put(self.store_key(), self.db, self.retriever, self.db_dir, self.index_version)
+
+    # the name of the chat model, part of the answer cache scope
+    def model_name(self):
+        return getattr(self.model, 'model_name', None) or getattr(self.model, 'model', None) or type(self.model).__name__
+
+    def cached_answer(self, scope, query, generate):
+        if not answer_cache_enabled:
+            return generate()
+        embed_query = getattr(self.embedding_model, 'embed_query', None)
+        answer = answer_cache.get(scope, query, embed_query)
+        if answer is None:
+            answer = generate()
+            answer_cache.put(scope, query, answer, embed_query)
+        return answer
+
+    def answer_scope(self, rsd=False, rr=False):
+        qa_template = selected_prompt_template('qa_selected_prompt')
+        provider = config_store.snapshot().get('model_providers', 'selected_provider')
+        return AnswerCache.scope_key(
+            repo=self.repo_name, index_version=self.index_version,
+            provider=provider, model=self.model_name(),
+            template=fingerprint(qa_template), history=fingerprint(list(self.ChatQueue.queue)),
+            rsd=rsd, rr=rr, context=self.context_budget(provider))
+
+    # the token budget of the context in the prompt, None when the documents go in as they are
+    def context_budget(self, provider):
+        if not context_packing:
+            return None
+        return context_packer.budget(provider, self.model_name())
+
+    # the context of the prompt: deduplicated, merged and packed into the budget of the model
+    def build_context(self, docs, provider):
+        if not context_packing:
+            if provider == 'localai':
+                return documents_to_string(docs)
+            return "\n\n".join(doc.page_content for doc in docs)
+        return context_packer.pack(docs, self.context_budget(provider), root=self.download_path)
 
-    # create a chain, send the message into llm and ouput the answer
-    @cached(cache)
     def retrieval_qa(self, query, rsd=False, rr=False):
-        config = configparser.ConfigParser()
-        config.read(config_path)
-        the_selected_provider = config.get('model_providers', 'selected_provider')
+        scope = self.answer_scope(rsd=rsd, rr=rr)
+
+        generated = []
+
+        def generate():
+            generated.append(True)
+            return self.generate_answer(query, rsd=rsd, rr=rr)
+
+        answer = self.cached_answer(scope, query, generate)
+        if not generated:
+            # served from the cache, keep the history as if it was generated
+            self.update_chat_queue((query, answer))
+        return answer
+
+    # a wider pool of candidates for the reranker
+    def candidate_retriever(self, k):
+        if isinstance(self.retriever, HybridRetriever):
+            return self.retriever.copy(update={'k': k, 'fetch_k': max(self.retriever.fetch_k, k)})
+        return self.db.as_retriever(k=k)
+
+    def qa_retriever(self, rr=False):
+        # add reranker
+        if rr:
+            return RerankingRetriever(base_retriever=self.candidate_retriever(rerank_candidate_k),
+                                      service=reranker_service, top_n=rerank_top_n)
+        return self.retriever
+
+    # create a chain, send the message into llm and ouput the answer
+    def generate_answer(self, query, rsd=False, rr=False):
+        the_selected_provider = config_store.snapshot().get('model_providers', 'selected_provider')
         chat_history = list(self.ChatQueue.queue)
 
         try:
-            templates = load_prompt_templates(prompt_templates_path)
-            qa_template_name = config.get('prompt_templates', 'qa_selected_prompt')
-            qa_template = templates['qa_prompt_templates'][qa_template_name]
+            qa_template = selected_prompt_template('qa_selected_prompt')
+            custom_prompt = qa_chat_prompt()
         except Exception as e:
-            print(f"Error reading config or templates: {e}")
+            logger.error(f"Error reading config or templates: {e}")
             raise
-
-        custom_prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(qa_template), 
-            HumanMessagePromptTemplate.from_template("{question}")])
         
         if the_selected_provider != 'localai':
-            # add reranker
-            if rr:
-                compressor = FlashrankRerank()
-                compression_retriever = ContextualCompressionRetriever(
-                    base_compressor=compressor, base_retriever=self.retriever
-                )
-                the_retriever = compression_retriever
-            else:
-                the_retriever = self.retriever
-
-                    
-            qa = ConversationalRetrievalChain.from_llm(
-                self.model, 
-                chain_type="stuff", 
-                retriever=the_retriever, 
-                condense_question_llm = self.model,
-                return_source_documents=True,
-                combine_docs_chain_kwargs={"prompt": custom_prompt})
-            
-            result = qa({"question": query, "chat_history": chat_history})
+            question, docs = self.retrieve_for_question(query, chat_history, rr)
+            messages = custom_prompt.format_messages(
+                context=self.build_context(docs, the_selected_provider), question=question)
+            with span('generate'):
+                answer = self.model.invoke(messages).content
 
-            self.update_chat_queue((query, result["answer"]))
+            self.update_chat_queue((query, answer))
 
             # add the search source documents
-            docs_strings = document_to_string(result['source_documents'][0])
-            # docs_strings = documents_to_string(result['source_documents'])
+            docs_strings = document_to_string(docs[0]) if docs else ""
+            # docs_strings = documents_to_string(docs)
 
             if rsd:
                 return docs_strings
             else:
-                return result['answer']
+                return answer
             
         elif the_selected_provider == 'localai':
-            docs = self.retriever.get_relevant_documents(query)
+            with span('retrieve'):
+                docs = self.retriever.get_relevant_documents(query)
 
-            ds2s = documents_to_string(docs)
+            context = self.build_context(docs, the_selected_provider)
 
             the_question = """   
             the question: {question}"""  
 
             # build the prompt with string
             combine_strings = qa_template + the_question
-            prompt = combine_strings.format(context=ds2s, question=query)
-            result = self.model.complete(prompt)
+            prompt = combine_strings.format(context=context, question=query)
+            with span('generate'):
+                result = self.model.complete(prompt)
             self.update_chat_queue((query, result.text))
             if rsd:
-                return ds2s
+                # the source documents with their metadata
+                return documents_to_string(docs)
             return result.text
         
         else:
             return "Wrong provider!!!"
-        
-    @cached(cache)
+
+    # condense the follow-up question when needed and retrieve its documents
+    def retrieve_for_question(self, query, chat_history, rr=False):
+        question, docs, _ = question_condenser.retrieve(
+            self.condense_model or self.model, self.qa_retriever(rr), query, chat_history)
+        return question, docs
+
+    # the metadata of the retrieved documents, sent to the client next to the answer
+    def source_metadata(self, docs):
+        return [dict(doc.metadata) for doc in docs]
+
+    def stream_retrieval_qa(self, query, rr=False):
+        """
+        Yield ("sources", [metadata]), then ("token", text) for each generated piece
+        and finally ("done", answer). Providers without streaming, and cached
+        answers, come as a single token.
+        """
+        scope = self.answer_scope(rr=rr)
+        embed_query = getattr(self.embedding_model, 'embed_query', None)
+        cached = answer_cache.get(scope, query, embed_query) if answer_cache_enabled else None
+        if cached is not None:
+            yield "sources", self.source_metadata(self.retriever.invoke(query))
+            yield "token", cached
+            self.update_chat_queue((query, cached))
+            yield "done", cached
+            return
+
+        the_selected_provider = config_store.snapshot().get('model_providers', 'selected_provider')
+        qa_template = selected_prompt_template('qa_selected_prompt')
+        chat_history = list(self.ChatQueue.queue)
+        pieces = []
+
+        if the_selected_provider != 'localai':
+            question, docs = self.retrieve_for_question(query, chat_history, rr)
+            yield "sources", self.source_metadata(docs)
+
+            messages = qa_chat_prompt().format_messages(
+                context=self.build_context(docs, the_selected_provider), question=question)
+            # chat models without native streaming yield the whole answer once
+            with span('generate'):
+                for chunk in self.model.stream(messages):
+                    if chunk.content:
+                        pieces.append(chunk.content)
+                        yield "token", chunk.content
+        else:
+            with span('retrieve'):
+                docs = self.retriever.get_relevant_documents(query)
+            yield "sources", self.source_metadata(docs)
+            the_question = """   
+            the question: {question}"""
+            prompt = (qa_template + the_question).format(
+                context=self.build_context(docs, the_selected_provider), question=query)
+            with span('generate'):
+                try:
+                    for response in self.model.stream_complete(prompt):
+                        if response.delta:
+                            pieces.append(response.delta)
+                            yield "token", response.delta
+                except NotImplementedError:
+                    text = self.model.complete(prompt).text
+                    pieces.append(text)
+                    yield "token", text
+
+        answer = "".join(pieces)
+        self.update_chat_queue((query, answer))
+        if answer_cache_enabled:
+            answer_cache.put(scope, query, answer, embed_query)
+        yield "done", answer
+
     def restrieval_qa_for_code(self, query):
-        config = configparser.ConfigParser()
-        config.read(config_path)
-        the_selected_provider = config.get('model_providers', 'selected_provider')
+        settings = config_store.snapshot()
+        templates = prompt_store.snapshot()
+        scope = AnswerCache.scope_key(
+            repo='', index_version=None,
+            provider=settings.get('model_providers', 'selected_provider'), model=self.model_name(),
+            template=fingerprint([templates.get('qa_prompt_templates', settings.get('prompt_templates', name), fallback=None)
+                                  for name in ('code_selected_prompt', 'localai_selected_prompt')]))
+        return self.cached_answer(scope, query, lambda: self.generate_code_analysis(query))
+
+    def generate_code_analysis(self, query):
+        the_selected_provider = config_store.snapshot().get('model_providers', 'selected_provider')
 
         try:
-            templates = load_prompt_templates(prompt_templates_path)
-            code_template_name = config.get('prompt_templates', 'code_selected_prompt')
-            localai_template_name = config.get('prompt_templates', 'localai_selected_prompt')
-            
-            code_template = templates['qa_prompt_templates'][code_template_name]
-            code_template_localai = templates['qa_prompt_templates'][localai_template_name]
+            code_template_localai = selected_prompt_template('localai_selected_prompt')
+            PROMPT = code_prompt()
         except Exception as e:
-            print(f"Error reading config or templates: {e}")
+            logger.error(f"Error reading config or templates: {e}")
             raise
 
         if the_selected_provider != 'localai':
-            PROMPT = PromptTemplate(input_variables=["input", "history"], template=code_template)
             # print("-->", datetime.now())
             conversation = ConversationChain(
                 prompt=PROMPT,
                 llm=self.model,
             )
             # print("-->", datetime.now())
-            code_anaylsis = conversation.predict(input=query)
+            with span('generate'):
+                code_anaylsis = conversation.predict(input=query)
             return code_anaylsis
         elif the_selected_provider == 'localai':
             prompt = code_template_localai.format(input=query)
-            result = self.model.complete(prompt)
+            with span('generate'):
+                result = self.model.complete(prompt)
             return result.text
         else:
             return "Wrong provider!!!"
\ No newline at end of file
@@ -0,0 +1,43 @@
+from typing import Any, List
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """Merge ranked id lists, an id scores sum(1 / (rrf_k + rank)) over the lists."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """Vector similarity and BM25 candidates of a vector backend, merged by reciprocal-rank fusion."""
+
+    vectorstore: Any
+    lexical_index: Any
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _vector_search(self, query):
+        embedding = self.vectorstore.embedding_function.embed_query(query)
+        docs = {}
+        for doc_id, text, metadata in self.vectorstore.query(embedding, self.fetch_k):
+            docs[doc_id] = Document(page_content=text, metadata=metadata or {})
+        return list(docs), docs
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector_ids, docs = self._vector_search(query)
+        lexical_ids = [doc_id for doc_id, _ in self.lexical_index.search(query, self.fetch_k)]
+        fused = reciprocal_rank_fusion([vector_ids, lexical_ids], self.rrf_k)[:self.k]
+
+        missing = [doc_id for doc_id in fused if doc_id not in docs]
+        if missing:
+            result = self.vectorstore.get(ids=missing)
+            for doc_id, text, metadata in zip(result['ids'], result['documents'], result['metadatas']):
+                docs[doc_id] = Document(page_content=text, metadata=metadata or {})
+        # a lexical hit whose chunk was removed from the store in the meantime is skipped
+        return [docs[doc_id] for doc_id in fused if doc_id in docs]
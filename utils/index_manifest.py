@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import time
+from utils.metrics import logger
+
+# the manifest sits next to the chroma files of each repo
+MANIFEST_NAME = 'index_manifest.json'
+
+
+def file_sha256(filepath, block_size=1 << 20):
+    """Return the sha256 hex digest of the file content."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(db_dir):
+    return os.path.join(db_dir, MANIFEST_NAME)
+
+
+def load_manifest(db_dir):
+    """Load the index manifest of a vector store, None if it was never recorded."""
+    path = manifest_path(db_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Error reading index manifest {path}: {e}")
+        return None
+
+
+def save_manifest(db_dir, files, commit=None, previous=None):
+    """Write the manifest atomically, bumping the index version of the previous one."""
+    version = (previous or {}).get('version', 0) + 1
+    manifest = {
+        'version': version,
+        'commit': commit,
+        'updated_at': time.time(),
+        'files': files,
+    }
+    os.makedirs(db_dir, exist_ok=True)
+    path = manifest_path(db_dir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def diff_manifest(old_files, new_files):
+    """Compare two {relative path: sha256} maps and return (added, modified, removed)."""
+    added = sorted(path for path in new_files if path not in old_files)
+    removed = sorted(path for path in old_files if path not in new_files)
+    modified = sorted(path for path in new_files
+                      if path in old_files and old_files[path] != new_files[path])
+    return added, modified, removed
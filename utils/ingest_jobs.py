@@ -0,0 +1,124 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import logger, set_trace_id
+
+# the stages reported by DataHandler while a repository is ingested
+INGEST_STAGES = ['queued', 'clone', 'load', 'split', 'embed', 'persist', 'codegraph', 'done']
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class IngestJob:
+    def __init__(self, repo_key, git_url, kind):
+        self.id = uuid.uuid4().hex
+        self.repo_key = repo_key
+        self.git_url = git_url
+        self.kind = kind
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    def update_stage(self, stage, **info):
+        self.stage = stage
+        self.progress.update(info)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'repo': self.repo_key,
+            'git_url': self.git_url,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class IngestJobManager:
+    """
+    Run the repository ingestions on a bounded worker pool. A repository has at
+    most one queued or running job, a second submission returns the existing one.
+    """
+
+    def __init__(self, max_concurrent=1, keep_finished=100):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent), thread_name_prefix='ingest')
+        self.keep_finished = keep_finished
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, repo_key, git_url, func, kind='load'):
+        """Queue func(job) for the repository, returns (job, created)."""
+        with self.lock:
+            job = self._active(repo_key)
+            if job is not None:
+                return job, False
+            job = IngestJob(repo_key, git_url, kind)
+            self.jobs[job.id] = job
+            self._prune()
+            job.future = self.executor.submit(self._run, job, func)
+        return job, True
+
+    def _run(self, job, func):
+        # the log lines of the ingestion carry the job id
+        set_trace_id(job.id)
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = func(job)
+            job.update_stage('done')
+            job.status = 'completed'
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} for {job.git_url} failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+    def _active(self, repo_key):
+        for job in self.jobs.values():
+            if job.repo_key == repo_key and job.status in ACTIVE_STATUSES:
+                return job
+        return None
+
+    def active(self, repo_key):
+        """The queued or running job of the repository, None when there is none."""
+        with self.lock:
+            return self._active(repo_key)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def cancel(self, job_id):
+        """Cancel a queued job, a running ingestion cannot be stopped."""
+        job = self.jobs.get(job_id)
+        if job is None or job.status != 'queued':
+            return False
+        if not job.future.cancel():
+            return False
+        job.status = 'cancelled'
+        job.finished_at = time.time()
+        return True
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.status not in ACTIVE_STATUSES]
+        for job in sorted(finished, key=lambda j: j.created_at)[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job.id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,123 @@
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from langchain_community.document_loaders import TextLoader
+from utils.metrics import logger, observe, span
+
+
+def load_file(file_path):
+    """Read and decode one file, top level so that it can run in a process pool."""
+    try:
+        loader = TextLoader(file_path, encoding='utf-8')
+        # whole files, the splitter stage decides the chunk boundaries
+        return loader.load()
+    except Exception as e:
+        logger.warning(f"Error loading file {file_path}: {e}")
+        return []
+
+
+def timed_load_file(file_path):
+    started = time.perf_counter()
+    docs = load_file(file_path)
+    return docs, time.perf_counter() - started
+
+
+class StageStats:
+    """Item counter of one pipeline stage."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.started = None
+        self.finished = None
+
+    def add(self, count=1):
+        if self.started is None:
+            self.started = time.perf_counter()
+        self.items += count
+        self.finished = time.perf_counter()
+
+    def as_dict(self, pipeline_started):
+        elapsed = (self.finished or pipeline_started) - pipeline_started
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        return {'items': self.items, 'unit': self.unit, 'seconds': round(elapsed, 3),
+                f'{self.unit}_per_second': round(rate, 2)}
+
+
+class IngestPipeline:
+    """
+    Streaming ingestion: files are read on a worker pool, split lazily and handed
+    downstream in bounded batches, so only max_inflight files and one batch of
+    chunks are held in memory at a time.
+    """
+
+    def __init__(self, splitter, workers=8, batch_size=256, max_inflight=64, executor='thread'):
+        self.splitter = splitter
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.max_inflight = max(self.workers, max_inflight)
+        self.executor = executor
+        self.started = time.perf_counter()
+        self.stats = {
+            'load': StageStats('load', 'files'),
+            'split': StageStats('split', 'chunks'),
+            'batch': StageStats('batch', 'batches'),
+        }
+
+    def _make_executor(self):
+        if self.executor == 'process':
+            # the ingestion runs on a thread of the server, a forked child could inherit a held lock
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    # stage 1: read the files on the pool, keep the input order
+    def load_documents(self, file_paths):
+        with self._make_executor() as pool:
+            pending = deque()
+            for file_path in file_paths:
+                pending.append(pool.submit(timed_load_file, file_path))
+                if len(pending) >= self.max_inflight:
+                    yield from self._drain_one(pending)
+            while pending:
+                yield from self._drain_one(pending)
+
+    def _drain_one(self, pending):
+        docs, seconds = pending.popleft().result()
+        observe('load', seconds)
+        self.stats['load'].add()
+        yield from docs
+
+    # stage 2: split the documents one by one
+    def split_documents(self, docs):
+        for doc in docs:
+            with span('split', logging.DEBUG):
+                chunks = self.splitter.split_documents([doc])
+            self.stats['split'].add(len(chunks))
+            yield from chunks
+
+    # stage 3: group the chunks for the consumers
+    def batches(self, chunks):
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= self.batch_size:
+                self.stats['batch'].add()
+                yield batch
+                batch = []
+        if batch:
+            self.stats['batch'].add()
+            yield batch
+
+    def run(self, file_paths):
+        return self.batches(self.split_documents(self.load_documents(file_paths)))
+
+    def report(self):
+        return {name: stats.as_dict(self.started) for name, stats in self.stats.items()}
+
+
+def default_workers():
+    return min(32, (os.cpu_count() or 1) + 4)
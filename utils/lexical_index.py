@@ -0,0 +1,212 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+import numpy as np
+
+# the lexical index lives in this sub directory of the repo's vector store
+LEXICAL_DIR_NAME = 'lexical'
+# written last by save(), the index is complete once it exists
+INFO_NAME = 'lexical.json'
+FORMAT_VERSION = 2
+
+WORD_RE = re.compile(r'[A-Za-z0-9_]+')
+CAMEL_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+
+
+def tokenize(text):
+    """
+    Identifier aware tokens: each identifier is kept whole (lower cased) and also
+    split on snake_case and camelCase boundaries, so "getUserName" matches the
+    queries "getUserName", "get user name" and "user_name".
+    """
+    tokens = []
+    for word in WORD_RE.findall(text):
+        lowered = word.lower()
+        tokens.append(lowered)
+        parts = [p.lower() for piece in word.split('_') if piece for p in CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def lexical_dir(db_dir):
+    return os.path.join(db_dir, LEXICAL_DIR_NAME)
+
+
+class StringTable:
+    """Strings in one memory-mapped UTF-8 blob and their offsets, a table of sorted strings can be searched."""
+
+    def __init__(self, directory, name):
+        self.data = np.load(os.path.join(directory, f'{name}_bytes.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(directory, f'{name}_offsets.npy'), mmap_mode='r')
+
+    @staticmethod
+    def arrays(name, strings):
+        """The {file name: array} of a table of strings, for LexicalIndexBuilder.save."""
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return {f'{name}_bytes.npy': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                f'{name}_offsets.npy': offsets}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _bytes(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        return self._bytes(i).decode('utf-8')
+
+    def find(self, value):
+        """The position of value, None when it is not in the table."""
+        target = value.encode('utf-8')
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._bytes(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self._bytes(low) == target else None
+
+
+class LexicalIndexBuilder:
+    """Collects the postings of the chunks in memory, save() writes the index files."""
+
+    def __init__(self):
+        self.doc_ids = []
+        self.sources = []
+        self.doc_lens = []
+        self.postings = defaultdict(list)  # term -> [(doc index, tf)]
+
+    def add(self, doc_id, text, source):
+        index = len(self.doc_ids)
+        counts = Counter(tokenize(text))
+        self.doc_ids.append(doc_id)
+        self.sources.append(source)
+        self.doc_lens.append(sum(counts.values()))
+        for term, tf in counts.items():
+            self.postings[term].append((index, min(tf, 65535)))
+
+    def add_many(self, ids, texts, metadatas):
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            self.add(doc_id, text, metadata.get('source', ''))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        # sorted by their UTF-8 bytes, the order StringTable.find searches in
+        terms = sorted(self.postings, key=lambda term: term.encode('utf-8'))
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        docs, tfs = [], []
+        for i, term in enumerate(terms):
+            entries = self.postings[term]
+            docs.extend(doc for doc, _ in entries)
+            tfs.extend(tf for _, tf in entries)
+            term_offsets[i + 1] = len(docs)
+        source_names = sorted(set(self.sources))
+        source_index = {source: i for i, source in enumerate(source_names)}
+        # write to temporary names first, the readers keep the old files mapped until the rename
+        arrays = {
+            'postings_docs.npy': np.asarray(docs, dtype=np.uint32),
+            'postings_tf.npy': np.asarray(tfs, dtype=np.uint16),
+            'term_postings.npy': term_offsets,
+            'doc_lens.npy': np.asarray(self.doc_lens, dtype=np.uint32),
+            'doc_sources.npy': np.asarray([source_index[source] for source in self.sources], dtype=np.uint32),
+        }
+        arrays.update(StringTable.arrays('terms', terms))
+        arrays.update(StringTable.arrays('doc_ids', self.doc_ids))
+        arrays.update(StringTable.arrays('sources', source_names))
+        for name, array in arrays.items():
+            with open(os.path.join(directory, name + '.tmp'), 'wb') as f:
+                np.save(f, array)
+        info = {'version': FORMAT_VERSION, 'docs': len(self.doc_ids),
+                'avgdl': sum(self.doc_lens) / len(self.doc_lens) if self.doc_lens else 0.0}
+        with open(os.path.join(directory, INFO_NAME + '.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        # the info file goes last, it marks a complete index
+        for name in list(arrays) + [INFO_NAME]:
+            os.replace(os.path.join(directory, name + '.tmp'), os.path.join(directory, name))
+        # the vocabulary of the first format, read whole into memory
+        if os.path.exists(os.path.join(directory, 'meta.json')):
+            os.remove(os.path.join(directory, 'meta.json'))
+
+
+class LexicalIndex:
+    """
+    BM25 over memory-mapped postings: for every term a contiguous slice of
+    document indexes and term frequencies. The sorted vocabulary, the chunk ids
+    and the sources are memory-mapped string tables as well, so an open index
+    only keeps the pages the queries touch.
+    """
+
+    def __init__(self, directory, k1=1.2, b=0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        with open(os.path.join(directory, INFO_NAME), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        self.avgdl = info['avgdl']
+        self.terms = StringTable(directory, 'terms')
+        self.doc_ids = StringTable(directory, 'doc_ids')
+        self.source_names = StringTable(directory, 'sources')
+        self.term_postings = self._load('term_postings.npy')
+        self.postings_docs = self._load('postings_docs.npy')
+        self.postings_tf = self._load('postings_tf.npy')
+        self.doc_lens = self._load('doc_lens.npy')
+        self.doc_sources = self._load('doc_sources.npy')
+
+    def _load(self, name):
+        return np.load(os.path.join(self.directory, name), mmap_mode='r')
+
+    @classmethod
+    def exists(cls, directory):
+        # an index of the first format (meta.json) is rebuilt like a missing one
+        return os.path.exists(os.path.join(directory, INFO_NAME))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def search(self, query, k=10):
+        """Return [(chunk id, score)] of the best k chunks."""
+        n_docs = len(self.doc_ids)
+        if not n_docs:
+            return []
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            position = self.terms.find(term)
+            if position is None:
+                continue
+            offset = int(self.term_postings[position])
+            df = int(self.term_postings[position + 1]) - offset
+            docs = self.postings_docs[offset:offset + df]
+            tf = self.postings_tf[offset:offset + df].astype(np.float32)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lens[docs] / self.avgdl)
+            # a doc appears once per term, plain fancy-index addition is safe
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        k = min(k, n_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def to_builder(self, exclude_sources=()):
+        """Rebuild the in-memory postings without the chunks of the excluded sources, for an incremental update."""
+        exclude_sources = set(exclude_sources)
+        sources = [self.source_names[int(i)] for i in self.doc_sources]
+        keep = [i for i, source in enumerate(sources) if source not in exclude_sources]
+        remap = {old: new for new, old in enumerate(keep)}
+        builder = LexicalIndexBuilder()
+        builder.doc_ids = [self.doc_ids[i] for i in keep]
+        builder.sources = [sources[i] for i in keep]
+        builder.doc_lens = [int(self.doc_lens[i]) for i in keep]
+        for position in range(len(self.terms)):
+            offset, end = int(self.term_postings[position]), int(self.term_postings[position + 1])
+            docs = self.postings_docs[offset:end]
+            tfs = self.postings_tf[offset:end]
+            entries = [(remap[int(d)], int(tf)) for d, tf in zip(docs, tfs) if int(d) in remap]
+            if entries:
+                builder.postings[self.terms[position]] = entries
+        return builder
@@ -0,0 +1,158 @@
+import gc
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from utils.metrics import logger, span
+
+
+def current_rss_bytes():
+    """The resident memory of the process, 0 where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def model_key(kind, provider, model_name, **params):
+    """The pool key of a model, the params (e.g. model_kwargs) are part of it."""
+    return (kind, provider, model_name, json.dumps(params, sort_keys=True, default=str))
+
+
+def parse_model_list(text):
+    """Parse "ollama:qwen2.5:14b, llamacpp:model.gguf" into [(provider, model)], split at the first colon."""
+    models = []
+    for item in text.split(','):
+        if ':' in item:
+            provider, model_name = item.strip().split(':', 1)
+            models.append((provider.strip(), model_name.strip()))
+    return models
+
+
+class PooledModel:
+    def __init__(self, key, model, load_seconds, size_bytes):
+        self.key = key
+        self.model = model
+        self.load_seconds = load_seconds
+        self.size_bytes = size_bytes
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.hits = 0
+        self.warm_seconds = None
+
+
+class ModelPool:
+    """
+    The chat and embedding models stay loaded per (kind, provider, model, params),
+    so switching back to a recent model does not load it again. The least
+    recently used ones are dropped once there are more than max_models or their
+    resident size, measured as the growth of the process RSS while each one
+    loaded, exceeds max_memory_mb (0 disables the memory budget). The models
+    load one at a time so that growth is the one of a single model, and the
+    active ones (set_active), which the app still holds, are never dropped.
+    """
+
+    def __init__(self, max_models=4, max_memory_mb=0):
+        self.max_models = max(1, max_models)
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # the rss growth of a load is only its model's when no other load runs
+        self.load_lock = threading.Lock()
+        self.active = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _touch(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            entry.hits += 1
+            entry.last_used = time.time()
+            self.hits += 1
+        return entry
+
+    def get_or_load(self, key, loader):
+        """Return the model of key, loader() builds it on a miss."""
+        with self.lock:
+            entry = self._touch(key)
+        if entry is not None:
+            return entry.model
+        # one loader at a time, the other requests wait for their model
+        with self.load_lock:
+            with self.lock:
+                entry = self._touch(key)
+            if entry is not None:
+                return entry.model
+            rss_before = current_rss_bytes()
+            started = time.perf_counter()
+            with span('model_load'):
+                model = loader()
+            load_seconds = time.perf_counter() - started
+            size_bytes = max(0, current_rss_bytes() - rss_before)
+            logger.info(f"Loaded {key[0]} model {key[1]}:{key[2]} in {load_seconds:.2f}s, "
+                        f"{size_bytes / (1024 * 1024):.1f} MB resident")
+            with self.lock:
+                self.misses += 1
+                self.entries[key] = PooledModel(key, model, load_seconds, size_bytes)
+                self._evict()
+            return model
+
+    def set_active(self, keys):
+        """The keys of the models the app holds on to, only the others are evicted."""
+        with self.lock:
+            self.active = set(key for key in keys if key is not None)
+            self._evict()
+
+    def _evict(self):
+        evicted = False
+        while len(self.entries) > self.max_models or (
+                self.max_bytes and sum(e.size_bytes for e in self.entries.values()) > self.max_bytes):
+            # the least recently used model that is not active, nor the one just loaded
+            candidates = [key for key in list(self.entries)[:-1] if key not in self.active]
+            if not candidates:
+                break
+            key = candidates[0]
+            del self.entries[key]
+            self.evictions += 1
+            evicted = True
+            logger.info(f"Evicted {key[0]} model {key[1]}:{key[2]}")
+        if evicted:
+            # the freed models often hold large buffers, give them back now
+            gc.collect()
+
+    def warm(self, key, loader, warmup=None):
+        """Load the model ahead of the first request, warmup(model) runs one small call through it."""
+        model = self.get_or_load(key, loader)
+        if warmup is not None:
+            started = time.perf_counter()
+            try:
+                warmup(model)
+            except Exception as e:
+                logger.warning(f"Warming {key[1]}:{key[2]} failed: {e}")
+                return model
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry.warm_seconds = time.perf_counter() - started
+        return model
+
+    def stats(self):
+        with self.lock:
+            return {
+                'models': [{'kind': key[0], 'provider': key[1], 'model': key[2], 'params': json.loads(key[3]),
+                            'load_seconds': round(entry.load_seconds, 3),
+                            'warm_seconds': round(entry.warm_seconds, 3) if entry.warm_seconds is not None else None,
+                            'resident_bytes': entry.size_bytes, 'hits': entry.hits,
+                            'loaded_at': entry.loaded_at, 'last_used': entry.last_used}
+                           for key, entry in self.entries.items()],
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'max_models': self.max_models,
+                'max_bytes': self.max_bytes,
+                'process_rss_bytes': current_rss_bytes(),
+            }
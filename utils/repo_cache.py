@@ -0,0 +1,90 @@
+import glob
+import os
+import threading
+from urllib.parse import urlparse
+import git
+
+# one lock per mirror, two jobs must not fetch into the same bare repo at once
+_mirror_locks = {}
+_mirror_locks_guard = threading.Lock()
+
+
+def _mirror_lock(path):
+    with _mirror_locks_guard:
+        return _mirror_locks.setdefault(path, threading.Lock())
+
+
+def mirror_path(mirror_dir, git_url):
+    """cache_mirrors/github.com/owner/name.git for https://github.com/owner/name(.git)."""
+    url_parts = urlparse(git_url)
+    path = url_parts.path.strip('/')
+    if path.endswith('.git'):
+        path = path[:-4]
+    return os.path.join(mirror_dir, url_parts.hostname or 'local', *path.split('/')) + '.git'
+
+
+def fork_candidates(mirror_dir, git_url):
+    """The existing mirrors of repos with the same name, likely forks sharing most objects."""
+    own = mirror_path(mirror_dir, git_url)
+    name = os.path.basename(own)
+    pattern = os.path.join(glob.escape(mirror_dir), '**', glob.escape(name))
+    return [path for path in glob.glob(pattern, recursive=True) if path != own]
+
+
+def update_mirror(mirror_dir, git_url):
+    """Create or fetch the bare mirror of git_url, returns its path."""
+    path = mirror_path(mirror_dir, git_url)
+    with _mirror_lock(path):
+        if os.path.exists(os.path.join(path, 'HEAD')):
+            git.Repo(path).git.fetch('--prune', 'origin')
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        options = ['--mirror']
+        # a fork only fetches the delta to the mirror it was forked from, and then copies the objects
+        # it borrowed (--dissociate), so pruning that mirror cannot break it
+        for candidate in fork_candidates(mirror_dir, git_url)[:1]:
+            options += [f'--reference-if-able={candidate}', '--dissociate']
+        git.Repo.clone_from(git_url, path, multi_options=options)
+        return path
+
+
+def sparse_patterns(extensions):
+    """Non-cone sparse checkout patterns of the indexable extensions, e.g. *.py."""
+    return [f'*{ext}' for ext in extensions]
+
+
+def clone_repo(git_url, dest, depth=0, blob_filter=False, patterns=None, mirror_dir=None):
+    """
+    Clone git_url into dest. With a mirror_dir the clone is made from the local
+    mirror, whose objects git hardlinks (copies across file systems) instead of
+    borrowing them through alternates, so nothing is downloaded twice, the
+    checkout survives a gc or removal of the mirror and depth/blob_filter are
+    not needed. Otherwise depth > 0 makes a shallow
+    clone and blob_filter skips the blobs until they are checked out. patterns
+    limit the working tree to the matching files.
+    """
+    options = []
+    source = git_url
+    if mirror_dir:
+        mirror = update_mirror(mirror_dir, git_url)
+        source = mirror
+    else:
+        if depth and depth > 0:
+            options.append(f'--depth={depth}')
+        if blob_filter:
+            options.append('--filter=blob:none')
+    if patterns:
+        options.append('--no-checkout')
+
+    repo = git.Repo.clone_from(source, dest, multi_options=options)
+    if mirror_dir:
+        # fetch and refresh talk to the real remote, not to the cache
+        repo.remotes.origin.set_url(git_url)
+    if patterns:
+        repo.git.sparse_checkout('set', '--no-cone', *patterns)
+        repo.git.checkout(repo.active_branch.name)
+    return repo
+
+
+def is_shallow(repo):
+    return os.path.exists(os.path.join(repo.git_dir, 'shallow'))
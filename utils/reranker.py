@@ -0,0 +1,184 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from utils.metrics import logger, observe
+
+
+class RerankerService:
+    """
+    One resident flashrank model for the whole process. The requests of all the
+    chats go through a queue drained by a single scoring thread: whatever is
+    waiting (up to max_batch, or max_wait_ms after the first request) is scored
+    together. With a cross-encoder the (query, passage) pairs of all those
+    requests go through one model call and the scores are split back per
+    request; the listwise (LLM) rankers get one rerank call per request.
+    """
+
+    def __init__(self, model_name=None, max_batch=8, max_wait_ms=5):
+        self.model_name = model_name
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.ranker = None
+        self.load_lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.metrics = {
+            'requests': 0,
+            'batches': 0,
+            'model_calls': 0,
+            'passages': 0,
+            'load_seconds': 0.0,
+            'score_seconds_total': 0.0,
+            'rerank_seconds_total': 0.0,
+            'last_rerank_seconds': 0.0,
+        }
+
+    def load(self):
+        """Load the model once, the later calls return the resident one."""
+        if self.ranker is None:
+            with self.load_lock:
+                if self.ranker is None:
+                    from flashrank import Ranker
+                    started = time.perf_counter()
+                    self.ranker = Ranker(model_name=self.model_name) if self.model_name else Ranker()
+                    self.metrics['load_seconds'] = time.perf_counter() - started
+                    logger.info(f"Loaded reranker model in {self.metrics['load_seconds']:.2f}s")
+        return self.ranker
+
+    def _ensure_worker(self):
+        with self.worker_lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._work, name='reranker', daemon=True)
+                self.worker.start()
+
+    def _work(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            batch = [request for request in batch if request[2].set_running_or_notify_cancel()]
+            model_calls = 0
+            shared = None
+            try:
+                shared = self._score_shared([(query, passages) for query, passages, _ in batch])
+            except Exception as e:
+                logger.warning(f"Batched reranking failed, scoring the requests one by one: {e}")
+            if shared is not None:
+                model_calls = 1
+                for (_, _, future), results in zip(batch, shared):
+                    future.set_result(results)
+            else:
+                for query, passages, future in batch:
+                    model_calls += 1
+                    try:
+                        future.set_result(self._score(query, passages))
+                    except Exception as e:
+                        future.set_exception(e)
+            with self.lock:
+                self.metrics['batches'] += 1
+                self.metrics['model_calls'] += model_calls
+                self.metrics['score_seconds_total'] += time.perf_counter() - started
+
+    def _score(self, query, passages):
+        from flashrank import RerankRequest
+        ranker = self.load()
+        return ranker.rerank(RerankRequest(query=query, passages=passages))
+
+    def _score_shared(self, requests):
+        """
+        The ranked passages of each (query, passages) request from one model call
+        over all their pairs, None when the ranker is no pointwise cross-encoder.
+        The scores are computed like flashrank's own rerank does.
+        """
+        ranker = self.load()
+        if getattr(ranker, 'llm_model', None) or not hasattr(ranker, 'session') or not hasattr(ranker, 'tokenizer'):
+            return None
+        pairs = [[query, passage['text']] for query, passages in requests for passage in passages]
+        if not pairs:
+            return [[] for _ in requests]
+        encoded = ranker.tokenizer.encode_batch(pairs)
+        inputs = {'input_ids': np.array([e.ids for e in encoded], dtype=np.int64),
+                  'attention_mask': np.array([e.attention_mask for e in encoded], dtype=np.int64)}
+        token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+        if np.any(token_type_ids):
+            inputs['token_type_ids'] = token_type_ids
+        logits = ranker.session.run(None, inputs)[0]
+        if logits.shape[1] == 1:
+            scores = 1 / (1 + np.exp(-logits.flatten()))
+        else:
+            exp_logits = np.exp(logits)
+            scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+
+        results = []
+        start = 0
+        for _, passages in requests:
+            ranked = [dict(passage, score=float(score))
+                      for passage, score in zip(passages, scores[start:start + len(passages)])]
+            start += len(passages)
+            ranked.sort(key=lambda passage: passage['score'], reverse=True)
+            results.append(ranked)
+        return results
+
+    def rerank(self, query, docs, top_n=5):
+        """Return the top_n documents with their scores in the metadata, best first."""
+        if not docs:
+            return []
+        started = time.perf_counter()
+        passages = [{'id': i, 'text': doc.page_content} for i, doc in enumerate(docs)]
+        future = Future()
+        self._ensure_worker()
+        self.requests.put((query, passages, future))
+        results = future.result()
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.metrics['requests'] += 1
+            self.metrics['passages'] += len(docs)
+            self.metrics['rerank_seconds_total'] += elapsed
+            self.metrics['last_rerank_seconds'] = elapsed
+        observe('rerank', elapsed)
+        logger.info(f"Reranked {len(docs)} candidates in {elapsed * 1000:.1f} ms")
+
+        reranked = []
+        for result in results[:top_n]:
+            doc = docs[result['id']]
+            metadata = dict(doc.metadata, relevance_score=float(result['score']))
+            reranked.append(Document(page_content=doc.page_content, metadata=metadata))
+        return reranked
+
+    def stats(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics['loaded'] = self.ranker is not None
+        metrics['avg_rerank_seconds'] = (metrics['rerank_seconds_total'] / metrics['requests']
+                                         if metrics['requests'] else 0.0)
+        # the requests scored per model call, above 1 when concurrent requests shared one
+        metrics['avg_batch_requests'] = (metrics['requests'] / metrics['model_calls'] if metrics['model_calls'] else 0.0)
+        return metrics
+
+
+class RerankingRetriever(BaseRetriever):
+    """Fetch a wide candidate pool from the base retriever and keep the top_n after reranking."""
+
+    base_retriever: Any
+    service: Any
+    top_n: int = 5
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        candidates = self.base_retriever.invoke(query)
+        return self.service.rerank(query, candidates, self.top_n)
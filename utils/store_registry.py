@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def embedding_identity(embedding_model):
+    """A stable name of the embedding model, part of the registry keys."""
+    namespace = getattr(embedding_model, 'namespace', None)
+    if namespace:
+        return namespace
+    name = getattr(embedding_model, 'model_name', None) or getattr(embedding_model, 'model', None)
+    return f"{type(embedding_model).__name__}:{name}"
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class StoreEntry:
+    def __init__(self, db, retriever, size_bytes, version=None):
+        self.db = db
+        self.retriever = retriever
+        self.version = version
+        self.size_bytes = size_bytes
+        self.opened_at = time.time()
+        self.hits = 0
+
+
+class VectorStoreRegistry:
+    """
+    Keep the opened vector stores and their retrievers per (repo, embedding model)
+    for the whole process. The least recently used ones are dropped once there are
+    more than max_stores or their on-disk size, used as the estimate of their
+    resident size, exceeds max_memory_mb (0 disables the size budget).
+    """
+
+    def __init__(self, max_stores=8, max_memory_mb=0):
+        self.max_stores = max(1, max_stores)
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                entry.hits += 1
+                self.hits += 1
+            return entry
+
+    def get_or_open(self, key, opener, db_dir=None):
+        """Return the entry of key, opener() -> (db, retriever, version) is called on a miss."""
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        # one opener per key, the other requests wait for its result
+        with self._key_lock(key):
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+            with self.lock:
+                self.misses += 1
+            db, retriever, version = opener()
+            return self.put(key, db, retriever, db_dir, version)
+
+    def put(self, key, db, retriever, db_dir=None, version=None):
+        entry = StoreEntry(db, retriever, directory_size(db_dir) if db_dir and self.max_bytes else 0, version)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self.entries) > 1 and (
+                len(self.entries) > self.max_stores or
+                (self.max_bytes and sum(e.size_bytes for e in self.entries.values()) > self.max_bytes)):
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, repo_name):
+        """Drop every entry of the repo, e.g. after its index was rebuilt."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == repo_name]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'stores': [{'repo': key[0], 'backend': getattr(entry.db, 'name', None),
+                            'version': entry.version, 'hits': entry.hits,
+                            'size_bytes': entry.size_bytes,
+                            'opened_at': entry.opened_at} for key, entry in self.entries.items()],
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'max_stores': self.max_stores,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,147 @@
+import os
+from typing import Any, List
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from utils.ann_index import MemmapAnnIndex
+
+BACKENDS = ('chroma', 'ann')
+# the directory of the in-process index inside the vector store directory of a repo
+ANN_INDEX_NAME = 'ann_index'
+
+
+class VectorBackend:
+    """
+    The vector store of one repo as the rest of the app uses it: upsert of
+    embedded chunks, top-k by embedding, get/delete by id or source, persist.
+    """
+
+    name = None
+
+    def __init__(self, embedding_function=None):
+        self.embedding_function = embedding_function
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        raise NotImplementedError
+
+    def query(self, embedding, k=4):
+        """[(id, document, metadata)] of the k nearest chunks, nearest first."""
+        raise NotImplementedError
+
+    def get(self, ids=None, where=None, limit=None, offset=None):
+        """{'ids', 'documents', 'metadatas'} of ids, or matching the {key: value} filter."""
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def persist(self):
+        pass
+
+    def stats(self):
+        return {'backend': self.name}
+
+    def similarity_search(self, query, k=4):
+        embedding = self.embedding_function.embed_query(query)
+        return [Document(page_content=text, metadata=metadata or {})
+                for _, text, metadata in self.query(embedding, k)]
+
+    def as_retriever(self, k=4):
+        return VectorBackendRetriever(vectorstore=self, k=k)
+
+
+class ChromaBackend(VectorBackend):
+    """A chroma collection persisted in the directory, through langchain's Chroma."""
+
+    name = 'chroma'
+
+    def __init__(self, persist_directory, embedding_function=None):
+        super().__init__(embedding_function)
+        from langchain_community.vectorstores import Chroma
+        self.store = Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        self.store._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    def query(self, embedding, k=4):
+        result = self.store._collection.query(
+            query_embeddings=[embedding], n_results=k, include=['documents', 'metadatas'])
+        return list(zip(result['ids'][0], result['documents'][0], result['metadatas'][0]))
+
+    def get(self, ids=None, where=None, limit=None, offset=None):
+        return self.store.get(ids=ids, where=where, limit=limit, offset=offset, include=['documents', 'metadatas'])
+
+    def delete(self, ids):
+        self.store.delete(ids=ids)
+
+    def persist(self):
+        self.store.persist()
+
+    def stats(self):
+        return {'backend': self.name, 'chunks': self.store._collection.count()}
+
+
+class AnnBackend(VectorBackend):
+    """The in-process IVF index over memory-mapped (optionally int8/float16) vectors."""
+
+    name = 'ann'
+
+    def __init__(self, path, embedding_function=None, dtype='int8', nlist=0, nprobe=0):
+        super().__init__(embedding_function)
+        self.index = MemmapAnnIndex(path, dtype=dtype, nlist=nlist, nprobe=nprobe)
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        self.index.add(ids, embeddings, documents, metadatas)
+
+    def query(self, embedding, k=4):
+        return [(doc_id, text, metadata) for doc_id, text, metadata, _ in self.index.search(embedding, k)]
+
+    def get(self, ids=None, where=None, limit=None, offset=None):
+        return self.index.get(ids=ids, where=where, limit=limit, offset=offset)
+
+    def delete(self, ids):
+        self.index.delete(ids)
+
+    def persist(self):
+        self.index.persist()
+
+    def stats(self):
+        stats = self.index.stats()
+        stats['backend'] = self.name
+        return stats
+
+
+class VectorBackendRetriever(BaseRetriever):
+    """The k most similar chunks of a vector backend."""
+
+    vectorstore: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.vectorstore.similarity_search(query, self.k)
+
+
+def ann_index_path(db_dir):
+    return os.path.join(db_dir, ANN_INDEX_NAME)
+
+
+def stored_backend(db_dir):
+    """The backend the store in db_dir was built with, None when there is none yet."""
+    if os.path.isdir(ann_index_path(db_dir)):
+        return 'ann'
+    if os.path.exists(os.path.join(db_dir, 'chroma.sqlite3')):
+        return 'chroma'
+    return None
+
+
+def open_vector_backend(db_dir, embedding_function, backend='chroma', dtype='int8', nlist=0, nprobe=0):
+    """
+    Open the store of db_dir with the backend it was built with, a new store
+    with backend. Switching the configured backend applies to the next rebuild.
+    """
+    backend = stored_backend(db_dir) or backend
+    if backend == 'ann':
+        return AnnBackend(ann_index_path(db_dir), embedding_function, dtype=dtype, nlist=nlist, nprobe=nprobe)
+    if backend == 'chroma':
+        return ChromaBackend(db_dir, embedding_function)
+    raise ValueError(f"Unknown vector backend {backend}, use one of {', '.join(BACKENDS)}")